@@ -0,0 +1,96 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Event loop latency under concurrent conversions (load test for convert_async).
+#
+# A heartbeat task sleeps 1 ms in a loop and records how late it wakes up, while
+# a number of Toaster conversions run concurrently: blocking convert() called
+# from a coroutine, convert_async() in threads, and in the process pool.
+#
+# Usage: python benchmarks/bench_async.py [gate_count] [concurrent] [experiments]
+#
+
+import sys
+import time
+import asyncio
+import statistics
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, Format
+from quantastica.qconvert.async_convert import AsyncConverter
+
+
+async def heartbeat(lateness, stop):
+	while not stop.is_set():
+		t0 = time.perf_counter()
+		await asyncio.sleep(0.001)
+		lateness.append(time.perf_counter() - t0 - 0.001)
+
+
+async def blocking(qobj, options):
+	return convert(Format.QOBJ, qobj, Format.TOASTER, options)
+
+
+async def run_scenario(convert_one, qobj, concurrent):
+	lateness = []
+	stop = asyncio.Event()
+	beat = asyncio.ensure_future(heartbeat(lateness, stop))
+	await asyncio.sleep(0.05)
+
+	t0 = time.perf_counter()
+	await asyncio.gather(*[convert_one(qobj, { "all_experiments": True }) for i in range(concurrent)])
+	elapsed = time.perf_counter() - t0
+
+	stop.set()
+	await beat
+
+	lateness.sort()
+	return elapsed, lateness
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	concurrent = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+	experiments = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+	qobj = rotation_qobj(gate_count // experiments, experiments=experiments)
+
+	thread_converter = AsyncConverter("thread")
+	process_converter = AsyncConverter("process")
+
+	async def warm_up():
+		# start pool workers and load gate tables before measuring
+		await process_converter.convert(Format.QOBJ, qobj, Format.TOASTER)
+
+	asyncio.run(warm_up())
+
+	scenarios = [	("blocking convert()", blocking),
+					("convert_async, threads", lambda qobj, options: thread_converter.convert(Format.QOBJ, qobj, Format.TOASTER, options)),
+					("convert_async, processes", lambda qobj, options: process_converter.convert(Format.QOBJ, qobj, Format.TOASTER, options)) ]
+
+	print("%d x %d gates (%d experiments each)" % (concurrent, gate_count, experiments))
+	for title, convert_one in scenarios:
+		elapsed, lateness = asyncio.run(run_scenario(convert_one, qobj, concurrent))
+		p99 = lateness[int(len(lateness) * 0.99)] if len(lateness) > 0 else 0
+		print("%-26s total %6.2fs   loop lateness: median %7.2f ms  p99 %7.2f ms  max %8.2f ms  (%d beats)" % (	title,
+																									elapsed,
+																									statistics.median(lateness) * 1000 if len(lateness) > 0 else 0,
+																									p99 * 1000,
+																									lateness[-1] * 1000 if len(lateness) > 0 else 0,
+																									len(lateness)))
+
+
+if __name__ == "__main__":
+	main()
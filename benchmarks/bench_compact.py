@@ -0,0 +1,75 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# "compact_qubits" option: synthetic circuit placed on scattered qubits of a
+# 27-qubit device. Prints QVM size and state vector memory of generated code
+# with and without the option, and conversion time (CPU time, best of 5,
+# includes compaction).
+#
+# Usage: python benchmarks/bench_compact.py [qubits] [depth]
+#
+
+import sys
+import time
+import random
+
+from synthetic import circuit_qobj
+
+from quantastica.qconvert import convert, Format
+
+DEVICE_QUBITS = 27
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def on_device(qobj, device_qubits, seed=0):
+	"""
+	qobj with qubits of its experiments mapped onto random qubits of device
+	"""
+	rnd = random.Random(seed)
+	for experiment in qobj["experiments"]:
+		placement = rnd.sample(range(device_qubits), experiment["header"]["n_qubits"])
+		for instruction in experiment["instructions"]:
+			if "qubits" in instruction:
+				instruction["qubits"] = [placement[qubit] for qubit in instruction["qubits"]]
+		experiment["header"]["n_qubits"] = device_qubits
+	return qobj
+
+
+def main():
+	qubits = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+	depth = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+	qobj = on_device(circuit_qobj(qubits=qubits, depth=depth, measure_density=0.05), DEVICE_QUBITS)
+	print("%d instructions on %d of %d qubits" % (len(qobj["experiments"][0]["instructions"]), qubits, DEVICE_QUBITS))
+
+	for label, qvm_qubits in [("plain", DEVICE_QUBITS), ("compact", qubits)]:
+		print("%-8s %2dq-qvm, state vector %s" % (label, qvm_qubits, "%.0f MiB" % (16 * 2 ** qvm_qubits / 2 ** 20) if qvm_qubits > 10 else "%d B" % (16 * 2 ** qvm_qubits)))
+
+	for dest_format in [Format.PYQUIL, Format.TOASTER]:
+		plain = best_time(lambda: convert(Format.QOBJ, qobj, dest_format))
+		compact = best_time(lambda: convert(Format.QOBJ, qobj, dest_format, { "compact_qubits": True }))
+		print("%-8s plain: %.3fs  compact_qubits: %.3fs" % (dest_format.name, plain, compact))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Cost of the events passed to converter hooks: memory blocks and bytes allocated for the events of one
+# experiment (counted with tracemalloc while a converter keeps every event), and time of traversal with
+# hooks which do nothing.
+#
+# Usage: python benchmarks/bench_events.py [gate_count]
+#
+
+import sys
+import gc
+import time
+import tracemalloc
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert.qconvert_qobj import QConvertQobj
+
+
+class KeepEvents(QConvertQobj):
+
+	def clear(self):
+		super().clear()
+		self.events = []
+
+	def on_qobj_instruction(self, data):
+		self.events.append(data)
+
+	def on_gate(self, data):
+		self.events.append(data)
+
+
+class Traverse(QConvertQobj):
+	pass
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+
+	# parameterless gates: matrices come from the cache, so only events are allocated
+	qobj = rotation_qobj(gate_count, gates=("h", "x", "s", "t"))
+
+	KeepEvents().convert(qobj, {})
+	gc.collect()
+
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	converter = KeepEvents()
+	converter.convert(qobj, {})
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+
+	stats = after.compare_to(before, "filename")
+	print("events: %d, allocated blocks: %d, bytes: %.1f MB" % (len(converter.events), sum(stat.count_diff for stat in stats), sum(stat.size_diff for stat in stats) / 1e6))
+	del converter
+
+	best = None
+	for i in range(3):
+		t0 = time.perf_counter()
+		Traverse().convert(qobj, {})
+		t = time.perf_counter() - t0
+		best = t if best is None else min(best, t)
+	print("traversal: %.3fs" % best)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# pyQuil conversion of tests/files/qobj_qaoa.json with instructions repeated up
+# to gate_count (gate events without params_dict and matrix, see
+# QConvertQobj.gate_event_fields). CPU time, best of 5. With --profile, prints
+# cProfile of one conversion. --package-root runs another checkout, for
+# comparison.
+#
+# Usage: python benchmarks/bench_gate_fields.py [--gates 100000] [--profile] [--package-root DIR]
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from synthetic import ROOT
+
+
+def scaled_qaoa(gate_count):
+	with open(os.path.join(ROOT, "tests", "files", "qobj_qaoa.json")) as file:
+		qobj = json.load(file)
+
+	experiment = qobj["experiments"][0]
+	instructions = experiment["instructions"]
+	experiment["instructions"] = [instructions[index % len(instructions)] for index in range(gate_count)]
+	qobj["experiments"] = [experiment]
+	return qobj
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--gates", type=int, default=100000)
+	parser.add_argument("--profile", action="store_true")
+	parser.add_argument("--package-root", default=None)
+	args = parser.parse_args()
+
+	if args.package_root is not None:
+		sys.path.insert(0, os.path.abspath(args.package_root))
+
+	from quantastica.qconvert import convert, Format
+
+	qobj = scaled_qaoa(args.gates)
+	convert(Format.QOBJ, qobj, Format.PYQUIL)
+
+	best = None
+	for i in range(5):
+		t0 = time.process_time()
+		convert(Format.QOBJ, qobj, Format.PYQUIL)
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	print("%d gates: %.3fs (%.2f us/gate)" % (args.gates, best, best / args.gates * 1e6))
+
+	if args.profile:
+		import cProfile
+		import pstats
+
+		profile = cProfile.Profile()
+		profile.runcall(convert, Format.QOBJ, qobj, Format.PYQUIL)
+		pstats.Stats(profile).sort_stats("tottime").print_stats(8)
+
+
+if __name__ == "__main__":
+	main()
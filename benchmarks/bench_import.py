@@ -0,0 +1,61 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Cold-start benchmark: each measurement is the wall time of a fresh interpreter.
+#
+# Usage: python benchmarks/bench_import.py [repeat]
+#
+
+import os
+import sys
+import subprocess
+import statistics
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = [
+	("python startup", "pass"),
+	("import qconvert", "from quantastica import qconvert"),
+	("import + load gate table (marshal)", "from quantastica import qconvert; qconvert.supported_gates()"),
+	("import + load gate table (json)", "from quantastica.qconvert import gate_table; gate_table.load_gate_defs(compiled_path=None)"),
+]
+
+
+def run_once(code):
+	t0 = time.perf_counter()
+	subprocess.check_call([sys.executable, "-c", code], cwd=ROOT)
+	return time.perf_counter() - t0
+
+
+def main():
+	repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+	from quantastica.qconvert import gate_table
+	gate_table.write_compiled_gate_defs()
+
+	#
+	# Warm up (writes .pyc files)
+	#
+	for title, code in SCENARIOS:
+		run_once(code)
+
+	for title, code in SCENARIOS:
+		samples = [run_once(code) for i in range(repeat)]
+		print("%-40s median %7.2f ms   min %7.2f ms" % (title, statistics.median(samples) * 1000, min(samples) * 1000))
+
+
+if __name__ == "__main__":
+	main()
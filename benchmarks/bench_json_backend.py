@@ -0,0 +1,93 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# End-to-end conversion of large Qobj held as JSON bytes or file: stdlib
+# json.loads() + convert() of dict, vs convert() of bytes / path (parsed with
+# fastest installed backend, output unchanged), and with "json_backend":
+# "auto" (Toaster serialized with it too). CPU time, best of 5.
+#
+# Usage: python benchmarks/bench_json_backend.py [experiments] [depth]
+#
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+from synthetic import circuit_qobj
+
+from quantastica.qconvert import convert, Format
+from quantastica.qconvert import json_backend
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	experiment_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	depth = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+	qobj = circuit_qobj(qubits=8, depth=depth, experiments=experiment_count, conditional_density=0.1, measure_density=0.05)
+	data = json.dumps(qobj).encode("utf-8")
+	options = { "all_experiments": True }
+	backend_options = { "all_experiments": True, "json_backend": "auto" }
+
+	print("Qobj: %d experiments, %.1f MB JSON, backends installed: %s (auto: %s)" % (	experiment_count,
+																					len(data) / 1e6,
+																					", ".join(json_backend.available_backends()),
+																					json_backend.resolve_backend("auto")))
+
+	print("parse      json.loads %.3fs   json_backend.loads %.3fs" % (	best_time(lambda: json.loads(data)),
+																		best_time(lambda: json_backend.loads(data))))
+
+	fd, path = tempfile.mkstemp(suffix=".json")
+	try:
+		with os.fdopen(fd, "wb") as file:
+			file.write(data)
+
+		def stdlib_file(dest_format):
+			with open(path) as file:
+				return convert(Format.QOBJ, json.load(file), dest_format, options)
+
+		for dest_format in [Format.PYQUIL, Format.TOASTER]:
+			expected = convert(Format.QOBJ, json.loads(data), dest_format, options)
+			assert convert(Format.QOBJ, data, dest_format, options) == expected
+			assert convert(Format.QOBJ, path, dest_format, options) == expected
+
+			stdlib = best_time(lambda: convert(Format.QOBJ, json.loads(data), dest_format, options))
+			from_bytes = best_time(lambda: convert(Format.QOBJ, data, dest_format, options))
+			stdlib_path = best_time(lambda: stdlib_file(dest_format))
+			from_path = best_time(lambda: convert(Format.QOBJ, path, dest_format, options))
+			print("%-8s bytes: json.loads + convert %.3fs   convert(bytes) %.3fs (%.2fx)" % (dest_format.name, stdlib, from_bytes, stdlib / from_bytes))
+			print("%-8s path:  json.load + convert  %.3fs   convert(path)  %.3fs (%.2fx)" % ("", stdlib_path, from_path, stdlib_path / from_path))
+
+			if dest_format == Format.TOASTER:
+				results = convert(Format.QOBJ, data, dest_format, backend_options)
+				assert [json.loads(result) for result in results] == [json.loads(result) for result in expected]
+				backend = best_time(lambda: convert(Format.QOBJ, data, dest_format, backend_options))
+				print("%-8s bytes, json_backend auto:          %.3fs (%.2fx)" % ("", backend, stdlib / backend))
+	finally:
+		os.remove(path)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,61 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Converting one Qobj to pyQuil and Toaster: two convert() calls vs. convert_multi(), plus the cost of the
+# shared stage (building ExperimentIR and evaluating its matrices). CPU time, best of 7.
+#
+# Usage: python benchmarks/bench_multi.py [gate_count]
+#
+
+import sys
+import time
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, convert_multi, Format, ExperimentIR
+
+
+def best_time(function, repeat=7):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+	qobj = rotation_qobj(gate_count, gates=("h", "x", "rz", "cx"))
+	for instruction in qobj["experiments"][0]["instructions"]:
+		if instruction["name"] == "cx":
+			instruction["qubits"] = [0, 1]
+		if instruction["name"] == "rz":
+			instruction["params"] = [0.25]
+
+	formats = [Format.PYQUIL, Format.TOASTER]
+	for title, options in [("default", {}), ("intern_matrices", { "intern_matrices": True })]:
+		separate = best_time(lambda: [convert(Format.QOBJ, qobj, dest_format, options) for dest_format in formats])
+		multi = best_time(lambda: convert_multi(Format.QOBJ, qobj, formats, options))
+		print("%-16s two convert(): %.3fs  convert_multi(): %.3fs" % (title, separate, multi))
+
+	experiment = qobj["experiments"][0]
+	print("ExperimentIR build: %.3fs" % best_time(lambda: ExperimentIR(experiment)))
+	print("ExperimentIR build + matrices: %.3fs" % best_time(lambda: ExperimentIR(experiment).matrices({})))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,57 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Multi-experiment Qobj conversion with 1/2/4/8 workers.
+# Pools are warmed up by one conversion before measuring.
+#
+# Usage: python benchmarks/bench_parallel.py [experiments] [gates_per_experiment]
+#
+
+import os
+import sys
+import time
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, Format
+
+
+def measure(qobj, dest_format, workers):
+	options = { "all_experiments": True, "workers": workers }
+	convert(Format.QOBJ, qobj, dest_format, options)
+
+	t0 = time.perf_counter()
+	convert(Format.QOBJ, qobj, dest_format, options)
+	return time.perf_counter() - t0
+
+
+def main():
+	experiments = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	gates = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+	print("CPUs: %d, experiments: %d, gates per experiment: %d" % (os.cpu_count(), experiments, gates))
+
+	qobj = rotation_qobj(gates, experiments=experiments)
+
+	for dest_format in [Format.PYQUIL, Format.TOASTER]:
+		base = None
+		for workers in [1, 2, 4, 8]:
+			t = measure(qobj, dest_format, workers)
+			if base is None:
+				base = t
+			print("%-16s workers: %d   %8.3f s   speedup %.2fx" % (dest_format.name, workers, t, base / t))
+
+
+if __name__ == "__main__":
+	main()
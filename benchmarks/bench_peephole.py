@@ -0,0 +1,68 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# "peephole" option on benchmark suite circuits: instruction count before and
+# after optimization, and conversion time without and with the option (CPU
+# time, best of 5, includes the optimization pass).
+#
+# Usage: python benchmarks/bench_peephole.py [depth]
+#
+
+import os
+import sys
+import json
+import time
+
+from synthetic import ROOT, circuit_qobj
+
+from quantastica.qconvert import convert, Format
+from quantastica.qconvert.peephole import optimize_instructions
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	depth = int(sys.argv[1]) if len(sys.argv) > 1 else 1600
+
+	with open(os.path.join(ROOT, "tests", "files", "qobj_qaoa.json")) as file:
+		qaoa = json.load(file)
+
+	cases = [	("default mix", circuit_qobj(qubits=8, depth=depth)),
+				("rotations", circuit_qobj(qubits=8, depth=depth, gate_mix={ "rx": 1, "ry": 1, "rz": 1, "u3": 1 })),
+				("u1 u2 u3 cx", circuit_qobj(qubits=4, depth=depth, gate_mix={ "u1": 2, "u2": 2, "u3": 1, "cx": 2 })),
+				("conditional 0.5", circuit_qobj(qubits=8, depth=depth, conditional_density=0.5)),
+				("qaoa", qaoa) ]
+
+	print("%-16s %9s %9s %7s   %-8s %9s %9s" % ("case", "gates", "after", "", "format", "plain", "peephole"))
+	for case_name, qobj in cases:
+		instructions = qobj["experiments"][0]["instructions"]
+		optimized = optimize_instructions(instructions)
+		reduction = 1 - len(optimized) / len(instructions)
+
+		for dest_format in [Format.PYQUIL, Format.TOASTER]:
+			plain = best_time(lambda: convert(Format.QOBJ, qobj, dest_format))
+			peephole = best_time(lambda: convert(Format.QOBJ, qobj, dest_format, { "peephole": True }))
+			print("%-16s %9d %9d %6.1f%%   %-8s %8.3fs %8.3fs" % (case_name, len(instructions), len(optimized), 100 * reduction, dest_format.name, plain, peephole))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# pyQuil emission of tests/files/qobj_qaoa.json scaled up (instructions repeated). CPU time, best of 5.
+#
+# Usage: python benchmarks/bench_pyquil_plans.py [repeat]
+#
+
+import os
+import sys
+import json
+import time
+
+from synthetic import ROOT
+
+from quantastica.qconvert import convert, Format
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+	with open(os.path.join(ROOT, "tests", "files", "qobj_qaoa.json")) as file:
+		qobj = json.load(file)
+
+	experiment = qobj["experiments"][0]
+	experiment["instructions"] = experiment["instructions"] * repeat
+
+	gate_count = len(experiment["instructions"])
+	t = best_time(lambda: convert(Format.QOBJ, qobj, Format.PYQUIL, {}))
+	print("%d instructions: %.3fs (%.2f us/instruction)" % (gate_count, t, t / gate_count * 1e6))
+
+
+if __name__ == "__main__":
+	main()
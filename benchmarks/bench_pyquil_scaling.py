@@ -0,0 +1,56 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# pyQuil code generation time from 1k to 1M gates. With linear emission the time per gate stays flat.
+#
+# Usage: python benchmarks/bench_pyquil_scaling.py [max_gates]
+#
+
+import io
+import sys
+import time
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, Format
+
+
+def measure(qobj, options):
+	t0 = time.perf_counter()
+	convert(Format.QOBJ, qobj, Format.PYQUIL, options)
+	return time.perf_counter() - t0
+
+
+def main():
+	max_gates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+	gate_count = 1000
+	base = None
+	while gate_count <= max_gates:
+		qobj = rotation_qobj(gate_count, gates=("h", "cx", "rz", "u3"))
+		for instruction in qobj["experiments"][0]["instructions"]:
+			if instruction["name"] == "cx":
+				instruction["qubits"] = [0, 1]
+
+		t = measure(qobj, {})
+		t_stream = measure(qobj, { "output_stream": io.StringIO() })
+		per_gate = t / gate_count * 1e6
+		if base is None:
+			base = per_gate
+		print("%8d gates   %8.3f s   %6.2f us/gate (%.2fx of 1k)   output_stream: %8.3f s" % (gate_count, t, per_gate, per_gate / base, t_stream))
+		gate_count *= 10
+
+
+if __name__ == "__main__":
+	main()
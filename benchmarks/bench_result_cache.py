@@ -0,0 +1,62 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Repeated conversion of the same experiments: no cache vs. "result_cache" hit in memory and on disk
+# (fresh ResultCache with the same directory, as in a new process). CPU time, best of 5.
+#
+# Usage: python benchmarks/bench_result_cache.py [gate_count] [experiments]
+#
+
+import sys
+import time
+import tempfile
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, Format, ResultCache
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	experiments = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+	qobj = rotation_qobj(gate_count, experiments=experiments)
+
+	with tempfile.TemporaryDirectory() as directory:
+		for dest_format in [Format.PYQUIL, Format.TOASTER]:
+			base_options = { "all_experiments": True }
+			uncached = best_time(lambda: convert(Format.QOBJ, qobj, dest_format, base_options))
+
+			memory_options = dict(base_options, result_cache=ResultCache())
+			convert(Format.QOBJ, qobj, dest_format, memory_options)
+			memory = best_time(lambda: convert(Format.QOBJ, qobj, dest_format, memory_options))
+
+			convert(Format.QOBJ, qobj, dest_format, dict(base_options, result_cache=ResultCache(directory=directory)))
+			disk = best_time(lambda: convert(Format.QOBJ, qobj, dest_format, dict(base_options, result_cache=ResultCache(directory=directory))))
+
+			print("%-16s no cache: %.3fs  memory hit: %.3fs  disk hit: %.3fs" % (dest_format.name, uncached, memory, disk))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,71 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Peak memory and time of converting a large Qobj file: json.load + convert() vs. convert_stream().
+# Each measurement runs in a fresh process. Converted results are discarded in both cases.
+#
+# Usage: python benchmarks/bench_stream.py [size_mb] [path]
+#
+
+import os
+import sys
+import subprocess
+import tempfile
+
+from synthetic import ROOT, write_large_qobj
+
+LOAD_ALL = """
+import json, resource, time, sys
+from quantastica.qconvert import convert, Format
+t0 = time.perf_counter()
+with open(sys.argv[1]) as f:
+	qobj = json.load(f)
+count = len(convert(Format.QOBJ, qobj, Format.TOASTER, { "all_experiments": True }))
+print(count, time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+STREAM = """
+import resource, time, sys
+from quantastica.qconvert import convert_stream, Format
+t0 = time.perf_counter()
+count = 0
+for result in convert_stream(Format.QOBJ, sys.argv[1], Format.TOASTER):
+	count += 1
+print(count, time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(code, path):
+	out = subprocess.check_output([sys.executable, "-c", code, path], cwd=ROOT)
+	count, seconds, maxrss_kb = out.decode().split()
+	return int(count), float(seconds), int(maxrss_kb) / 1024.0
+
+
+def main():
+	size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+	path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), "qconvert_bench_%dmb.json" % size_mb)
+
+	if not os.path.exists(path):
+		print("Writing %s ..." % path)
+		write_large_qobj(path, size_mb * 1024 * 1024)
+
+	print("Qobj: %s (%.0f MB)" % (path, os.path.getsize(path) / 1024.0 / 1024.0))
+
+	for title, code in [("convert_stream()", STREAM), ("json.load + convert()", LOAD_ALL)]:
+		count, seconds, peak_mb = run(code, path)
+		print("%-24s experiments: %d   %8.2f s   peak RSS %8.1f MB" % (title, count, seconds, peak_mb))
+
+
+if __name__ == "__main__":
+	main()
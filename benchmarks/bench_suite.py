@@ -0,0 +1,217 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Benchmark suite: synthetic circuits (circuit_qobj) converted to PYQUIL and TOASTER.
+#
+# Each case is a point on a scaling curve (depth, qubits, conditional density,
+# measure density, experiment count). For each case and format: wall time (best
+# of --repeat), gates/s and peak memory allocated during conversion
+# (tracemalloc, separate run). Runs offline: pyQuil and Qiskit are not needed.
+#
+# Results are saved as JSON. With --compare, times are compared to results of a
+# previous run (e.g. other version) and cases slower by more than --threshold
+# are reported.
+#
+# Usage: python benchmarks/bench_suite.py [--quick] [--output results.json] [--compare baseline.json]
+#        python benchmarks/bench_suite.py --package-root ../other-checkout --output baseline.json
+#
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import subprocess
+
+from synthetic import ROOT, circuit_qobj
+
+
+def suite_cases(scale):
+	"""
+	Returns list of (case name, circuit_qobj kwargs). scale multiplies depth
+	"""
+	cases = []
+
+	for depth in [100, 400, 1600, 6400]:
+		cases.append(("depth-%d" % depth, { "qubits": 8, "depth": depth * scale }))
+
+	for qubits in [4, 16, 64]:
+		cases.append(("qubits-%d" % qubits, { "qubits": qubits, "depth": 400 * scale // max(1, qubits // 8) }))
+
+	for density in [0.1, 0.5]:
+		cases.append(("conditional-%g" % density, { "qubits": 8, "depth": 400 * scale, "conditional_density": density }))
+
+	for density in [0.1, 0.5]:
+		cases.append(("measure-%g" % density, { "qubits": 8, "depth": 400 * scale, "measure_density": density }))
+
+	cases.append(("rotations", { "qubits": 8, "depth": 400 * scale, "gate_mix": { "rx": 1, "ry": 1, "rz": 1, "u3": 1 } }))
+
+	cases.append(("experiments-16", { "qubits": 8, "depth": 50 * scale, "experiments": 16 }))
+
+	return cases
+
+
+def gate_count(qobj):
+	return sum(len(experiment["instructions"]) for experiment in qobj["experiments"])
+
+
+def clear_caches(qconvert):
+	# versions before matrix cache don't have it
+	if hasattr(qconvert, "matrix_cache"):
+		qconvert.matrix_cache.clear()
+
+
+def run_case(qconvert, qobj, dest_format, repeat):
+	options = { "all_experiments": True }
+
+	#
+	# Time: best of repeat, matrix cache cleared before each run so every run does the same work
+	#
+	best = None
+	for i in range(repeat):
+		clear_caches(qconvert)
+		t0 = time.perf_counter()
+		qconvert.convert(qconvert.Format.QOBJ, qobj, dest_format, options)
+		t = time.perf_counter() - t0
+		best = t if best is None else min(best, t)
+
+	#
+	# Memory: peak of allocations during one conversion
+	#
+	clear_caches(qconvert)
+	tracemalloc.start()
+	qconvert.convert(qconvert.Format.QOBJ, qobj, dest_format, options)
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return best, peak
+
+
+def peak_rss():
+	try:
+		import resource
+	except ImportError:
+		return None
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_revision(root):
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results, baseline_path, threshold):
+	with open(baseline_path) as file:
+		baseline = json.load(file)
+
+	baseline_times = {}
+	for result in baseline["results"]:
+		baseline_times[(result["case"], result["format"])] = result
+
+	regressions = 0
+	print()
+	print("%-20s %-8s %10s %10s %8s" % ("case", "format", "baseline", "now", "ratio"))
+	for result in results:
+		old = baseline_times.get((result["case"], result["format"]))
+		if old is None:
+			continue
+
+		ratio = result["wall_s"] / old["wall_s"] if old["wall_s"] > 0 else 0
+		mark = ""
+		if ratio > 1 + threshold:
+			mark = "  SLOWER"
+			regressions += 1
+		elif ratio < 1 - threshold:
+			mark = "  faster"
+		print("%-20s %-8s %9.4fs %9.4fs %7.2fx%s" % (result["case"], result["format"], old["wall_s"], result["wall_s"], ratio, mark))
+
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="qconvert benchmark suite")
+	parser.add_argument("--quick", action="store_true", help="small circuits (for checking that the suite runs)")
+	parser.add_argument("--scale", type=int, default=1, help="depth multiplier (default: 1)")
+	parser.add_argument("--repeat", type=int, default=5, help="timed runs per case, best is reported")
+	parser.add_argument("--filter", default=None, help="run only cases whose name contains this string")
+	parser.add_argument("--output", default=None, help="write results to this JSON file")
+	parser.add_argument("--compare", default=None, help="compare with results JSON of a previous run")
+	parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as regression (default 0.1)")
+	parser.add_argument("--package-root", default=None, help="benchmark quantastica.qconvert from this checkout (default: this one)")
+	args = parser.parse_args()
+
+	package_root = ROOT
+	if args.package_root is not None:
+		package_root = os.path.abspath(args.package_root)
+		sys.path.insert(0, package_root)
+
+	from quantastica import qconvert
+
+	scale = args.scale
+
+	results = []
+	print("%-20s %-8s %9s %10s %12s %10s" % ("case", "format", "gates", "wall", "gates/s", "peak MB"))
+	for case_name, params in suite_cases(scale):
+		if args.filter is not None and args.filter not in case_name:
+			continue
+
+		if args.quick:
+			params = dict(params, depth=max(1, params["depth"] // 10))
+
+		qobj = circuit_qobj(**params)
+		gates = gate_count(qobj)
+
+		for dest_format in [qconvert.Format.PYQUIL, qconvert.Format.TOASTER]:
+			wall, peak = run_case(qconvert, qobj, dest_format, args.repeat)
+			results.append({	"case": case_name,
+								"format": dest_format.name,
+								"params": params,
+								"gates": gates,
+								"wall_s": wall,
+								"gates_per_s": gates / wall if wall > 0 else None,
+								"peak_bytes": peak })
+			print("%-20s %-8s %9d %9.4fs %12.0f %10.1f" % (case_name, dest_format.name, gates, wall, gates / wall, peak / (1 << 20)))
+
+	if args.output is not None:
+		meta = {	"revision": git_revision(package_root),
+					"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+					"python": platform.python_version(),
+					"platform": platform.platform(),
+					"cpu_count": os.cpu_count(),
+					"quick": args.quick,
+					"scale": scale,
+					"repeat": args.repeat,
+					"peak_rss_bytes": peak_rss() }
+
+		with open(args.output, "w") as file:
+			json.dump({ "meta": meta, "results": results }, file, indent=1)
+		print("Results written to " + args.output)
+
+	if args.compare is not None:
+		regressions = compare(results, args.compare, args.threshold)
+		if regressions > 0:
+			print("%d case(s) slower than baseline by more than %d%%" % (regressions, args.threshold * 100))
+			return 1
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
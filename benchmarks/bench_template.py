@@ -0,0 +1,96 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Parameter sweep: one circuit structure, many sets of param values. Full
+# conversion of each bound experiment vs. convert_template() once and bind()
+# per set, and Qobj with all bound experiments converted with and without
+# "parameter_templates" option. CPU time; outputs are checked to be equal.
+#
+# Usage: python benchmarks/bench_template.py [bindings] [depth]
+#
+
+import sys
+import time
+import random
+
+from synthetic import circuit_qobj
+
+from quantastica.qconvert import convert, convert_template, Format, matrix_cache
+from quantastica.qconvert.template import experiment_params
+
+GATE_MIX = { "h": 1, "cx": 2, "rx": 2, "rz": 2, "u3": 1 }
+
+
+def bound_experiment(experiment, values):
+	"""
+	Copy of experiment with numeric gate params replaced by values
+	"""
+	values = iter(values)
+	instructions = []
+	for instruction in experiment["instructions"]:
+		if "params" in instruction and instruction["name"] not in ("bfunc", "measure", "barrier"):
+			instruction = dict(instruction, params=[next(values) if type(param) in (int, float) else param for param in instruction["params"]])
+		instructions.append(instruction)
+	return dict(experiment, instructions=instructions)
+
+
+def main():
+	bindings = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	depth = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+	qobj = circuit_qobj(qubits=8, depth=depth, gate_mix=GATE_MIX, measure_density=0.05)
+	experiment = qobj["experiments"][0]
+	param_count = len(experiment_params(experiment))
+
+	rnd = random.Random(1)
+	value_sets = [[rnd.uniform(-3.14, 3.14) for i in range(param_count)] for j in range(bindings)]
+	experiments = [bound_experiment(experiment, values) for values in value_sets]
+
+	print("%d bindings of %d instructions, %d params" % (bindings, len(experiment["instructions"]), param_count))
+
+	for dest_format in [Format.PYQUIL, Format.TOASTER]:
+		matrix_cache.clear()
+		t0 = time.process_time()
+		full = [convert(Format.QOBJ, { "experiments": [bound] }, dest_format) for bound in experiments]
+		full_time = time.process_time() - t0
+
+		matrix_cache.clear()
+		t0 = time.process_time()
+		template = convert_template(Format.QOBJ, qobj, dest_format)
+		bound = [template.bind(values) for values in value_sets]
+		template_time = time.process_time() - t0
+
+		assert bound == full
+
+		sweep = { "experiments": experiments }
+
+		matrix_cache.clear()
+		t0 = time.process_time()
+		results = convert(Format.QOBJ, sweep, dest_format, { "all_experiments": True, "parameter_templates": True })
+		option_time = time.process_time() - t0
+
+		assert results == full
+
+		print("%-8s full: %.3fs (%.2fms each)  template + bind: %.3fs (%.2fms each, %.1fx)  parameter_templates: %.3fs (%.1fx)" % (	dest_format.name,
+																																	full_time,
+																																	1000 * full_time / bindings,
+																																	template_time,
+																																	1000 * template_time / bindings,
+																																	full_time / template_time,
+																																	option_time,
+																																	full_time / option_time))
+
+
+if __name__ == "__main__":
+	main()
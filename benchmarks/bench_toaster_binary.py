@@ -0,0 +1,85 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Binary Toaster encoding vs JSON: output size (plain and gzip), encoding of
+# Toaster dict (json.dumps vs encode_toaster), decoding (json.loads vs
+# decode_toaster) and whole conversion with and without "toaster_binary"
+# option. CPU time, best of 5. Encoded dict shares matrices between gates as
+# converter's does; encode_toaster() of json.loads() output can't, so it
+# stores each gate's matrix (larger output).
+#
+# Usage: python benchmarks/bench_toaster_binary.py [depth]
+#
+
+import sys
+import gzip
+import json
+import time
+
+from synthetic import circuit_qobj, rotation_qobj
+
+from quantastica.qconvert import convert, Format
+from quantastica.qconvert.toaster_binary import encode_toaster, decode_toaster
+
+
+def best_time(function, repeat=5):
+	best = None
+	for i in range(repeat):
+		t0 = time.process_time()
+		function()
+		t = time.process_time() - t0
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	depth = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+	cases = [	("default mix", circuit_qobj(qubits=8, depth=depth)),
+				("rotations", rotation_qobj(depth * 8)),
+				("conditional 0.3", circuit_qobj(qubits=8, depth=depth, conditional_density=0.3, measure_density=0.05)) ]
+
+	for case_name, qobj in cases:
+		text = convert(Format.QOBJ, qobj, Format.TOASTER)
+		data = convert(Format.QOBJ, qobj, Format.TOASTER, { "toaster_binary": True })
+
+		#
+		# Decoded dict shares matrices between gates, as converter's dict does (matrix cache)
+		#
+		toaster = decode_toaster(data)
+		assert toaster == json.loads(text)
+		assert encode_toaster(toaster) == data
+
+		print("%s: %d gates" % (case_name, len(toaster["program"])))
+		print("  size       JSON %9d B (gzip %8d B)   binary %9d B (gzip %8d B)   %.1fx smaller" % (	len(text),
+																										len(gzip.compress(text.encode("utf-8"))),
+																										len(data),
+																										len(gzip.compress(data)),
+																										len(text) / len(data)))
+
+		json_encode = best_time(lambda: json.dumps(toaster))
+		binary_encode = best_time(lambda: encode_toaster(toaster))
+		print("  encode     json.dumps %.3fs   encode_toaster %.3fs" % (json_encode, binary_encode))
+
+		json_decode = best_time(lambda: json.loads(text))
+		binary_decode = best_time(lambda: decode_toaster(data))
+		print("  decode     json.loads %.3fs   decode_toaster %.3fs" % (json_decode, binary_decode))
+
+		json_convert = best_time(lambda: convert(Format.QOBJ, qobj, Format.TOASTER))
+		binary_convert = best_time(lambda: convert(Format.QOBJ, qobj, Format.TOASTER, { "toaster_binary": True }))
+		print("  convert    JSON %.3fs   toaster_binary %.3fs" % (json_convert, binary_convert))
+
+
+if __name__ == "__main__":
+	main()
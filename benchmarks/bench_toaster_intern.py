@@ -0,0 +1,80 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Toaster output size and conversion time with and without "intern_matrices", for a deep QAOA-like circuit
+# (layers of h, cx chain, rz and rx, with one angle per layer), and time to read the output back.
+#
+# Usage: python benchmarks/bench_toaster_intern.py [layers] [qubits]
+#
+
+import sys
+import time
+import json
+
+from synthetic import ROOT
+
+from quantastica.qconvert import convert, Format, expand_toaster_matrices
+
+
+def layered_qobj(layers, qubits):
+	instructions = []
+	for layer in range(layers):
+		gamma = 0.1 + 0.01 * layer
+		beta = 0.2 + 0.01 * layer
+		for qubit in range(qubits):
+			instructions.append({ "name": "h", "qubits": [qubit] })
+		for qubit in range(qubits - 1):
+			instructions.append({ "name": "cx", "qubits": [qubit, qubit + 1] })
+		for qubit in range(qubits):
+			instructions.append({ "name": "rz", "qubits": [qubit], "params": [gamma] })
+		for qubit in range(qubits):
+			instructions.append({ "name": "rx", "qubits": [qubit], "params": [beta] })
+
+	instructions.append({ "name": "measure", "qubits": list(range(qubits)), "memory": list(range(qubits)) })
+
+	header = {	"n_qubits": qubits,
+				"memory_slots": qubits,
+				"creg_sizes": [["c", qubits]] }
+
+	return { "experiments": [{ "header": header, "instructions": instructions }] }
+
+
+def main():
+	layers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	qubits = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+	qobj = layered_qobj(layers, qubits)
+	print("gates: %d" % len(qobj["experiments"][0]["instructions"]))
+
+	outputs = {}
+	for title, options in [("plain", {}), ("intern_matrices", { "intern_matrices": True })]:
+		t0 = time.perf_counter()
+		output = convert(Format.QOBJ, qobj, Format.TOASTER, options)
+		t = time.perf_counter() - t0
+
+		t0 = time.perf_counter()
+		json.loads(output)
+		t_load = time.perf_counter() - t0
+
+		outputs[title] = output
+		print("%-16s %12d chars  convert %.3fs  json.loads %.3fs" % (title, len(output), t, t_load))
+
+	t0 = time.perf_counter()
+	expanded = expand_toaster_matrices(json.loads(outputs["intern_matrices"]))
+	t = time.perf_counter() - t0
+	print("expand_toaster_matrices (dict) %.3fs, identical: %s" % (t, json.dumps(expanded) == outputs["plain"]))
+
+
+if __name__ == "__main__":
+	main()
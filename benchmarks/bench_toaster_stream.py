@@ -0,0 +1,67 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Memory used by Toaster conversion on top of the input Qobj: json.dumps of whole program vs. output_stream.
+# Output is written to a sink which only counts characters. Each mode runs in a fresh process, memory is
+# peak RSS after conversion minus peak RSS after the input Qobj was generated.
+#
+# Usage: python benchmarks/bench_toaster_stream.py [gate_count]
+#
+
+import sys
+import subprocess
+
+from synthetic import ROOT
+
+MEASURE = """
+import sys, time, resource
+sys.path.insert(0, "benchmarks")
+from synthetic import rotation_qobj
+from quantastica.qconvert import convert, Format
+
+class CountingSink:
+	def __init__(self):
+		self.chars = 0
+
+	def write(self, text):
+		self.chars += len(text)
+
+qobj = rotation_qobj(int(sys.argv[1]), gates=("h", "rz", "u3", "x"))
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+t0 = time.perf_counter()
+if sys.argv[2] == "stream":
+	sink = CountingSink()
+	convert(Format.QOBJ, qobj, Format.TOASTER, { "output_stream": sink })
+	chars = sink.chars
+else:
+	chars = len(convert(Format.QOBJ, qobj, Format.TOASTER))
+t = time.perf_counter() - t0
+
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(t, (after - before) / 1024.0, chars)
+"""
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+	for title, mode in [("json.dumps", "dumps"), ("output_stream", "stream")]:
+		out = subprocess.check_output([sys.executable, "-c", MEASURE, str(gate_count), mode], cwd=ROOT)
+		t, extra_mb, chars = out.decode().split()
+		print("%-16s %8.2f s   extra peak RSS %8.1f MB   output %s chars" % (title, float(t), float(extra_mb), chars))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,58 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Toaster conversion of rotation-heavy circuit: scalar vs. vectorized (NumPy) matrix evaluation.
+#
+# Usage: python benchmarks/bench_vectorize.py [gate_count]
+#
+
+import sys
+import time
+
+from synthetic import rotation_qobj
+
+from quantastica.qconvert import convert, Format, matrix_cache
+from quantastica.qconvert.qobj_to_toaster import QobjToToaster
+from quantastica.qconvert import numpy_batch
+
+
+class TraversalOnly(QobjToToaster):
+	# skip json.dumps, measure traversal + matrix evaluation only
+	def on_end(self, data):
+		pass
+
+
+def measure(qobj, options):
+	matrix_cache.clear()
+	converter = TraversalOnly()
+	t0 = time.perf_counter()
+	converter.convert(qobj, options)
+	return time.perf_counter() - t0
+
+
+def main():
+	gate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+	if not numpy_batch.numpy_available():
+		print("NumPy is not installed, vectorized mode falls back to scalar evaluation.")
+
+	qobj = rotation_qobj(gate_count)
+
+	for title, options in [("scalar", {}), ("vectorized", { "vectorize": True })]:
+		t = measure(qobj, options)
+		print("%-12s %8.3f s   %10.0f gates/s" % (title, t, gate_count / t))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,80 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Per-request latency of one process per call vs. long-running worker (worker.py).
+#
+# The same requests (random circuits, each different) are sent one at a time:
+# to a new "python -m quantastica.qconvert.worker" process per request, and to
+# one worker process over its stdin/stdout. Latency is wall time from writing
+# the request to reading the response.
+#
+# Usage: python benchmarks/bench_worker.py [requests] [depth]
+#
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+from synthetic import ROOT, circuit_qobj
+
+WORKER = [sys.executable, "-m", "quantastica.qconvert.worker", "--quiet"]
+
+
+def report(name, latencies):
+	latencies = sorted(latencies)
+	print("%-20s mean %8.2fms  p50 %8.2fms  p99 %8.2fms" % (	name,
+																1000 * statistics.mean(latencies),
+																1000 * latencies[len(latencies) // 2],
+																1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]))
+
+
+def main():
+	request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	depth = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+	env = dict(os.environ, PYTHONPATH=ROOT)
+
+	for dest_format in ["pyquil", "toaster"]:
+		lines = []
+		for index in range(request_count):
+			request = { "id": index, "dest_format": dest_format, "qobj": circuit_qobj(qubits=8, depth=depth, seed=index) }
+			lines.append(json.dumps(request) + "\n")
+
+		latencies = []
+		for line in lines:
+			t0 = time.perf_counter()
+			output = subprocess.run(WORKER, input=line, capture_output=True, text=True, env=env, check=True).stdout
+			latencies.append(time.perf_counter() - t0)
+			assert "result" in json.loads(output)
+		report(dest_format + " per call", latencies)
+
+		worker = subprocess.Popen(WORKER, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+		latencies = []
+		for line in lines:
+			t0 = time.perf_counter()
+			worker.stdin.write(line)
+			worker.stdin.flush()
+			response = json.loads(worker.stdout.readline())
+			latencies.append(time.perf_counter() - t0)
+			assert "result" in response
+		worker.stdin.close()
+		worker.wait()
+		report(dest_format + " worker", latencies)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,159 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Synthetic Qobj generators for benchmarks
+#
+
+import os
+import sys
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rotation_qobj(gate_count, qubits=8, gates=("rx", "ry", "rz", "u3"), seed=0, experiments=1):
+	rnd = random.Random(seed)
+
+	return { "experiments": [rotation_experiment(gate_count, qubits, gates, rnd) for i in range(experiments)] }
+
+
+def rotation_experiment(gate_count, qubits, gates, rnd):
+	param_count = { "rx": 1, "ry": 1, "rz": 1, "u1": 1, "u2": 2, "u3": 3 }
+
+	instructions = []
+	for i in range(gate_count):
+		name = gates[i % len(gates)]
+		instructions.append({	"name": name,
+								"qubits": [rnd.randrange(qubits)],
+								"params": [rnd.uniform(-3.14, 3.14) for p in range(param_count.get(name, 0))] })
+
+	instructions.append({ "name": "measure", "qubits": list(range(qubits)), "memory": list(range(qubits)) })
+
+	header = {	"n_qubits": qubits,
+				"memory_slots": qubits,
+				"creg_sizes": [["c", qubits]] }
+
+	return { "header": header, "instructions": instructions }
+
+
+def write_large_qobj(path, target_bytes, gates_per_experiment=20000, qubits=8, seed=0):
+	"""
+	Write Qobj with as many rotation experiments as needed to reach target_bytes, one experiment at a time
+	"""
+	import json
+
+	rnd = random.Random(seed)
+
+	written = 0
+	count = 0
+	with open(path, "w") as file:
+		file.write('{"qobj_id": "synthetic", "type": "QASM", "schema_version": "1.1.0", "experiments": [')
+		while written < target_bytes:
+			text = json.dumps(rotation_experiment(gates_per_experiment, qubits, ("rx", "ry", "rz", "u3"), rnd))
+			if count > 0:
+				file.write(", ")
+			file.write(text)
+			written += len(text)
+			count += 1
+		file.write('], "config": {"shots": 1024}}')
+
+	return count
+
+
+#
+# Random circuits with configurable shape (used by bench_suite.py)
+#
+
+DEFAULT_GATE_MIX = { "h": 2, "x": 1, "cx": 3, "rz": 2, "u3": 1 }
+
+
+def gate_shapes(gate_names):
+	"""
+	Returns { name: (qubit count, param count) } taken from gate_defs.json of this checkout (read directly, so the
+	same circuits are generated when other version of the package is benchmarked)
+	"""
+	import json
+
+	with open(os.path.join(ROOT, "quantastica", "qconvert", "gate_defs.json"), encoding="utf-8") as file:
+		gate_defs = json.load(file)
+
+	shapes = {}
+	for name in gate_names:
+		gate_def = gate_defs[name]
+		qubit_count = max(1, len(gate_def.get("matrix", [[1], [1]])).bit_length() - 1)
+		shapes[name] = (qubit_count, len(gate_def.get("params", [])))
+	return shapes
+
+
+def circuit_qobj(qubits=8, depth=100, gate_mix=None, conditional_density=0.0, measure_density=0.0, experiments=1, seed=0):
+	"""
+	Qobj with random layered circuits. In each of depth layers, gates are drawn from gate_mix ({ name: weight })
+	until no qubits are left. Each gate is conditional (preceded by bfunc on a 1-bit register) with probability
+	conditional_density, and each qubit is measured at the end of a layer with probability measure_density.
+	"""
+	if gate_mix is None:
+		gate_mix = DEFAULT_GATE_MIX
+
+	shapes = gate_shapes(gate_mix)
+	names = [name for name in gate_mix if shapes[name][0] <= qubits]
+	weights = [gate_mix[name] for name in names]
+
+	rnd = random.Random(seed)
+
+	return { "experiments": [circuit_experiment(qubits, depth, names, weights, shapes, conditional_density, measure_density, rnd) for i in range(experiments)] }
+
+
+def circuit_experiment(qubits, depth, names, weights, shapes, conditional_density, measure_density, rnd):
+	instructions = []
+	register = 0
+
+	for layer in range(depth):
+		free = list(range(qubits))
+		rnd.shuffle(free)
+
+		while len(free) > 0:
+			name = rnd.choices(names, weights)[0]
+			qubit_count, param_count = shapes[name]
+			if qubit_count > len(free):
+				break
+
+			gate = {	"name": name,
+						"qubits": [free.pop() for q in range(qubit_count)],
+						"params": [rnd.uniform(-3.14, 3.14) for p in range(param_count)] }
+
+			if conditional_density > 0 and rnd.random() < conditional_density:
+				bit = rnd.randrange(qubits)
+				instructions.append({	"name": "bfunc",
+										"mask": hex(1 << bit),
+										"relation": "==",
+										"val": hex(rnd.randrange(2) << bit),
+										"register": register })
+				gate["conditional"] = register
+				register += 1
+
+			instructions.append(gate)
+
+		if measure_density > 0:
+			for qubit in range(qubits):
+				if rnd.random() < measure_density:
+					instructions.append({ "name": "measure", "qubits": [qubit], "memory": [qubit] })
+
+	instructions.append({ "name": "measure", "qubits": list(range(qubits)), "memory": list(range(qubits)) })
+
+	header = {	"n_qubits": qubits,
+				"memory_slots": qubits,
+				"creg_sizes": [["c" + str(qubit), 1] for qubit in range(qubits)] }
+
+	return { "header": header, "instructions": instructions }
@@ -14,5 +14,17 @@
 from .convert import convert
 from .convert import supported_gates
 from .convert import Format
+from .convert import convert_file
+from .convert import convert_stream
+from .convert import convert_multi
+from .convert import convert_async
+from .convert import iter_convert_async
+from .convert import convert_template
+from .ir import ExperimentIR
 from .qobj_to_pyquil import qobj_to_pyquil
 from .qobj_to_toaster import qobj_to_toaster
+from .qobj_to_toaster import expand_toaster_matrices
+from .toaster_binary import encode_toaster, decode_toaster
+from .qconvert_base import matrix_cache
+from .result_cache import ResultCache
+from .compact import qubit_map
@@ -0,0 +1,253 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# asyncio API (convert_async() and iter_convert_async() in convert.py).
+# Conversions run in an executor, one job per experiment, so the event loop is
+# not blocked and gets control back between experiments.
+#
+# Executor is "process" (shared pool from parallel.py, default), "thread"
+# (loop's default thread pool) or any concurrent.futures.Executor. In threads,
+# conversion competes with the loop for the GIL, and the loop stalls for the
+# whole json.dumps of a large Toaster program: use processes for latency.
+#
+# Cancelling the awaiting task stops the conversion before the next
+# experiment. The experiment being converted is finished in the executor (a
+# job which didn't start yet is cancelled) and its result is dropped.
+#
+# With "stats" option, each experiment is profiled in the executor and the
+# reports are merged (times and counts summed, peak memory is maximum).
+# "result_cache" is used in this process, around the executor jobs, so cached
+# results are shared with convert() also when converting in processes.
+#
+
+import os
+import asyncio
+import weakref
+from concurrent.futures.process import BrokenProcessPool
+
+from .convert import converter_class, load_source
+from . import json_backend
+from . import qobj_stream
+from . import compact
+from . import stats
+
+
+def convert_experiment(source_format, dest_format, experiment, options, profile=False):
+	"""
+	Executor job: convert one experiment. If profile, returns (result, stats report).
+	"""
+	if profile:
+		options = dict(options)
+		options["stats"] = {}
+
+	converter = converter_class(source_format, dest_format)()
+	result = converter.convert({ "experiments": [experiment] }, options)
+
+	if profile:
+		return result, options["stats"]
+	return result
+
+
+class AsyncConverter:
+	"""
+	Converts in executor ("process", "thread" or Executor instance), with at most max_concurrency conversions
+	in flight (None: no limit). max_workers is size of the process pool for "process".
+	"""
+
+	def __init__(self, executor="process", max_workers=None, max_concurrency=None):
+		self.executor = executor
+		self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+		self.max_concurrency = max_concurrency
+		self.semaphores = weakref.WeakKeyDictionary()
+
+	def get_semaphore(self):
+		"""
+		Semaphore of the running loop (asyncio primitives are bound to the loop which first uses them)
+		"""
+		if self.max_concurrency is None:
+			return None
+
+		loop = asyncio.get_running_loop()
+		semaphore = self.semaphores.get(loop)
+		if semaphore is None:
+			semaphore = asyncio.Semaphore(self.max_concurrency)
+			self.semaphores[loop] = semaphore
+		return semaphore
+
+	def get_executor(self, source_format, dest_format, options):
+		"""
+		Returns executor for run_in_executor (None is loop's default thread pool)
+		"""
+		if self.executor == "thread":
+			return None
+
+		if self.executor == "process":
+			from . import parallel
+
+			#
+			# Options which can't be sent to other process (e.g. output_stream): convert in thread
+			#
+			if not parallel.can_run_in_pool(converter_class(source_format, dest_format), options):
+				return None
+			return parallel.get_pool(self.max_workers)
+
+		return self.executor
+
+	async def convert(self, source_format, source_dict, dest_format, options=dict()):
+		"""
+		Same as convert(), but awaitable
+		"""
+		all_experiments = options is not None and "all_experiments" in options and options["all_experiments"]
+
+		results = []
+		async for result in self.iter_convert(source_format, source_dict, dest_format, options):
+			results.append(result)
+
+		if len(results) > 0 and not all_experiments:
+			return results[0]
+
+		return results
+
+	async def iter_convert(self, source_format, source, dest_format, options=dict()):
+		"""
+		Async iterator over converted experiments. source is Qobj dict or JSON (str or bytes), or path or file
+		object (read incrementally, see convert_file()).
+		"""
+		if options is None:
+			options = {}
+
+		all_experiments = "all_experiments" in options and options["all_experiments"]
+
+		job_options = dict(options)
+		job_options["all_experiments"] = False
+		job_options.pop("workers", None)
+		job_options.pop("qubit_maps", None)
+
+		#
+		# Each job is profiled in the executor, reports are merged into "stats" dict
+		#
+		report = None
+		if stats.stats_requested(options):
+			report = options["stats"]
+			report.clear()
+		job_options.pop("stats", None)
+
+		loop = asyncio.get_running_loop()
+		executor = self.get_executor(source_format, dest_format, job_options)
+
+		#
+		# JSON in memory is parsed in thread at once, experiments from file are read in thread one by one
+		#
+		stream = None
+		if isinstance(source, dict):
+			experiments = iter(source["experiments"] if "experiments" in source else [])
+		elif json_backend.is_json_source(source):
+			source = await loop.run_in_executor(None, load_source, source, options)
+			experiments = iter(source["experiments"] if "experiments" in source else [])
+		else:
+			stream = qobj_stream.iter_experiments(source)
+			experiments = stream
+
+		#
+		# Results are cached here, not in executor jobs (cache of a pool process would be lost to this one)
+		#
+		cache = None
+		if "result_cache" in options:
+			from . import result_cache
+			cache = result_cache.get_result_cache(options)
+		job_options.pop("result_cache", None)
+
+		semaphore = self.get_semaphore()
+		job_class = converter_class(source_format, dest_format)
+
+		read = None
+		try:
+			while True:
+				if stream is not None:
+					#
+					# Shielded, so if the task is cancelled the read can be waited for before the stream is closed
+					#
+					read = loop.run_in_executor(None, next, stream, None)
+					experiment = await asyncio.shield(read)
+				else:
+					experiment = next(experiments, None)
+
+				if experiment is None:
+					break
+
+				compact.record_qubit_map(options, experiment)
+
+				key = None
+				result = None
+				if cache is not None:
+					key = result_cache.result_key(job_class, experiment, options)
+					if key is not None:
+						result = await self.cache_call(loop, cache, cache.get, key)
+
+				if result is None:
+					job = (source_format, dest_format, experiment, job_options, report is not None)
+					try:
+						result = await self.run_job(loop, executor, semaphore, job)
+					except BrokenProcessPool:
+						#
+						# Worker of shared pool died: replace the pool and try once more
+						#
+						if self.executor != "process" or executor is None:
+							raise
+						from . import parallel
+						parallel.evict_pool(self.max_workers, executor)
+						executor = self.get_executor(source_format, dest_format, job_options)
+						result = await self.run_job(loop, executor, semaphore, job)
+
+					if report is not None:
+						result, job_report = result
+						stats.merge_report(report, job_report)
+
+					if key is not None:
+						await self.cache_call(loop, cache, cache.put, key, result)
+
+				yield result
+
+				if not all_experiments:
+					break
+		finally:
+			if stream is not None:
+				# generator can't be closed while next() runs in thread
+				if read is not None and not read.done():
+					await asyncio.wait([read])
+				stream.close()
+
+	async def run_job(self, loop, executor, semaphore, job):
+		"""
+		Converts experiment in executor, holding semaphore (if any) only while the job runs
+		"""
+		if semaphore is None:
+			return await loop.run_in_executor(executor, convert_experiment, *job)
+
+		async with semaphore:
+			return await loop.run_in_executor(executor, convert_experiment, *job)
+
+	async def cache_call(self, loop, cache, method, *args):
+		"""
+		Calls result cache method, in thread if cache has directory (so file I/O doesn't block the loop)
+		"""
+		if cache.directory is None:
+			return method(*args)
+		return await loop.run_in_executor(None, method, *args)
+
+
+#
+# Used by convert.convert_async() and convert.iter_convert_async()
+#
+async_converter = AsyncConverter()
@@ -0,0 +1,435 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# qconvert command line tool: converts Qobj files (plain or gzip) in a process pool.
+#
+# Inputs are files, glob patterns or directories (searched recursively for
+# *.json and *.json.gz). Output is written next to each input or into the
+# output directory. A manifest (input path -> size, mtime, SHA-256, settings)
+# is kept, so unchanged inputs are skipped when the command is run again.
+#
+# Usage: qconvert [-h] -f {pyquil,toaster} [options] inputs...
+#
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import argparse
+import tempfile
+
+from .convert import Format, converter_class
+from .gate_table import gate_defs_version
+from . import qobj_stream
+
+OUTPUT_EXTENSIONS = { "pyquil": ".py", "toaster": ".toaster.json" }
+
+#
+# Toaster output with "toaster_binary" option
+#
+BINARY_TOASTER_EXTENSION = ".toaster.qtb"
+
+INPUT_EXTENSIONS = (".json", ".json.gz")
+
+MANIFEST_NAME = ".qconvert-manifest.json"
+
+MANIFEST_VERSION = 1
+
+
+def input_stem(path):
+	name = os.path.basename(path)
+	if name.endswith(".gz"):
+		name = name[:-3]
+	if name.endswith(".json"):
+		name = name[:-5]
+	return name
+
+
+def is_input_file(name):
+	if name.startswith("."):
+		return False
+
+	#
+	# Outputs written next to inputs are not inputs
+	#
+	if name.endswith(OUTPUT_EXTENSIONS["toaster"]) or name.endswith(OUTPUT_EXTENSIONS["toaster"] + ".gz"):
+		return False
+
+	return name.endswith(INPUT_EXTENSIONS)
+
+
+def find_inputs(patterns):
+	"""
+	Returns list of (input path, path relative to the directory or pattern it was found in)
+	"""
+	inputs = []
+	seen = set()
+
+	def add(path, relative_path):
+		path = os.path.abspath(path)
+		if path not in seen:
+			seen.add(path)
+			inputs.append((path, relative_path))
+
+	for pattern in patterns:
+		if os.path.isdir(pattern):
+			for dir_path, dir_names, file_names in os.walk(pattern):
+				dir_names[:] = sorted(dir_name for dir_name in dir_names if not dir_name.startswith("."))
+				for file_name in sorted(file_names):
+					if is_input_file(file_name):
+						path = os.path.join(dir_path, file_name)
+						add(path, os.path.relpath(path, pattern))
+		elif os.path.isfile(pattern):
+			add(pattern, os.path.basename(pattern))
+		else:
+			paths = sorted(glob.glob(pattern, recursive=True))
+			if len(paths) == 0:
+				raise Exception("No input files match \"" + pattern + "\".")
+			base = glob_base(pattern)
+			for path in paths:
+				if os.path.isfile(path):
+					add(path, os.path.relpath(path, base))
+
+	return inputs
+
+
+def glob_base(pattern):
+	"""
+	Directory part of glob pattern before the first component with wildcards
+	"""
+	parts = []
+	for part in os.path.dirname(pattern).split(os.sep):
+		if glob.has_magic(part):
+			break
+		parts.append(part)
+	return os.sep.join(parts) or os.curdir
+
+
+def check_outputs(inputs, settings):
+	"""
+	Raises if two inputs would be written to the same output file
+	"""
+	outputs = {}
+	for input_path, relative_path in inputs:
+		path = output_path(input_path, relative_path, 0, settings)
+		if path in outputs:
+			raise Exception("\"" + outputs[path] + "\" and \"" + input_path + "\" would be written to the same output \"" + path + "\".")
+		outputs[path] = input_path
+
+
+def output_path(input_path, relative_path, index, settings):
+	"""
+	Output file for converted experiment with given index
+	"""
+	if settings["output_dir"] is not None:
+		base = os.path.join(settings["output_dir"], os.path.dirname(relative_path), input_stem(input_path))
+	else:
+		base = os.path.join(os.path.dirname(input_path), input_stem(input_path))
+
+	extension = OUTPUT_EXTENSIONS[settings["format"]]
+	if settings["format"] == "toaster" and settings["options"].get("toaster_binary"):
+		extension = BINARY_TOASTER_EXTENSION
+	if settings["gzip"]:
+		extension += ".gz"
+
+	if not settings["all_experiments"]:
+		return base + extension
+
+	return base + "_" + str(index) + extension
+
+
+def write_output(path, text, compress):
+	#
+	# Written to temporary file and renamed, so interrupted run doesn't leave partial output
+	#
+	directory = os.path.dirname(path)
+	os.makedirs(directory, exist_ok=True)
+
+	fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+	try:
+		with os.fdopen(fd, "wb") as file:
+			data = text if isinstance(text, bytes) else text.encode("utf-8")
+			if compress:
+				data = gzip.compress(data, compresslevel=6)
+			file.write(data)
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.remove(tmp_path)
+		except OSError:
+			pass
+		raise
+
+
+def convert_input(input_path, relative_path, settings):
+	"""
+	Converts one input file. Returns (input path, output paths, experiment count, gate count, error message or None)
+	"""
+	try:
+		converter = converter_class(Format.QOBJ, Format[settings["format"].upper()])()
+
+		counts = { "experiments": 0, "gates": 0 }
+
+		def counted(experiments):
+			for experiment in experiments:
+				counts["experiments"] += 1
+				if "instructions" in experiment:
+					# measure, barrier and bfunc are not gates
+					handlers = converter.instruction_handlers
+					counts["gates"] += sum(1 for instruction in experiment["instructions"] if instruction.get("name") not in handlers)
+				yield experiment
+
+				if not settings["all_experiments"]:
+					return
+
+		#
+		# Each result is written as soon as it is converted, so only one is held in memory
+		#
+		outputs = []
+		experiments = qobj_stream.iter_experiments(input_path)
+		try:
+			for result in converter.iter_convert(counted(experiments), settings["options"]):
+				path = output_path(input_path, relative_path, len(outputs), settings)
+				write_output(path, result, settings["gzip"])
+				outputs.append(path)
+		finally:
+			experiments.close()
+
+		if len(outputs) == 0:
+			raise Exception("No experiments found.")
+
+		return (input_path, outputs, counts["experiments"], counts["gates"], None)
+	except Exception as e:
+		return (input_path, [], 0, 0, str(e) or type(e).__name__)
+
+
+#
+# Manifest of converted inputs (for incremental runs)
+#
+
+def settings_hash(settings):
+	import hashlib
+
+	text = json.dumps([	MANIFEST_VERSION,
+						gate_defs_version(),
+						settings["format"],
+						settings["options"],
+						settings["all_experiments"],
+						settings["gzip"],
+						settings["output_dir"] ], sort_keys=True, default=str)
+
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+	import hashlib
+
+	digest = hashlib.sha256()
+	with open(path, "rb") as file:
+		while True:
+			chunk = file.read(1 << 20)
+			if not chunk:
+				break
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def load_manifest(path):
+	try:
+		with open(path, "r", encoding="utf-8") as file:
+			manifest = json.load(file)
+	except (OSError, ValueError):
+		return {}
+
+	if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+		return {}
+
+	return manifest.get("files", {})
+
+
+def save_manifest(path, files):
+	write_output(path, json.dumps({ "version": MANIFEST_VERSION, "files": files }, indent=1, sort_keys=True), False)
+
+
+def is_unchanged(input_path, entry, settings_key):
+	"""
+	True if input was already converted with the same settings and outputs exist. Input is hashed only if its
+	size or mtime changed since the last run; entry mtime is updated if content is the same.
+	"""
+	if entry is None or entry.get("settings") != settings_key:
+		return False
+
+	if not all(os.path.exists(path) for path in entry.get("outputs", [])):
+		return False
+
+	stat = os.stat(input_path)
+	if stat.st_size == entry.get("size") and stat.st_mtime_ns == entry.get("mtime_ns"):
+		return True
+
+	if stat.st_size != entry.get("size") or file_hash(input_path) != entry.get("sha256"):
+		return False
+
+	entry["mtime_ns"] = stat.st_mtime_ns
+	return True
+
+
+def manifest_entry(input_path, outputs, settings_key):
+	stat = os.stat(input_path)
+	return {	"size": stat.st_size,
+				"mtime_ns": stat.st_mtime_ns,
+				"sha256": file_hash(input_path),
+				"settings": settings_key,
+				"outputs": outputs }
+
+
+def peak_rss():
+	"""
+	Peak resident set size in bytes of this process and its (finished) worker processes, or None if not available
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None
+
+	peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	if sys.platform == "darwin":
+		return peak
+	return peak * 1024
+
+
+def parse_option(text):
+	if "=" not in text:
+		raise argparse.ArgumentTypeError("expected name=value, got \"" + text + "\"")
+
+	name, value = text.split("=", 1)
+	try:
+		value = json.loads(value)
+	except ValueError:
+		pass
+	return (name, value)
+
+
+def make_parser():
+	parser = argparse.ArgumentParser(prog="qconvert", description="Convert Qobj files (plain or gzip compressed) to another format.")
+	parser.add_argument("inputs", nargs="+", help="input files, glob patterns or directories (searched for *.json and *.json.gz)")
+	parser.add_argument("-f", "--format", required=True, choices=sorted(OUTPUT_EXTENSIONS), help="destination format")
+	parser.add_argument("-o", "--output-dir", default=None, help="write outputs to this directory (default: next to inputs)")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of CPUs)")
+	parser.add_argument("-z", "--gzip", action="store_true", help="gzip compress outputs")
+	parser.add_argument("-a", "--all-experiments", action="store_true", help="convert all experiments, one output file per experiment (NAME_INDEX)")
+	parser.add_argument("-O", "--option", action="append", default=[], type=parse_option, metavar="NAME=VALUE", help="conversion option (value is JSON or string), can be repeated")
+	parser.add_argument("--manifest", default=None, help="manifest file for incremental runs (default: " + MANIFEST_NAME + " in output directory or current directory)")
+	parser.add_argument("--force", action="store_true", help="convert all inputs, even unchanged ones")
+	parser.add_argument("-q", "--quiet", action="store_true", help="print only errors and summary")
+	return parser
+
+
+def main(argv=None):
+	args = make_parser().parse_args(argv)
+
+	options = dict(args.option)
+	options["all_experiments"] = args.all_experiments
+
+	settings = {	"format": args.format,
+					"options": options,
+					"all_experiments": args.all_experiments,
+					"gzip": args.gzip,
+					"output_dir": os.path.abspath(args.output_dir) if args.output_dir is not None else None }
+
+	started = time.perf_counter()
+
+	try:
+		inputs = find_inputs(args.inputs)
+		check_outputs(inputs, settings)
+	except Exception as e:
+		sys.stderr.write("qconvert: " + str(e) + "\n")
+		return 2
+
+	manifest_path = args.manifest
+	if manifest_path is None:
+		manifest_path = os.path.join(settings["output_dir"] or os.getcwd(), MANIFEST_NAME)
+
+	manifest = load_manifest(manifest_path)
+	settings_key = settings_hash(settings)
+
+	#
+	# Skip inputs which didn't change since last run
+	#
+	pending = []
+	skipped = 0
+	for input_path, relative_path in inputs:
+		if not args.force and is_unchanged(input_path, manifest.get(input_path), settings_key):
+			skipped += 1
+		else:
+			pending.append((input_path, relative_path))
+
+	converted = 0
+	failed = 0
+	experiment_count = 0
+	gate_count = 0
+
+	def done(result):
+		nonlocal converted, failed, experiment_count, gate_count
+
+		input_path, outputs, experiments, gates, error = result
+		if error is not None:
+			failed += 1
+			manifest.pop(input_path, None)
+			sys.stderr.write("qconvert: " + input_path + ": " + error + "\n")
+			return
+
+		converted += 1
+		experiment_count += experiments
+		gate_count += gates
+		manifest[input_path] = manifest_entry(input_path, outputs, settings_key)
+		if not args.quiet:
+			sys.stdout.write(input_path + " -> " + ", ".join(outputs) + "\n")
+
+	jobs = max(1, min(args.jobs, len(pending)))
+	if jobs == 1:
+		for input_path, relative_path in pending:
+			done(convert_input(input_path, relative_path, settings))
+	else:
+		from concurrent.futures import ProcessPoolExecutor, as_completed
+		from .parallel import init_worker
+
+		with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker) as pool:
+			futures = [pool.submit(convert_input, input_path, relative_path, settings) for input_path, relative_path in pending]
+			for future in as_completed(futures):
+				done(future.result())
+
+	save_manifest(manifest_path, manifest)
+
+	elapsed = time.perf_counter() - started
+
+	summary = "%d converted, %d unchanged, %d failed in %.2fs: %.1f files/s, %d gates/s" % (	converted,
+																							skipped,
+																							failed,
+																							elapsed,
+																							converted / elapsed if elapsed > 0 else 0,
+																							gate_count / elapsed if elapsed > 0 else 0)
+	rss = peak_rss()
+	if rss is not None:
+		summary += ", peak RSS %.1f MB" % (rss / (1 << 20))
+	sys.stdout.write(summary + "\n")
+
+	return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
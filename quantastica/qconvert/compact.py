@@ -0,0 +1,94 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Qubit compaction, used with "compact_qubits" option.
+#
+# Experiment transpiled for a device has header n_qubits of the device, e.g. 27
+# for a circuit which uses 3 qubits, and the generated QVM / simulator would be
+# that big. Qubits used by gates and measurements are mapped onto 0..k-1 in
+# their original order, and header n_qubits becomes k. Barriers keep only used
+# qubits (barrier left without qubits is dropped).
+#
+# Mapping depends only on the experiment as given (before "peephole"), so
+# qubit_map(experiment) returns the same mapping for translating results back:
+# compact qubit i is original qubit sorted(mapping)[i].
+#
+
+def is_compacted(instruction):
+	return "qubits" in instruction and instruction.get("name") != "barrier"
+
+
+def qubit_map(experiment):
+	"""
+	Dict original qubit -> compact qubit of qubits used by gates and measurements
+	"""
+	used = set()
+	for instruction in experiment["instructions"]:
+		if is_compacted(instruction):
+			used.update(instruction["qubits"])
+
+	return { qubit: index for index, qubit in enumerate(sorted(used)) }
+
+
+def record_qubit_map(options, experiment):
+	"""
+	With "compact_qubits", appends qubit_map(experiment) to list given as "qubit_maps" option (if any)
+	"""
+	if "qubit_maps" in options and options["qubit_maps"] is not None and "compact_qubits" in options and options["compact_qubits"]:
+		options["qubit_maps"].append(qubit_map(experiment))
+
+
+def compact_experiment(experiment, mapping=None):
+	"""
+	Returns copy of experiment with qubits remapped (by qubit_map(experiment) if mapping is not given).
+	Experiment without used qubits is returned as is.
+	"""
+	if mapping is None:
+		mapping = qubit_map(experiment)
+
+	if len(mapping) == 0:
+		return experiment
+
+	header = dict(experiment["header"])
+	if "qubit_labels" in header and len(header["qubit_labels"]) > max(mapping):
+		labels = header["qubit_labels"]
+		header["qubit_labels"] = [labels[qubit] for qubit in sorted(mapping)]
+	header["n_qubits"] = len(mapping)
+
+	compacted = dict(experiment)
+	compacted["header"] = header
+
+	#
+	# Used qubits already are 0..k-1: only barriers change
+	#
+	identity = max(mapping) == len(mapping) - 1
+
+	instructions = []
+	for instruction in experiment["instructions"]:
+		if "qubits" in instruction:
+			if instruction.get("name") == "barrier":
+				qubits = [mapping[qubit] for qubit in instruction["qubits"] if qubit in mapping]
+				if len(qubits) == 0 and len(instruction["qubits"]) > 0:
+					continue
+			elif identity:
+				instructions.append(instruction)
+				continue
+			else:
+				qubits = [mapping[qubit] for qubit in instruction["qubits"]]
+			instruction = dict(instruction)
+			instruction["qubits"] = qubits
+		instructions.append(instruction)
+
+	compacted["instructions"] = instructions
+	return compacted
@@ -14,6 +14,9 @@
 from enum import Enum
 from . import qobj_to_pyquil, qobj_to_toaster
 from . import qconvert_base
+from . import qobj_stream
+from . import ir
+from . import json_backend
 
 class Format(Enum):
     UNDEFINED = 0
@@ -34,11 +37,59 @@ class Format(Enum):
 #
 #   as_qvm: True/False. if True, QVM will mimic QPU specified by lattice argument. Default: False
 #   seed: if valid integer set random_seed for qc.qam to given value. Default: None 
-# - TOASTER: ...
+#   output_stream: text stream. If given, code is written to it and None is returned instead of string
+# - TOASTER:
+#   output_stream: object with write() method or callable. If given, JSON is written to it gate by gate
+#                  and None is returned instead of string
+#   intern_matrices: if True, unique matrices are written once to top-level "matrices" list and
+#                    gate's "matrix" is index into it. Use expand_toaster_matrices() to expand. Default: False
+#   toaster_binary: if True, bytes in compact binary encoding are returned instead of JSON string (see
+#                   toaster_binary.py). decode_toaster() returns the same dict as json.loads() of JSON output.
+#                   Not with output_stream; intern_matrices is ignored. Default: False
+# - All formats:
+#   matrix_cache: if False, gate matrices are evaluated for each gate instead of taken from
+#                 the shared qconvert.matrix_cache. Default: True
+#   matrix_cache_precision: if set, gate params are rounded to given number of decimals
+#                           before matrix cache lookup. Default: None
+#   workers: if > 1 and all_experiments is True, experiments are converted in a pool of given
+#            number of processes. Pool is kept and reused by later calls. Default: None
+#   vectorize: if True and NumPy is installed, matrices of parametrized gates are evaluated
+#              with NumPy in one batch per gate. Default: False
+#   result_cache: True (shared in-memory qconvert.result_cache.result_cache) or ResultCache instance
+#                 (optionally with directory shared by processes). Converted experiments are cached by
+#                 content hash of experiment, converter, options and gate table. Default: None
+#   stats: dict. If given, conversion is profiled and report (phase timings, instruction counts,
+#          cache hits, emitted characters, peak memory) is stored into the dict. Experiments converted by
+#          workers are counted, their merged reports are under "workers". With convert_async(), reports
+#          of experiments (converted in executor) are merged. See stats.py. Default: None
+#   span_callback: with stats, called as span_callback(name, start, seconds) for conversion, each experiment
+#                  and its phases (e.g. to forward to tracing). Default: None
+#   parameter_templates: if True, experiments which differ only in numeric gate params (e.g. parameter sweep
+#                        assembled into one Qobj) are converted once into template (see convert_template()) and
+#                        the others made by filling param slots. Ignored with workers, output_stream,
+#                        intern_matrices, peephole, toaster_binary and json_backend. Default: False
+#   peephole: if True, experiment instructions are optimized before conversion (see peephole.py): inverse
+#             pairs (h h, cx cx, s sdg...) cancelled, consecutive rotations on a qubit merged (into u3 if
+#             axes differ), id dropped. Nothing is moved across measurements, barriers or conditional
+#             gates. Default: False
+#   compact_qubits: if True, qubits used by gates and measurements are mapped onto 0..k-1 (in original order)
+#                   and header n_qubits becomes k, so e.g. 3-qubit circuit transpiled for 27-qubit device
+#                   gets 3q-qvm (see compact.py). Default: False
+#   json_backend: "auto", "orjson", "simdjson", "ujson" or "json" (see json_backend.py). Used to parse source given
+#                 as JSON or path, "auto" (fastest installed) if not set. Toaster JSON is serialized with it if
+#                 set (equivalent JSON, but not the same text as json.dumps()), with json.dumps() if not.
+#                 Not with output_stream. Default: None
+#   qubit_maps: list. With compact_qubits, mapping (dict original qubit -> compact qubit) of each converted
+#               experiment is appended to it, for translating results back (same as qubit_map(experiment)).
+#               Default: None
+
+# source_dict: Qobj dict, or JSON (str, bytes, bytearray, memoryview, mmap) or path to JSON file (plain or gzip)
 
 def convert(source_format, source_dict, dest_format, options = dict() ):
     ret = None
 
+    source_dict = load_source(source_dict, options)
+
     if source_format == Format.QOBJ: 
         if dest_format == Format.PYQUIL:
             ret = qobj_to_pyquil.qobj_to_pyquil(source_dict, options)
@@ -53,5 +104,198 @@ def convert(source_format, source_dict, dest_format, options = dict() ):
 
     return ret
 
+def load_source(source, options):
+    if isinstance(source, dict):
+        return source
+
+    backend = None
+    if options is not None and "json_backend" in options:
+        backend = options["json_backend"]
+
+    return json_backend.load_qobj(source, backend)
+
+# Experiments of source: from Qobj dict or JSON in memory, or read incrementally from path or file object
+
+def iter_source_experiments(source, options):
+    if isinstance(source, dict) or json_backend.is_json_source(source):
+        source = load_source(source, options)
+        return iter(source["experiments"] if "experiments" in source else [])
+
+    return qobj_stream.iter_experiments(source)
+
+def converter_class(source_format, dest_format):
+    if source_format == Format.QOBJ:
+        if dest_format == Format.PYQUIL:
+            return qobj_to_pyquil.QobjToPyquil
+        elif dest_format == Format.TOASTER:
+            return qobj_to_toaster.QobjToToaster
+
+    msg = "Unsuported conversion formats - source: %s  destination: %s"%(str(source_format),str(dest_format))
+    raise RuntimeError(msg)
+
+# Converts Qobj read incrementally from source: path (plain or gzip compressed) or file object.
+# Experiments are parsed, converted and released one by one. Yields converted experiments. JSON str / bytes
+# (or dict) is parsed at once, as by convert().
+# Options: same as convert() (all_experiments and workers are ignored)
+
+def convert_stream(source_format, source, dest_format, options = dict()):
+    converter = converter_class(source_format, dest_format)()
+
+    return converter.iter_convert(iter_source_experiments(source, options), options)
+
+# Same as convert() but reads Qobj incrementally from source (see convert_stream)
+
+def convert_file(source_format, source, dest_format, options = dict()):
+    all_experiments = options is not None and "all_experiments" in options and options["all_experiments"]
+
+    results = []
+    stream = convert_stream(source_format, source, dest_format, options)
+    try:
+        for result in stream:
+            if not all_experiments:
+                return result
+            results.append(result)
+    finally:
+        stream.close()
+
+    return results
+
+# Awaitable convert(): experiments are converted one by one in a process pool (see async_convert.py, use
+# async_convert.AsyncConverter for other executor or to limit concurrent conversions). Cancelling stops
+# before the next experiment. asyncio is imported on first call.
+
+async def convert_async(source_format, source_dict, dest_format, options = dict()):
+    from . import async_convert
+
+    return await async_convert.async_converter.convert(source_format, source_dict, dest_format, options)
+
+# Async iterator over converted experiments. source is Qobj dict or JSON, or path or file object (as convert_file)
+
+def iter_convert_async(source_format, source, dest_format, options = dict()):
+    from . import async_convert
+
+    return async_convert.async_converter.iter_convert(source_format, source, dest_format, options)
+
+# Conversion template for parameter sweeps (see template.py): experiment is converted once, then
+# template.bind(values) returns the same as convert() of the experiment with its numeric gate params
+# (template.params, in instruction order) replaced by values. template.bind_experiment(experiment) takes
+# values from experiment with the same structure. Returns template of the first experiment, or list of
+# templates of all experiments with all_experiments. output_stream, intern_matrices, toaster_binary and
+# json_backend are not supported.
+
+def convert_template(source_format, source_dict, dest_format, options = dict()):
+    from . import template
+
+    converter = converter_class(source_format, dest_format)()
+    converter.options = options if options is not None else {}
+
+    source_dict = load_source(source_dict, converter.options)
+
+    experiments = []
+    if "experiments" in source_dict:
+        experiments = source_dict["experiments"]
+
+    all_experiments = "all_experiments" in converter.options and converter.options["all_experiments"]
+    if not all_experiments:
+        experiments = experiments[:1]
+
+    # qubit map of templated experiment (experiments bound to its template have the same qubits)
+    if "qubit_maps" in converter.options:
+        from . import compact
+        for experiment in experiments:
+            compact.record_qubit_map(converter.options, experiment)
+
+    if not all_experiments:
+        if len(experiments) == 0:
+            return None
+        return template.ConversionTemplate(converter, experiments[0])
+
+    return [template.ConversionTemplate(converter, experiment) for experiment in experiments]
+
+# Converts source to several formats at once. Each Qobj experiment is parsed once into ir.ExperimentIR and all
+# converters replay it, so classical registers, conditions and gate matrices are resolved once for all formats
+# (converters with different compact_qubits / peephole options get their own IR).
+# options: dict used for all formats, or list with one dict per format. workers and parameter_templates are
+# ignored (experiments are converted in this process, output is the same), stats is not supported.
+# Returns list of results in dest_formats order, each the same as convert() returns.
+
+def convert_multi(source_format, source_dict, dest_formats, options = dict()):
+    if isinstance(options, (list, tuple)):
+        if len(options) != len(dest_formats):
+            raise RuntimeError("convert_multi: got %d options for %d formats" % (len(options), len(dest_formats)))
+        format_options = list(options)
+    else:
+        format_options = [options] * len(dest_formats)
+
+    converters = []
+    for dest_format, dest_options in zip(dest_formats, format_options):
+        converter = converter_class(source_format, dest_format)()
+        converter.options = dest_options if dest_options is not None else {}
+        converter.all_experiments = "all_experiments" in converter.options and converter.options["all_experiments"]
+
+        if "stats" in converter.options:
+            from . import stats
+            if stats.stats_requested(converter.options):
+                raise Exception("convert_multi: \"stats\" option is not supported.")
+
+        converter.cache = None
+        if "result_cache" in converter.options:
+            from . import result_cache
+            converter.cache = result_cache.get_result_cache(converter.options)
+
+        converters.append(converter)
+
+    source_dict = load_source(source_dict, format_options[0] if len(format_options) > 0 else None)
+
+    experiments = []
+    if "experiments" in source_dict:
+        experiments = source_dict["experiments"]
+
+    for experiment_index in range(len(experiments)):
+        pending = [converter for converter in converters if experiment_index == 0 or converter.all_experiments]
+        if len(pending) == 0:
+            break
+
+        experiment = experiments[experiment_index]
+
+        # IR per (compact_qubits, peephole), qubit map once per options dict
+        experiment_irs = {}
+        recorded = []
+        for converter in pending:
+            if "qubit_maps" in converter.options and not any(options is converter.options for options in recorded):
+                from . import compact
+                compact.record_qubit_map(converter.options, experiment)
+                recorded.append(converter.options)
+
+            key = None
+            if converter.cache is not None:
+                key = result_cache.result_key(type(converter), experiment, converter.options)
+                if key is not None:
+                    result = converter.cache.get(key)
+                    if result is not None:
+                        converter.results.append(result)
+                        continue
+
+            transforms = (bool(converter.options.get("compact_qubits")), bool(converter.options.get("peephole")))
+            experiment_ir = experiment_irs.get(transforms)
+            if experiment_ir is None:
+                experiment_ir = ir.ExperimentIR(converter.prepare_experiment(experiment))
+                experiment_irs[transforms] = experiment_ir
+
+            converter.result = None
+            converter.convert_ir(experiment_ir)
+            converter.results.append(converter.result)
+
+            if key is not None:
+                converter.cache.put(key, converter.result)
+
+    results = []
+    for converter in converters:
+        if len(converter.results) > 0 and not converter.all_experiments:
+            results.append(converter.results[0])
+        else:
+            results.append(converter.results)
+    return results
+
 def supported_gates():
-    return list(qconvert_base.gate_defs.keys())
+    return list(qconvert_base.get_gate_defs().keys())
@@ -0,0 +1,170 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Records passed to converter hooks (on_qobj_instruction, on_gate, on_measure, on_barrier).
+#
+# Records use __slots__ instead of a dict per instruction. Read fields as
+# attributes (data.name). For subclasses written against the old dict events,
+# records also support data["name"], data["name"] = value, "name" in data,
+# data.get(), keys(), values(), items(), update(), setdefault() and copy()
+# (which returns a dict). Keys which are not fields are stored in a dict
+# created on first use.
+#
+# Records are not dicts: isinstance(data, dict) is False. They are registered
+# as collections.abc.MutableMapping, check isinstance(data, Mapping) instead.
+#
+
+import collections.abc
+
+
+class EventRecord:
+
+	__slots__ = ("_extra",)
+
+	fields = ()
+
+	def __getitem__(self, key):
+		if key in self.fields:
+			try:
+				return getattr(self, key)
+			except AttributeError:
+				raise KeyError(key)
+
+		try:
+			return self._extra[key]
+		except AttributeError:
+			raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key in self.fields:
+			setattr(self, key, value)
+			return
+
+		try:
+			extra = self._extra
+		except AttributeError:
+			extra = {}
+			self._extra = extra
+		extra[key] = value
+
+	def __contains__(self, key):
+		if key in self.fields:
+			return hasattr(self, key)
+		return hasattr(self, "_extra") and key in self._extra
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		keys = [key for key in self.fields if hasattr(self, key)]
+		if hasattr(self, "_extra"):
+			keys += list(self._extra)
+		return keys
+
+	def items(self):
+		return [(key, self[key]) for key in self.keys()]
+
+	def values(self):
+		return [self[key] for key in self.keys()]
+
+	def update(self, other=(), **kwargs):
+		if hasattr(other, "keys"):
+			for key in other.keys():
+				self[key] = other[key]
+		else:
+			for key, value in other:
+				self[key] = value
+		for key in kwargs:
+			self[key] = kwargs[key]
+
+	def setdefault(self, key, default=None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+
+	def copy(self):
+		"""
+		Returns dict with the same keys and values
+		"""
+		return dict(self.items())
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def __repr__(self):
+		return type(self).__name__ + "(" + repr(dict(self.items())) + ")"
+
+
+collections.abc.MutableMapping.register(EventRecord)
+
+
+class InstructionEvent(EventRecord):
+
+	__slots__ = ("instruction", "info")
+
+	fields = __slots__
+
+	def __init__(self, instruction, info):
+		self.instruction = instruction
+		self.info = info
+
+
+class GateEvent(EventRecord):
+
+	#
+	# matrix_array is set only when matrices are evaluated with NumPy ("vectorize" option)
+	#
+	__slots__ = ("name", "gate_def", "condition", "params", "params_dict", "qubits", "matrix", "info", "matrix_array")
+
+	fields = __slots__
+
+	def __init__(self, name, gate_def, condition, params, params_dict, qubits, matrix, info):
+		self.name = name
+		self.gate_def = gate_def
+		self.condition = condition
+		self.params = params
+		self.params_dict = params_dict
+		self.qubits = qubits
+		self.matrix = matrix
+		self.info = info
+
+
+class MeasureEvent(EventRecord):
+
+	__slots__ = ("qubit", "creg_name", "creg_bit", "memory", "info")
+
+	fields = __slots__
+
+	def __init__(self, qubit, creg_name, creg_bit, memory, info):
+		self.qubit = qubit
+		self.creg_name = creg_name
+		self.creg_bit = creg_bit
+		self.memory = memory
+		self.info = info
+
+
+class BarrierEvent(EventRecord):
+
+	__slots__ = ("info",)
+
+	fields = __slots__
+
+	def __init__(self, info):
+		self.info = info
@@ -0,0 +1,158 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Lazy loader for gate_defs.json.
+#
+# The gate table is not loaded on import: it is read on first use and kept for
+# the lifetime of the process. If a precompiled marshal file (written at build
+# time by setup.py, or by running "python quantastica/qconvert/gate_table.py")
+# exists and its content hash (size + CRC32) matches gate_defs.json, it is used
+# instead of parsing the JSON.
+#
+# This module must not import anything from the package: setup.py loads it by
+# path to generate the precompiled file. json is imported only when the
+# precompiled file cannot be used.
+#
+
+import os
+import marshal
+import zlib
+
+gate_defs_path = os.path.join(os.path.dirname(__file__), "gate_defs.json")
+gate_defs_compiled_path = os.path.join(os.path.dirname(__file__), "gate_defs.marshal")
+
+COMPILED_FORMAT = 1
+
+#
+# Per-target slices: only the keys (and exportInfo entries) each target needs. Slices keep "matrix":
+# subclasses may read GateEvent.matrix, converters which don't are skipped by QConvertQobj.uses_matrices()
+#
+GATE_DEF_SLICES = {
+	"pyquil": { "keys": ["params", "matrix"], "export": ["quil", "pyquil"] },
+	"toaster": { "keys": ["params", "matrix"], "export": [] }
+}
+
+_gate_defs = None
+_gate_def_slices = {}
+_gate_defs_version = None
+
+
+def gate_defs_hash(raw):
+	return "%d-%08x" % (len(raw), zlib.crc32(raw))
+
+
+def write_compiled_gate_defs(json_path=gate_defs_path, compiled_path=gate_defs_compiled_path):
+	import json
+
+	with open(json_path, "rb") as file:
+		raw = file.read()
+
+	payload = {	"format": COMPILED_FORMAT,
+				"hash": gate_defs_hash(raw),
+				"gate_defs": json.loads(raw.decode("utf-8")) }
+
+	tmp_path = compiled_path + ".tmp"
+	with open(tmp_path, "wb") as file:
+		marshal.dump(payload, file)
+	os.replace(tmp_path, compiled_path)
+
+	return compiled_path
+
+
+def load_gate_defs(json_path=gate_defs_path, compiled_path=gate_defs_compiled_path):
+	with open(json_path, "rb") as file:
+		raw = file.read()
+
+	#
+	# Use precompiled table if it is not stale
+	#
+	if compiled_path is not None and os.path.exists(compiled_path):
+		try:
+			with open(compiled_path, "rb") as file:
+				payload = marshal.loads(file.read())
+			if payload.get("format") == COMPILED_FORMAT and payload.get("hash") == gate_defs_hash(raw):
+				return payload["gate_defs"]
+		except Exception:
+			pass
+
+	import json
+
+	return json.loads(raw.decode("utf-8"))
+
+
+def gate_defs_version():
+	"""
+	Content hash of gate_defs.json: changes when gate definitions change
+	"""
+	global _gate_defs_version
+
+	if _gate_defs_version is None:
+		with open(gate_defs_path, "rb") as file:
+			_gate_defs_version = gate_defs_hash(file.read())
+
+	return _gate_defs_version
+
+
+def slice_gate_defs(gate_defs, target):
+	if target not in GATE_DEF_SLICES:
+		raise Exception("Unknown gate definitions target \"" + str(target) + "\".")
+
+	slice_info = GATE_DEF_SLICES[target]
+
+	sliced = {}
+	for gate_name in gate_defs:
+		gate_def = gate_defs[gate_name]
+
+		gate_slice = {}
+		for key in slice_info["keys"]:
+			if key in gate_def:
+				gate_slice[key] = gate_def[key]
+
+		if len(slice_info["export"]) > 0:
+			export_info = {}
+			for export_name in slice_info["export"]:
+				if export_name in gate_def.get("exportInfo", {}):
+					export_info[export_name] = gate_def["exportInfo"][export_name]
+			gate_slice["exportInfo"] = export_info
+
+		sliced[gate_name] = gate_slice
+
+	return sliced
+
+
+def get_gate_defs(target=None):
+	global _gate_defs
+
+	if _gate_defs is None:
+		_gate_defs = load_gate_defs()
+
+	if target is None:
+		return _gate_defs
+
+	if target not in _gate_def_slices:
+		_gate_def_slices[target] = slice_gate_defs(_gate_defs, target)
+
+	return _gate_def_slices[target]
+
+
+def reset_gate_defs():
+	global _gate_defs, _gate_defs_version
+
+	_gate_defs = None
+	_gate_def_slices.clear()
+	_gate_defs_version = None
+
+
+if __name__ == "__main__":
+	print("Written " + write_compiled_gate_defs())
@@ -0,0 +1,326 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Intermediate representation of one Qobj experiment.
+#
+# The experiment is parsed once into columns (one row per instruction):
+# classical registers and bfunc conditions are resolved, gate names are
+# interned. Converters replay the IR (QConvertQobj.convert_ir), so one IR can
+# drive several output formats (convert_multi). Gate matrices are evaluated
+# on first request and shared by all converters which use them.
+#
+
+import array
+import itertools
+
+from .qconvert_base import get_gate_defs, eval_mathjs_matrix, matrix_cache
+
+OP_GATE = 0
+OP_MEASURE = 1
+OP_BARRIER = 2
+OP_BFUNC = 3
+
+INSTRUCTION_OPS = { "measure": OP_MEASURE, "barrier": OP_BARRIER, "bfunc": OP_BFUNC }
+
+
+class ExperimentIR:
+	"""
+	Experiment in columns, one row per instruction. For row i:
+
+	  ops[i]          opcode (OP_GATE, OP_MEASURE, OP_BARRIER, OP_BFUNC)
+	  names[i]        index into name_table (instruction names, "iden" translated to "id")
+	  conditions[i]   index into condition_table or -1. For bfunc: condition it sets, for gate: condition it depends on
+	  row_qubits[i]   list of qubits ([] if instruction has none)
+	  row_params[i]   list of params as given in Qobj (None if instruction has no "params")
+	  row_memory[i]   list of memory slots for measure (None for other rows)
+
+	ops, names and conditions are array.array (numpy.frombuffer() gives views without copying). Qubits and
+	params are kept as the lists from Qobj, because converters pass them on as lists: flat array columns
+	are built on request by qubit_columns() and param_columns().
+	"""
+
+	def __init__(self, experiment):
+		#
+		# Do we have header in Qobj?
+		#
+		if "header" not in experiment:
+			raise Exception("Qobj header not found.")
+
+		self.experiment = experiment
+		self.instructions = experiment["instructions"]
+
+		header = experiment["header"]
+
+		self.qubit_count = 0
+		if "n_qubits" in header:
+			self.qubit_count = header["n_qubits"]
+
+		self.memory_slots = 0
+		if "memory_slots" in header:
+			self.memory_slots = header["memory_slots"]
+
+		#
+		# Classical registers
+		#
+		self.cregs = {}
+		self.creg_masks = {}
+		if "creg_sizes" in header:
+			total_bits = 0
+			for creg_data in header["creg_sizes"]:
+				if len(creg_data) >= 2:
+					creg_name = creg_data[0]
+					creg_len = creg_data[1]
+					creg_mask = (1 << (total_bits + creg_len)) - (1 << total_bits)
+					self.cregs[creg_name] = {	"memory_offset": total_bits,
+												"len": creg_len,
+												"mask": creg_mask }
+
+					self.creg_masks[creg_mask] = {	"memory_offset": total_bits,
+													"name": creg_name }
+
+					total_bits += creg_len
+
+		#
+		# Memory slot -> (creg name, bit in creg)
+		#
+		self.memory_cregs = []
+		for creg_name in self.cregs:
+			for creg_bit in range(self.cregs[creg_name]["len"]):
+				self.memory_cregs.append((creg_name, creg_bit))
+
+		self.build()
+
+		self.evaluated_matrices = {}
+
+	def build(self):
+		#
+		# Columns are built with comprehensions over all instructions: per-instruction Python code is the cost here
+		#
+		instructions = self.instructions
+
+		name_ids = {}
+		self.names = array.array("l", [name_ids.setdefault(instruction["name"] if "name" in instruction else "", len(name_ids)) for instruction in instructions])
+		self.name_table = list(name_ids)
+
+		#
+		# Translate gate names to gate_defs
+		#
+		if "iden" in name_ids:
+			iden_id = name_ids["iden"]
+			if "id" in name_ids:
+				id_id = name_ids["id"]
+				self.names = array.array("l", [id_id if name_id == iden_id else name_id for name_id in self.names])
+			else:
+				self.name_table[iden_id] = "id"
+
+		op_table = [INSTRUCTION_OPS.get(name, OP_GATE) for name in self.name_table]
+		self.ops = array.array("B", [op_table[name_id] for name_id in self.names])
+
+		self.row_qubits = [instruction["qubits"] if "qubits" in instruction else [] for instruction in instructions]
+		self.row_params = [instruction["params"] if "params" in instruction else None for instruction in instructions]
+
+		#
+		# Memory slots of measure
+		#
+		self.row_memory = [None] * len(instructions)
+		if OP_MEASURE in op_table:
+			for index in range(len(instructions)):
+				if self.ops[index] == OP_MEASURE:
+					instruction = instructions[index]
+					self.row_qubits[index] = instruction["qubits"]
+					self.row_memory[index] = instruction["memory"]
+
+		#
+		# Conditions: bfunc sets condition of its register, gates refer to the last condition set for their register
+		#
+		self.condition_table = []
+		self.conditions = array.array("l", [-1]) * len(instructions)
+		if OP_BFUNC in op_table:
+			register_conditions = {}
+			for index in range(len(instructions)):
+				instruction = instructions[index]
+				op = self.ops[index]
+				if op == OP_BFUNC:
+					condition = len(self.condition_table)
+					self.condition_table.append(self.bfunc_condition(instruction))
+					register_conditions[instruction["register"]] = condition
+					self.conditions[index] = condition
+				elif op == OP_GATE and "conditional" in instruction:
+					self.conditions[index] = register_conditions[instruction["conditional"]]
+		else:
+			for index in range(len(instructions)):
+				if "conditional" in instructions[index] and self.ops[index] == OP_GATE:
+					# no bfunc sets this register
+					raise KeyError(instructions[index]["conditional"])
+
+	def bfunc_condition(self, instruction):
+		#
+		# Classical condition
+		#
+		bfunc_mask = int(instruction["mask"], 0)
+		bfunc_val = int(instruction["val"], 0)
+		if not bfunc_mask in self.creg_masks:
+			raise Exception("Cannot find classical register by mask in bfunc")
+
+		bfunc_relation = None
+		if("relation" in instruction):
+			bfunc_relation = instruction["relation"]
+
+		bfunc_creg = self.creg_masks[bfunc_mask]
+
+		return {	"mask": bfunc_mask,
+					"val": bfunc_val,
+					"memory": bfunc_creg["memory_offset"],
+					"relation": bfunc_relation,
+					"creg_name": bfunc_creg["name"],
+					"creg_value": bfunc_val >> bfunc_creg["memory_offset"] }
+
+	def __len__(self):
+		return len(self.ops)
+
+	def name(self, index):
+		return self.name_table[self.names[index]]
+
+	def condition(self, index):
+		condition = self.conditions[index]
+		if condition < 0:
+			return None
+		return self.condition_table[condition]
+
+	def qubit_columns(self):
+		"""
+		Returns (offsets, qubits) arrays: qubits of row i are qubits[offsets[i]:offsets[i + 1]]
+		"""
+		offsets = array.array("l", [0])
+		offsets.extend(itertools.accumulate(map(len, self.row_qubits)))
+		return offsets, array.array("q", itertools.chain.from_iterable(self.row_qubits))
+
+	def param_columns(self):
+		"""
+		Returns (offsets, params) arrays, params as floats: params of row i are params[offsets[i]:offsets[i + 1]].
+		Raises TypeError if params are not real numbers.
+		"""
+		row_params = [params if params is not None else () for params in self.row_params]
+		offsets = array.array("l", [0])
+		offsets.extend(itertools.accumulate(map(len, row_params)))
+		return offsets, array.array("d", itertools.chain.from_iterable(row_params))
+
+	def make_info(self, options):
+		info = {	"return_state_vector": False,
+					"create_exec_code": False,
+					"classical_control_present": False,
+					"qubits": 0,
+					"memory_slots": 0,
+					"cregs": {} }
+
+		#
+		# Does user requests state vector?
+		#
+		if options is not None and "lattice" in options and options["lattice"] == "statevector_simulator":
+			info["return_state_vector"] = True
+
+		#
+		# Does user want to generate executable code?
+		#
+		if options is not None and ("create_exec_code" not in options or options["create_exec_code"]):
+			info["create_exec_code"] = True
+
+		info["classical_control_present"] = len(self.condition_table) > 0
+		info["memory_slots"] = self.memory_slots
+		info["cregs"] = self.cregs
+		info["qubits"] = self.qubit_count
+
+		return info
+
+	def params_dict(self, index, gate_def):
+		params = self.row_params[index]
+		params_dict = {}
+		if "params" in gate_def:
+			param_index = 0
+			for param_name in gate_def["params"]:
+				params_dict[param_name] = params[param_index]
+				param_index += 1
+		return params_dict
+
+	def matrices(self, options):
+		"""
+		Returns (matrices, matrix_arrays): per row, evaluated matrix of gate (None for other rows and gates
+		without matrix). matrix_arrays is None, or (with "vectorize" option) per row NumPy view of the matrix.
+		Evaluated once for each combination of options which affect evaluation.
+		"""
+		use_matrix_cache = True
+		if options is not None and "matrix_cache" in options and not options["matrix_cache"]:
+			use_matrix_cache = False
+
+		matrix_cache_precision = None
+		if options is not None and "matrix_cache_precision" in options:
+			matrix_cache_precision = options["matrix_cache_precision"]
+
+		vectorize = False
+		if options is not None and "vectorize" in options and options["vectorize"]:
+			from . import numpy_batch
+			vectorize = numpy_batch.numpy_available()
+
+		key = (use_matrix_cache, matrix_cache_precision, vectorize)
+		if key in self.evaluated_matrices:
+			return self.evaluated_matrices[key]
+
+		gate_defs = get_gate_defs()
+
+		#
+		# Evaluate matrices of parametrized gates with NumPy, in one batch per gate?
+		#
+		batch_matrices = None
+		if vectorize:
+			batch_matrices = numpy_batch.evaluate_experiment_matrices(self.instructions, gate_defs)
+
+		row_defs = [gate_defs.get(name) for name in self.name_table]
+
+		#
+		# Matrices of parameterless gates: evaluated once per gate name
+		#
+		constant_matrices = [None] * len(self.name_table)
+		if use_matrix_cache:
+			for name_id in range(len(self.name_table)):
+				gate_def = row_defs[name_id]
+				if gate_def is not None and "matrix" in gate_def and len(gate_def.get("params", [])) == 0:
+					constant_matrices[name_id] = matrix_cache.get(self.name_table[name_id], gate_def, {})
+
+		ops = self.ops
+		names = self.names
+
+		matrices = [None] * len(ops)
+		matrix_arrays = [None] * len(ops) if batch_matrices is not None else None
+		for index in range(len(ops)):
+			if ops[index] != OP_GATE:
+				continue
+
+			name_id = names[index]
+			if constant_matrices[name_id] is not None:
+				matrices[index] = constant_matrices[name_id]
+				continue
+
+			gate_def = row_defs[name_id]
+			if gate_def is None or "matrix" not in gate_def:
+				continue
+
+			if batch_matrices is not None and batch_matrices[index] is not None:
+				matrices[index], matrix_arrays[index] = batch_matrices[index]
+			elif use_matrix_cache:
+				matrices[index] = matrix_cache.get(self.name_table[name_id], gate_def, self.params_dict(index, gate_def), matrix_cache_precision)
+			else:
+				matrices[index] = eval_mathjs_matrix(gate_def["matrix"], self.params_dict(index, gate_def))
+
+		self.evaluated_matrices[key] = (matrices, matrix_arrays)
+		return self.evaluated_matrices[key]
@@ -0,0 +1,176 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# JSON backends ("json_backend" option): orjson, simdjson (parsing only) and
+# ujson are used if installed, none of them is a dependency. "auto" is the
+# first installed of BACKENDS, stdlib json if none is.
+#
+# Parsing gives the same values with any backend. Input a backend rejects
+# (e.g. NaN, which only stdlib json accepts) is parsed again with stdlib json,
+# so errors are stdlib json's.
+#
+# Serialized JSON is equivalent (parses to the same values), but not the same
+# text as json.dumps(): other backends write no spaces after separators, and
+# some write floats differently (1e-05 as 0.00001). Objects a backend can't
+# serialize, and output of orjson with null (which is how it writes NaN and
+# Infinity), are written by stdlib json, so non-finite floats are kept.
+#
+# load_qobj() reads convert() input: dict, JSON as str / bytes / bytearray /
+# memoryview / mmap, or path (str or PathLike, gzip is detected). Plain files
+# are memory-mapped, so backends which take buffers parse them without copy.
+#
+
+import os
+import json
+import mmap
+import gzip
+
+#
+# Fastest first
+#
+BACKENDS = ("orjson", "simdjson", "ujson", "json")
+
+#
+# Backends which only parse: serialization uses the next installed backend
+#
+PARSE_ONLY = ("simdjson",)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+_modules = {}
+
+
+def backend_module(name):
+	"""
+	Returns module of installed backend, or None
+	"""
+	if name not in _modules:
+		module = None
+		if name == "json":
+			module = json
+		elif name in BACKENDS:
+			try:
+				module = __import__(name)
+			except ImportError:
+				module = None
+		_modules[name] = module
+	return _modules[name]
+
+
+def resolve_backend(name, serialize=False):
+	"""
+	Returns name of installed backend: first installed for "auto" or None, "json" if named backend is not installed
+	"""
+	if name is not None and name != "auto" and name not in BACKENDS:
+		raise Exception("Unknown JSON backend \"" + str(name) + "\".")
+
+	if name is None or name == "auto" or (serialize and name in PARSE_ONLY):
+		for backend_name in BACKENDS:
+			if serialize and backend_name in PARSE_ONLY:
+				continue
+			if backend_module(backend_name) is not None:
+				return backend_name
+		return "json"
+
+	if backend_module(name) is None:
+		return "json"
+	return name
+
+
+def available_backends():
+	return [name for name in BACKENDS if backend_module(name) is not None]
+
+
+def loads(data, backend="auto"):
+	"""
+	Parses JSON from str, bytes, bytearray, memoryview or mmap
+	"""
+	name = resolve_backend(backend)
+	if name != "json":
+		module = backend_module(name)
+		try:
+			if name == "orjson":
+				if isinstance(data, mmap.mmap):
+					data = memoryview(data)
+				return module.loads(data)
+			if isinstance(data, (memoryview, mmap.mmap)):
+				data = bytes(data)
+			return module.loads(data)
+		except Exception:
+			pass
+
+	if isinstance(data, (memoryview, mmap.mmap)):
+		data = bytes(data)
+	return json.loads(data)
+
+
+def dumps(value, backend="auto"):
+	"""
+	Serializes value to JSON string
+	"""
+	name = resolve_backend(backend, serialize=True)
+	if name == "orjson":
+		try:
+			text = backend_module(name).dumps(value).decode("utf-8")
+			#
+			# orjson writes NaN and Infinity as null: if there is null, it may be one of them
+			#
+			if "null" not in text:
+				return text
+		except Exception:
+			pass
+	elif name == "ujson":
+		try:
+			return backend_module(name).dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+		except Exception:
+			pass
+
+	return json.dumps(value)
+
+
+def is_json_source(source):
+	"""
+	True if convert() input is JSON in memory (str / bytes / bytearray / memoryview / mmap), not path or dict
+	"""
+	if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+		return True
+	return isinstance(source, str) and source.lstrip()[:1] in ("{", "[")
+
+
+def load_qobj(source, backend="auto"):
+	"""
+	Returns Qobj dict from convert() input (dict is returned as is)
+	"""
+	if isinstance(source, dict):
+		return source
+
+	if is_json_source(source):
+		if not isinstance(source, str) and bytes(source[:len(GZIP_MAGIC)]) == GZIP_MAGIC:
+			return loads(gzip.decompress(source), backend)
+		return loads(source, backend)
+
+	if isinstance(source, (str, os.PathLike)):
+		with open(source, "rb") as file:
+			if file.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+				file.seek(0)
+				with gzip.GzipFile(fileobj=file) as gzip_file:
+					return loads(gzip_file.read(), backend)
+
+			if os.fstat(file.fileno()).st_size == 0:
+				return loads(b"", backend)
+
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+				return loads(mapped, backend)
+
+	raise Exception("Source must be Qobj dict, JSON (str or bytes) or path.")
@@ -0,0 +1,210 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Optional NumPy path: evaluates matrices of all instances of a parametrized
+# gate in one array operation. NumPy is not a dependency - if it is not
+# installed, numpy_available() returns False and callers use scalar evaluation.
+#
+
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from .qconvert_base import mathjs_to_python, check_expression, expression_is_complex, expression_uses_names
+from .qconvert_base import clean_param_name, matrix_cell_value, EXPRESSION_GLOBALS, EXPRESSION_FUNCTIONS
+
+CELL_CONSTANT = 0
+CELL_COMPLEX = 1
+CELL_REAL = 2
+
+
+def numpy_available():
+	return numpy is not None
+
+
+NUMPY_FUNCTION_NAMES = {	"sqrt": "sqrt", "exp": "exp", "log": "log", "sin": "sin", "cos": "cos", "tan": "tan",
+							"asin": "arcsin", "acos": "arccos", "atan": "arctan", "sinh": "sinh", "cosh": "cosh", "tanh": "tanh" }
+
+
+def numpy_globals():
+	scope = {}
+	for function_name in EXPRESSION_FUNCTIONS:
+		scope[function_name] = getattr(numpy, NUMPY_FUNCTION_NAMES[function_name])
+	scope["pi"] = EXPRESSION_GLOBALS["pi"]
+	scope["e"] = EXPRESSION_GLOBALS["e"]
+	scope["__builtins__"] = {}
+	return scope
+
+
+class BatchMatrix:
+	"""
+	Gate matrix compiled for NumPy. evaluate() takes one complex array per param
+	(in param_names order, all of length k) and returns complex array of shape [k, 2^n, 2^n].
+	"""
+
+	def __init__(self, matrix, param_names):
+		clean_names = [clean_param_name(param_name) for param_name in param_names]
+
+		self.size = len(matrix)
+		self.cells = []
+		self.builder = None
+
+		scope = numpy_globals()
+		source = "def _matrix(_out, " + ", ".join(clean_names) + "):\n"
+
+		for row_index in range(len(matrix)):
+			row = matrix[row_index]
+			cell_row = []
+			for col_index in range(len(row)):
+				cell = row[col_index]
+
+				if not isinstance(cell, str):
+					cell_row.append((CELL_CONSTANT, cell))
+					source += "\t_out[:, " + str(row_index) + ", " + str(col_index) + "] = " + repr(cell) + "\n"
+					continue
+
+				expression = mathjs_to_python(cell)
+				tree = check_expression(expression, clean_names)
+
+				if not expression_uses_names(tree):
+					constant = eval(compile(tree, "", "eval"), EXPRESSION_GLOBALS, {})
+					cell_row.append((CELL_CONSTANT, matrix_cell_value(constant)))
+					source += "\t_out[:, " + str(row_index) + ", " + str(col_index) + "] = " + repr(complex(constant)) + "\n"
+					continue
+
+				if expression_is_complex(tree):
+					cell_row.append((CELL_COMPLEX, None))
+				else:
+					cell_row.append((CELL_REAL, None))
+
+				source += "\t_out[:, " + str(row_index) + ", " + str(col_index) + "] = " + expression + "\n"
+
+			self.cells.append(cell_row)
+
+		source += "\treturn _out\n"
+
+		exec(compile(source, "<gate matrix batch>", "exec"), scope)
+		self.function = scope["_matrix"]
+
+	def evaluate(self, *param_arrays):
+		count = len(param_arrays[0]) if len(param_arrays) > 0 else 1
+		out = numpy.empty((count, self.size, self.size), dtype=complex)
+		return self.function(out, *param_arrays)
+
+	def compile_builder(self):
+		#
+		# Function which builds one matrix (in eval_mathjs_matrix form) from one batch row converted to list
+		#
+		scope = { "__builtins__": {} }
+		rows = []
+		for row_index in range(self.size):
+			cells = []
+			for col_index in range(self.size):
+				kind, value = self.cells[row_index][col_index]
+				# flattened row, real and imaginary parts interleaved (complex array viewed as float)
+				re_part = "[" + str(2 * (row_index * self.size + col_index)) + "]"
+				im_part = "[" + str(2 * (row_index * self.size + col_index) + 1) + "]"
+				if kind == CELL_CONSTANT:
+					name = "_k" + str(len(scope))
+					scope[name] = value
+					cells.append(name)
+				elif kind == CELL_COMPLEX:
+					cells.append("{ \"type\": \"complex\", \"re\": _row" + re_part + ", \"im\": _row" + im_part + " }")
+				else:
+					cells.append("_row" + re_part)
+			rows.append("[" + ", ".join(cells) + "]")
+
+		source = "def _build(_row):\n"
+		source += "\treturn [" + ", ".join(rows) + "]\n"
+		exec(compile(source, "<gate matrix builder>", "exec"), scope)
+		return scope["_build"]
+
+	def to_matrices(self, batch):
+		"""
+		Convert [k, 2^n, 2^n] array into list of k matrices in the same form as eval_mathjs_matrix returns
+		"""
+		if self.builder is None:
+			self.builder = self.compile_builder()
+
+		builder = self.builder
+		return [builder(row) for row in batch.view(float).reshape(len(batch), -1).tolist()]
+
+
+batch_matrices = {}
+
+def get_batch_matrix(name, gate_def):
+	key = (name, id(gate_def["matrix"]))
+	batch_matrix = batch_matrices.get(key)
+	if batch_matrix is None:
+		batch_matrix = BatchMatrix(gate_def["matrix"], gate_def.get("params", []))
+		batch_matrices[key] = batch_matrix
+	return batch_matrix
+
+
+def evaluate_experiment_matrices(instructions, gate_defs):
+	"""
+	Evaluate matrices of all parametrized gates in experiment, one batch per gate.
+
+	Returns list with one entry per instruction: None, or (matrix, view) where matrix is in
+	eval_mathjs_matrix form and view is the instruction's [2^n, 2^n] slice of its gate's batch array.
+	"""
+	groups = {}
+	for index in range(len(instructions)):
+		instruction = instructions[index]
+		if "params" not in instruction:
+			continue
+
+		group = groups.get(instruction["name"])
+		if group is None:
+			gate_def = gate_defs.get(instruction["name"])
+			if gate_def is None or "matrix" not in gate_def or len(gate_def.get("params", [])) == 0:
+				continue
+
+			group = ([], [])
+			groups[instruction["name"]] = group
+
+		group[0].append(index)
+		group[1].append(instruction["params"])
+
+	return evaluate_groups(groups, gate_defs, len(instructions))
+
+
+def evaluate_groups(groups, gate_defs, instruction_count):
+	result = [None] * instruction_count
+	for name in groups:
+		indexes, params = groups[name]
+		gate_def = gate_defs[name]
+		param_count = len(gate_def["params"])
+
+		try:
+			param_array = numpy.array(params, dtype=complex)
+		except (ValueError, TypeError):
+			#
+			# Ragged or non-numeric params: leave these to scalar evaluation
+			#
+			continue
+
+		if param_array.ndim != 2 or param_array.shape[1] < param_count:
+			continue
+
+		batch_matrix = get_batch_matrix(name, gate_def)
+		batch = batch_matrix.evaluate(*[param_array[:, param_index] for param_index in range(param_count)])
+		matrices = batch_matrix.to_matrices(batch)
+
+		for index, matrix, view in zip(indexes, matrices, batch):
+			result[index] = (matrix, view)
+
+	return result
@@ -0,0 +1,171 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Converts experiments of one Qobj in a process pool.
+#
+# Pools are created on first use and kept (one per number of workers) until the
+# process exits, so gate tables and matrix caches stay warm in the workers
+# across conversions. If a worker dies (e.g. killed when out of memory), the
+# pool is broken: it is replaced and the conversion is tried once more.
+#
+
+import atexit
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .gate_table import get_gate_defs
+
+#
+# Experiments are sent in chunks: CHUNKS_PER_WORKER chunks per worker, balanced by instruction count
+#
+CHUNKS_PER_WORKER = 4
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def init_worker():
+	get_gate_defs()
+
+
+def get_pool(workers):
+	with _pools_lock:
+		pool = _pools.get(workers)
+		if pool is None:
+			pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+			_pools[workers] = pool
+		return pool
+
+
+def evict_pool(workers, pool):
+	"""
+	Removes broken pool (a worker died), so get_pool() creates new one
+	"""
+	with _pools_lock:
+		if _pools.get(workers) is pool:
+			_pools.pop(workers)
+	pool.shutdown(wait=False)
+
+
+def shutdown_pools():
+	with _pools_lock:
+		for workers in list(_pools):
+			_pools.pop(workers).shutdown(wait=True)
+
+atexit.register(shutdown_pools)
+
+
+def can_run_in_pool(converter_class, options):
+	try:
+		pickle.dumps((converter_class, options))
+		return True
+	except Exception:
+		return False
+
+
+def experiment_size(experiment):
+	if "instructions" in experiment:
+		return len(experiment["instructions"])
+	return 0
+
+
+def balance_chunks(experiments, chunk_count):
+	"""
+	Split experiments into chunk_count lists of indexes with similar total instruction count
+	(largest experiment first, each into currently smallest chunk)
+	"""
+	chunks = [[] for i in range(chunk_count)]
+	totals = [0] * chunk_count
+
+	order = sorted(range(len(experiments)), key=lambda index: experiment_size(experiments[index]), reverse=True)
+	for index in order:
+		chunk_index = totals.index(min(totals))
+		chunks[chunk_index].append(index)
+		totals[chunk_index] += experiment_size(experiments[index]) + 1
+
+	#
+	# Biggest chunks first, so they don't end up last in the queue
+	#
+	ordered = sorted(range(chunk_count), key=lambda chunk_index: totals[chunk_index], reverse=True)
+	return [chunks[chunk_index] for chunk_index in ordered if len(chunks[chunk_index]) > 0]
+
+
+def convert_chunk(converter_class, options, experiments, profile=False):
+	converter = converter_class()
+	converter.options = options
+
+	#
+	# Profiled (for "stats" of the parent conversion): returns (results, report)
+	#
+	profiler = None
+	if profile:
+		from . import stats
+		profiler = stats.ConversionProfiler(converter)
+		profiler.start()
+
+	results = []
+	try:
+		for experiment in experiments:
+			converter.result = None
+			converter.experiment_converter(experiment)
+			results.append(converter.result)
+			if profiler is not None:
+				profiler.add_result(converter.result)
+	finally:
+		if profiler is not None:
+			report = profiler.stop()
+
+	if profiler is not None:
+		return results, report
+	return results
+
+
+def convert_experiments(converter_class, options, experiments, workers, reports=None):
+	"""
+	Convert experiments with converter_class in pool of given number of workers. Results are in experiments order.
+	If reports is a list, workers profile conversion and stats report of each chunk is appended to it.
+	"""
+	worker_options = dict(options)
+	worker_options.pop("workers", None)
+
+	chunks = balance_chunks(experiments, min(len(experiments), workers * CHUNKS_PER_WORKER))
+
+	for attempt in range(2):
+		pool = get_pool(workers)
+		try:
+			return convert_chunks(pool, converter_class, worker_options, experiments, chunks, reports)
+		except BrokenProcessPool:
+			evict_pool(workers, pool)
+			if attempt > 0:
+				raise
+			if reports is not None:
+				del reports[:]
+
+
+def convert_chunks(pool, converter_class, worker_options, experiments, chunks, reports):
+	futures = []
+	for chunk in chunks:
+		futures.append(pool.submit(convert_chunk, converter_class, worker_options, [experiments[index] for index in chunk], reports is not None))
+
+	results = [None] * len(experiments)
+	for chunk, future in zip(chunks, futures):
+		chunk_results = future.result()
+		if reports is not None:
+			chunk_results, report = chunk_results
+			reports.append(report)
+		for index, result in zip(chunk, chunk_results):
+			results[index] = result
+	return results
@@ -0,0 +1,274 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Peephole optimization of experiment instructions, used with "peephole" option.
+#
+# One pass over instructions, keeping for each qubit a stack of (indexes of)
+# kept instructions which act on it. An incoming gate is compared only with
+# the instruction on top of its qubits' stacks, i.e. the previous instruction
+# on the same wires, so nothing is reordered:
+#
+#   - id / iden are dropped
+#   - inverse pair on the same qubits (cx cx, h h, s sdg...) is removed, and
+#     the instruction below becomes top again (h x x h cancels completely)
+#   - consecutive rotations on one qubit are merged: same-axis gates (rz rz,
+#     u1 u1, rx rx, ry ry) by adding angles, other runs of u1/u2/u3/rz/rx/ry
+#     into one u3 from the product of their gate_defs matrices (equal up to
+#     global phase). Merged gate which is identity is removed.
+#
+# Measurements and barriers are pushed on their qubits' stacks (barrier without
+# qubits clears all stacks), so nothing is cancelled or merged across them.
+# Conditional gates (after bfunc) and gates with non-numeric params are never
+# changed and block their qubits the same way.
+#
+
+import cmath
+import math
+
+from .qconvert_base import get_gate_defs, eval_mathjs_matrix
+
+SELF_INVERSE = ("x", "y", "z", "h", "cx", "cy", "cz", "ch", "swap", "ccx", "cswap")
+
+INVERSES = {	"s": "sdg", "sdg": "s",
+				"t": "tdg", "tdg": "t",
+				"cs": "csdg", "csdg": "cs",
+				"ct": "ctdg", "ctdg": "ct",
+				"srn": "srndg", "srndg": "srn" }
+
+#
+# Gates whose qubits can be in any order
+#
+SYMMETRIC = ("cz", "swap")
+
+IDENTITIES = ("id", "iden")
+
+#
+# Merged by adding angles (rotation about the same axis)
+#
+ADDITIVE = ("rz", "u1", "rx", "ry")
+
+#
+# Merged into u3 by matrix product
+#
+FUSABLE = ("u1", "u2", "u3", "rz", "rx", "ry")
+
+#
+# Angles and matrix elements closer than this to zero are zero
+#
+TOLERANCE = 1e-12
+
+
+def is_number(value):
+	return type(value) is int or type(value) is float
+
+
+def is_plain_gate(instruction):
+	"""
+	Gate without condition with numeric params (can be cancelled or merged)
+	"""
+	if "conditional" in instruction:
+		return False
+	if "params" in instruction:
+		for value in instruction["params"]:
+			if not is_number(value):
+				return False
+	return True
+
+
+def has_params(instruction, gate_defs):
+	gate_def = gate_defs.get(instruction["name"])
+	if gate_def is None:
+		return False
+	return len(instruction.get("params", [])) == len(gate_def.get("params", []))
+
+
+def same_qubits(first, second, name):
+	if name in SYMMETRIC:
+		return sorted(first) == sorted(second)
+	return list(first) == list(second)
+
+
+def gate_matrix(instruction, gate_defs):
+	"""
+	2x2 matrix of single-qubit gate as nested lists of complex
+	"""
+	gate_def = gate_defs[instruction["name"]]
+
+	params_dict = {}
+	for param_index, param_name in enumerate(gate_def.get("params", [])):
+		params_dict[param_name] = instruction["params"][param_index]
+
+	# evaluated directly: merged angles are rarely repeated, so they would only fill the matrix cache
+	matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+
+	def value(cell):
+		if isinstance(cell, dict):
+			return complex(cell["re"], cell["im"])
+		return complex(cell)
+
+	return [[value(cell) for cell in row] for row in matrix]
+
+
+def multiply(a, b):
+	return [	[a[0][0] * b[0][0] + a[0][1] * b[1][0], a[0][0] * b[0][1] + a[0][1] * b[1][1]],
+				[a[1][0] * b[0][0] + a[1][1] * b[1][0], a[1][0] * b[0][1] + a[1][1] * b[1][1]] ]
+
+
+def is_identity(matrix):
+	# identity up to global phase
+	return abs(matrix[0][1]) < TOLERANCE and abs(matrix[1][0]) < TOLERANCE and abs(matrix[0][0] - matrix[1][1]) < TOLERANCE
+
+
+def u3_params(matrix):
+	"""
+	(theta, phi, lambda) of u3 equal to matrix up to global phase
+	"""
+	theta = 2 * math.atan2(abs(matrix[1][0]), abs(matrix[0][0]))
+
+	if abs(matrix[1][0]) < TOLERANCE:
+		# diagonal: only phi + lambda matters
+		phase = cmath.phase(matrix[0][0])
+		return (0.0, 0.0, cmath.phase(matrix[1][1]) - phase)
+
+	if abs(matrix[0][0]) < TOLERANCE:
+		# anti-diagonal: only phi - lambda matters
+		phase = cmath.phase(-matrix[0][1])
+		return (theta, cmath.phase(matrix[1][0]) - phase, 0.0)
+
+	phase = cmath.phase(matrix[0][0])
+	return (theta, cmath.phase(matrix[1][0]) - phase, cmath.phase(-matrix[0][1]) - phase)
+
+
+def cancels(first, second):
+	name = second["name"]
+	if name in SELF_INVERSE:
+		return first["name"] == name and same_qubits(first["qubits"], second["qubits"], name)
+	if name in INVERSES:
+		return first["name"] == INVERSES[name] and list(first["qubits"]) == list(second["qubits"])
+	return False
+
+
+def optimize_instructions(instructions):
+	"""
+	Returns optimized copy of Qobj instruction list (instructions are not modified)
+	"""
+	gate_defs = get_gate_defs()
+
+	kept = []
+	stacks = {}
+
+	#
+	# Index in kept -> product matrix of merged run of rotations, written as u3 at the end
+	#
+	runs = {}
+
+	def push(index, qubits):
+		for qubit in qubits:
+			stack = stacks.get(qubit)
+			if stack is None:
+				stack = []
+				stacks[qubit] = stack
+			stack.append(index)
+
+	def top(qubits):
+		"""
+		Index of instruction on top of all qubits' stacks, or None if tops differ
+		"""
+		index = None
+		for qubit in qubits:
+			stack = stacks.get(qubit)
+			if stack is None or len(stack) == 0:
+				return None
+			if index is None:
+				index = stack[-1]
+			elif stack[-1] != index:
+				return None
+		return index
+
+	def remove(index):
+		for qubit in kept[index]["qubits"]:
+			stacks[qubit].pop()
+		kept[index] = None
+		runs.pop(index, None)
+
+	for instruction in instructions:
+		name = instruction.get("name", "")
+
+		if name == "barrier":
+			kept.append(instruction)
+			if "qubits" in instruction and len(instruction["qubits"]) > 0:
+				push(len(kept) - 1, instruction["qubits"])
+			else:
+				stacks = {}
+			continue
+
+		qubits = instruction.get("qubits", [])
+		if name in ("bfunc", "measure") or len(qubits) == 0 or not is_plain_gate(instruction):
+			kept.append(instruction)
+			push(len(kept) - 1, qubits)
+			continue
+
+		if name in IDENTITIES:
+			continue
+
+		previous_index = top(qubits)
+		previous = kept[previous_index] if previous_index is not None else None
+		if previous is not None and is_plain_gate(previous) and len(previous.get("qubits", [])) == len(qubits):
+			if previous_index not in runs and cancels(previous, instruction):
+				remove(previous_index)
+				continue
+
+			if name in FUSABLE and previous["name"] in FUSABLE and has_params(instruction, gate_defs) and has_params(previous, gate_defs):
+				if previous_index not in runs and previous["name"] == name and name in ADDITIVE:
+					#
+					# Rotations about the same axis: add angles
+					#
+					angle = previous["params"][0] + instruction["params"][0]
+					if angle == 0:
+						remove(previous_index)
+					else:
+						merged = dict(previous)
+						merged["params"] = [angle]
+						kept[previous_index] = merged
+					continue
+
+				matrix = runs.get(previous_index)
+				if matrix is None:
+					matrix = gate_matrix(previous, gate_defs)
+				matrix = multiply(gate_matrix(instruction, gate_defs), matrix)
+				if is_identity(matrix):
+					remove(previous_index)
+				else:
+					runs[previous_index] = matrix
+				continue
+
+		kept.append(instruction)
+		push(len(kept) - 1, qubits)
+
+	for index in runs:
+		merged = dict(kept[index])
+		merged["name"] = "u3"
+		merged["params"] = list(u3_params(runs[index]))
+		kept[index] = merged
+
+	return [instruction for instruction in kept if instruction is not None]
+
+
+def optimize_experiment(experiment):
+	"""
+	Returns copy of experiment with optimized instructions
+	"""
+	optimized = dict(experiment)
+	optimized["instructions"] = optimize_instructions(experiment["instructions"])
+	return optimized
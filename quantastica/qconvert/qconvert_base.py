@@ -11,15 +11,44 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-import os
-import json
 import re
+import ast
+import math
+import cmath
+import keyword
+import functools
+import threading
+import collections
+
+from .gate_table import get_gate_defs, gate_defs_path
+
+
+def __getattr__(name):
+	#
+	# "gate_defs" used to be loaded on import. It is now loaded on first access.
+	#
+	if name == "gate_defs":
+		return get_gate_defs()
+
+	raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+#
+# Expressions in gate_defs are math.js strings. They are translated to Python
+# expressions, checked against a restricted AST (numbers, names, arithmetic and
+# calls to the cmath functions below) and evaluated without builtins.
+#
+EXPRESSION_FUNCTIONS = {}
+for _function_name in ["sqrt", "exp", "log", "sin", "cos", "tan", "asin", "acos", "atan", "sinh", "cosh", "tanh"]:
+	EXPRESSION_FUNCTIONS[_function_name] = getattr(cmath, _function_name)
+
+EXPRESSION_CONSTANTS = { "pi": cmath.pi, "e": cmath.e }
 
-gate_defs_path = os.path.join(os.path.dirname(__file__), "gate_defs.json")
-with open(gate_defs_path, encoding="utf-8") as file:
-	gate_defs = json.load(file)
+EXPRESSION_GLOBALS = dict(EXPRESSION_FUNCTIONS)
+EXPRESSION_GLOBALS.update(EXPRESSION_CONSTANTS)
+EXPRESSION_GLOBALS["__builtins__"] = {}
 
-from cmath import *
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant, ast.Load,
+					ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
 
 def is_float_str(s):
 	try:
@@ -28,10 +57,13 @@ def is_float_str(s):
 	except:
 		return False
 
-import functools
+def clean_param_name(param_name):
+	# lambda appears as variable name in some expressions, but is reserved word in python
+	if keyword.iskeyword(param_name):
+		return "_" + param_name
+	return param_name
 
-@functools.lru_cache(maxsize=1024)
-def compile_expression(s):
+def mathjs_to_python(s):
 	expression = ""
 	tokens = re.findall(r"(\b\w*[\.]?\w+\b|[\(\)\+\*\-\/])", s)
 	prev_tok = None
@@ -42,14 +74,51 @@ def compile_expression(s):
 				tok = "1j"
 			else:
 				tok = "j"
-
-		# lambda appears as variable name in some expressions, but is reserved word in python
-		if tok == "lambda":
-			tok = "_lambda"
+		elif tok[-1] == "i" and is_float_str(tok[:-1]):
+			# imaginary literal e.g. "0.5i"
+			tok = tok[:-1] + "j"
+		else:
+			tok = clean_param_name(tok)
 
 		expression += tok
 		prev_tok = tok
-	return compile(expression,"",'eval')
+	return expression
+
+def check_expression(expression, param_names=None):
+	tree = ast.parse(expression, mode="eval")
+	for node in ast.walk(tree):
+		if not isinstance(node, EXPRESSION_NODES):
+			raise Exception("Unsupported expression \"" + expression + "\".")
+
+		if isinstance(node, ast.Constant) and type(node.value) not in (int, float, complex):
+			raise Exception("Unsupported constant in expression \"" + expression + "\".")
+
+		if isinstance(node, ast.Call):
+			if not isinstance(node.func, ast.Name) or node.func.id not in EXPRESSION_FUNCTIONS or len(node.keywords) > 0:
+				raise Exception("Unsupported function call in expression \"" + expression + "\".")
+
+		if isinstance(node, ast.Name) and node.id not in EXPRESSION_GLOBALS:
+			if param_names is not None and node.id not in param_names:
+				raise Exception("Unknown variable \"" + node.id + "\" in expression \"" + expression + "\".")
+	return tree
+
+def expression_is_complex(tree):
+	# cmath functions always return complex, and complex propagates through arithmetic
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Call) or (isinstance(node, ast.Constant) and isinstance(node.value, complex)):
+			return True
+	return False
+
+def expression_uses_names(tree):
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Name) and node.id not in EXPRESSION_GLOBALS:
+			return True
+	return False
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(s):
+	tree = check_expression(mathjs_to_python(s))
+	return compile(tree, "", "eval")
 
 def eval_mathjs_string(s, params):
 	# evaluate expression
@@ -59,50 +128,234 @@ def eval_mathjs_string(s, params):
 	clean_params = {}
 	if params is not None:
 		for param_name in params:
-			# lambda appears as variable name in some expressions, but is reserved word in python
-			if param_name == "lambda":
-				clean_name = "_lambda"
-			else:
-				clean_name = param_name
+			clean_params[clean_param_name(param_name)] = params[param_name]
 
-			clean_params[clean_name] = params[param_name]
+	return eval(prepared, EXPRESSION_GLOBALS, clean_params)
 
-	return eval(prepared, None, clean_params)
+def matrix_cell_value(ev):
+	if isinstance(ev, complex):
+		return { "type": "complex", "re": ev.real, "im": ev.imag }
+	return ev
 
-def eval_mathjs_matrix(matrix, params):
-	res_matrix = []
+def compile_matrix(matrix, param_names):
+	"""
+	Compile gate_defs matrix into a function which takes param values positionally
+	(in param_names order) and returns evaluated matrix.
+
+	Cells which don't depend on params are evaluated once, here.
+	"""
+	clean_names = [clean_param_name(param_name) for param_name in param_names]
+
+	constants = {}
+	body = ""
+	rows = []
 	for row in matrix:
-		res_row = []
+		cells = []
 		for cell in row:
-			if isinstance(cell, str):
-				ev = eval_mathjs_string(cell, params)
+			if not isinstance(cell, str):
+				name = "_k" + str(len(constants))
+				constants[name] = cell
+				cells.append(name)
+				continue
+
+			expression = mathjs_to_python(cell)
+			tree = check_expression(expression, clean_names)
 
-				if isinstance(ev, complex):
-					res_row.append({ "type": "complex", "re": ev.real, "im": ev.imag })
-				else:
-					res_row.append(ev)
+			if not expression_uses_names(tree):
+				name = "_k" + str(len(constants))
+				constants[name] = matrix_cell_value(eval(compile(tree, "", "eval"), EXPRESSION_GLOBALS, {}))
+				cells.append(name)
+				continue
+
+			name = "_t" + str(len(rows)) + "_" + str(len(cells))
+			body += "\t" + name + " = " + expression + "\n"
+			if expression_is_complex(tree):
+				cells.append("{ \"type\": \"complex\", \"re\": " + name + ".real, \"im\": " + name + ".imag }")
 			else:
-				res_row.append(cell)
+				cells.append("_cell(" + name + ")")
+		rows.append("[" + ", ".join(cells) + "]")
+
+	source = "def _matrix(" + ", ".join(clean_names) + "):\n"
+	source += body
+	source += "\treturn [" + ", ".join(rows) + "]\n"
+
+	scope = dict(EXPRESSION_GLOBALS)
+	scope.update(constants)
+	scope["_cell"] = matrix_cell_value
+	exec(compile(source, "<gate matrix>", "exec"), scope)
+	return scope["_matrix"]
+
+#
+# Compiled matrix functions, keyed by id of the matrix (kept alive in the value) and param names
+#
+compiled_matrices = {}
 
-		res_matrix.append(res_row)
-	return res_matrix
+def get_matrix_function(matrix, param_names):
+	key = (id(matrix), tuple(param_names))
+	compiled = compiled_matrices.get(key)
+	if compiled is None or compiled[0] is not matrix:
+		compiled = (matrix, compile_matrix(matrix, param_names))
+		compiled_matrices[key] = compiled
+	return compiled[1]
+
+def eval_mathjs_matrix(matrix, params):
+	if params is None:
+		params = {}
+	return get_matrix_function(matrix, list(params))(*params.values())
+
+
+def normalize_param(value, precision=None):
+	if precision is not None:
+		value = round(value, precision)
+
+	# keep sign of zero, it can show up in the evaluated matrix
+	if value == 0 and isinstance(value, float):
+		return (value, math.copysign(1.0, value))
+
+	return value
+
+def matrix_key(name, params_dict, precision=None):
+	"""
+	Key which identifies evaluated matrix: gate name + normalized param values. Raises TypeError if params are unhashable.
+	"""
+	values = tuple(params_dict.values())
+	if precision is not None or 0 in values:
+		values = tuple(normalize_param(value, precision) for value in values)
+
+	key = (name,) + values
+	hash(key)
+	return key
+
+
+class MatrixCache:
+	"""
+	Bounded LRU cache of evaluated gate matrices keyed by (gate name, parameter values).
+
+	Matrices of parameterless gates are kept in a separate table and never evicted.
+	If precision is set, parameters are rounded to that many decimals before lookup
+	and the matrix is evaluated from the rounded values.
+
+	Cached matrices are shared between all callers and must not be modified.
+	"""
+
+	def __init__(self, maxsize=4096, precision=None):
+		self.maxsize = maxsize
+		self.precision = precision
+		self.lock = threading.Lock()
+		self.constant = {}
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def clear(self):
+		with self.lock:
+			self.constant.clear()
+			self.entries.clear()
+			self.hits = 0
+			self.misses = 0
+			self.evictions = 0
+
+	def info(self):
+		return {	"hits": self.hits,
+					"misses": self.misses,
+					"evictions": self.evictions,
+					"size": len(self.entries),
+					"constant_size": len(self.constant),
+					"maxsize": self.maxsize }
+
+	def get(self, name, gate_def, params_dict, precision=None):
+		if precision is None:
+			precision = self.precision
+
+		#
+		# Parameterless gate: evaluated once per process
+		#
+		if len(params_dict) == 0:
+			with self.lock:
+				matrix = self.constant.get(name)
+				if matrix is not None:
+					self.hits += 1
+					return matrix
+
+			matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+
+			with self.lock:
+				self.misses += 1
+				self.constant[name] = matrix
+			return matrix
+
+		try:
+			key = matrix_key(name, params_dict, precision)
+		except TypeError:
+			#
+			# Unhashable or non-numeric parameters: don't cache
+			#
+			return eval_mathjs_matrix(gate_def["matrix"], params_dict)
+
+		with self.lock:
+			matrix = self.entries.get(key)
+			if matrix is not None:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return matrix
+
+		if precision is not None:
+			params_dict = { param_name: round(params_dict[param_name], precision) for param_name in params_dict }
+
+		matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+
+		with self.lock:
+			self.misses += 1
+			self.entries[key] = matrix
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+		return matrix
+
+
+#
+# Process-wide cache shared by all conversions
+#
+matrix_cache = MatrixCache()
 
 
 class QConvertBase:
 
+	#
+	# stats.ConversionProfiler while converting with "stats" option
+	#
+	profiler = None
+
 	def __init__(self):
 		self.clear()
 
 	def clear(self):
 		self.result = None
 		self.results = []
+		self.stats = None
 
 	def convert(self, input_data, options={ "all_experiments": False }):
 		self.clear()
 
 		self.options = options if options is not None else {}
 
-		self.converter(input_data, options)
+		if "stats" in self.options:
+			from . import stats
+			if stats.stats_requested(self.options):
+				profiler = stats.ConversionProfiler(self)
+				profiler.start()
+				try:
+					self.converter(input_data, options)
+				finally:
+					for result in self.results:
+						profiler.add_result(result)
+					profiler.stop()
+			else:
+				self.converter(input_data, options)
+		else:
+			self.converter(input_data, options)
 
 		all_experiments = False
 		if self.options is not None and "all_experiments" in self.options and self.options["all_experiments"]:
@@ -127,3 +380,11 @@ class QConvertBase:
 
 	def on_end(self, data):
 		pass
+
+	def on_span(self, name, start, seconds):
+		"""
+		Called with "stats" option when a phase ends: start is time.perf_counter() value. Override, or give
+		"span_callback" option, to forward spans to tracing.
+		"""
+		if "span_callback" in self.options and self.options["span_callback"] is not None:
+			self.options["span_callback"](name, start, seconds)
@@ -12,11 +12,112 @@
 # that they have been altered from the originals.
 
 
-from .qconvert_base import QConvertBase, gate_defs, eval_mathjs_matrix
+from .qconvert_base import QConvertBase, get_gate_defs, eval_mathjs_matrix, matrix_cache
+from .events import InstructionEvent, GateEvent, MeasureEvent, BarrierEvent
+from .ir import OP_GATE, OP_MEASURE, OP_BARRIER
+
+
+class ExperimentState:
+	"""
+	Per-experiment data shared by instruction handlers
+	"""
+
+	__slots__ = ("info", "gate_defs", "creg_masks", "memory_cregs", "conditions",
+					"use_matrix_cache", "matrix_cache_precision", "batch_matrices", "lazy_gates")
+
+
+class LazyGateEvent(GateEvent):
+	"""
+	GateEvent for converters which don't use params_dict and matrix (see QConvertQobj.gate_event_fields):
+	they are evaluated from the event's fields on first access, so subclasses which read them still work.
+	"""
+
+	#
+	# Properties, not __getattr__: a class with __getattr__ makes every attribute access slower
+	#
+	__slots__ = ("state", "instruction_index", "_params_dict", "_matrix")
+
+	def __init__(self, name, gate_def, condition, params, qubits, info, state, instruction_index):
+		self.name = name
+		self.gate_def = gate_def
+		self.condition = condition
+		self.params = params
+		self.qubits = qubits
+		self.info = info
+		self.state = state
+		self.instruction_index = instruction_index
+
+	@property
+	def params_dict(self):
+		try:
+			return self._params_dict
+		except AttributeError:
+			pass
+
+		params_dict = {}
+		if self.gate_def is not None and "params" in self.gate_def:
+			for param_index, param_name in enumerate(self.gate_def["params"]):
+				params_dict[param_name] = self.params[param_index]
+
+		self._params_dict = params_dict
+		return params_dict
+
+	@params_dict.setter
+	def params_dict(self, value):
+		self._params_dict = value
+
+	@property
+	def matrix(self):
+		try:
+			return self._matrix
+		except AttributeError:
+			pass
+
+		matrix = None
+		gate_def = self.gate_def
+		state = self.state
+		if gate_def is not None and "matrix" in gate_def:
+			if state.batch_matrices is not None and state.batch_matrices[self.instruction_index] is not None:
+				matrix = state.batch_matrices[self.instruction_index][0]
+			elif state.use_matrix_cache:
+				matrix = matrix_cache.get(self.name, gate_def, self.params_dict, state.matrix_cache_precision)
+			else:
+				matrix = eval_mathjs_matrix(gate_def["matrix"], self.params_dict)
+
+		self._matrix = matrix
+		return matrix
+
+	@matrix.setter
+	def matrix(self, value):
+		self._matrix = value
 
 
 class QConvertQobj(QConvertBase):
 
+	#
+	# Slice of gate_defs needed by the converter (see gate_table.GATE_DEF_SLICES). None means full table.
+	#
+	gate_defs_target = None
+
+	#
+	# Instruction name -> name of method which converts it: method(state, instruction_index, instruction, name).
+	# Instructions not listed here are gates (convert_gate).
+	#
+	instruction_handlers = {	"bfunc": "convert_bfunc",
+								"measure": "convert_measure",
+								"barrier": "convert_barrier" }
+
+	#
+	# Matrix markers (per instruction, as batch matrices) while converting template.ConversionTemplate
+	#
+	slot_matrices = None
+
+	#
+	# GateEvent fields read by on_gate. None means all. If "params_dict" or "matrix" is not listed, gates
+	# are passed as LazyGateEvent and these are evaluated only if accessed.
+	#
+	gate_event_fields = None
+
 	def converter(self, qobj, options = { "all_experiments": False }):
 
 		all_experiments = False
@@ -29,22 +130,181 @@ class QConvertQobj(QConvertBase):
 			else:
 				return None
 
-		for experiment in qobj["experiments"]:
-			self.result = None
-			self.experiment_converter(experiment)
-			self.results.append(self.result)
+		experiments = qobj["experiments"]
+		if not all_experiments:
+			experiments = experiments[:1]
+
+		#
+		# Qubit maps are made here, as experiments from result cache or workers are not converted by this converter
+		#
+		if self.options is not None and "qubit_maps" in self.options:
+			from . import compact
+			for experiment in experiments:
+				compact.record_qubit_map(self.options, experiment)
 
-			if not all_experiments:
-				return
+		results = [None] * len(experiments)
+		pending = list(range(len(experiments)))
 
-	def experiment_converter(self, experiment):
+		#
+		# Take what we can from result cache
+		#
+		cache = None
+		if self.options is not None and "result_cache" in self.options:
+			from . import result_cache
+			cache = result_cache.get_result_cache(self.options)
+
+		if cache is not None:
+			keys = [result_cache.result_key(type(self), experiment, self.options) for experiment in experiments]
+			pending = []
+			for index in range(len(experiments)):
+				if keys[index] is not None:
+					results[index] = cache.get(keys[index])
+				if results[index] is None:
+					pending.append(index)
 
+		#
+		# Convert experiments in process pool?
+		#
+		workers = 0
+		if self.options is not None and "workers" in self.options and self.options["workers"] is not None:
+			workers = int(self.options["workers"])
+
+		converted = None
+		if workers > 1 and len(pending) > 1:
+			from . import parallel
+
+			worker_options = dict(self.options)
+			worker_options.pop("result_cache", None)
+			worker_options.pop("stats", None)
+			worker_options.pop("span_callback", None)
+			worker_options.pop("qubit_maps", None)
+			if parallel.can_run_in_pool(type(self), worker_options):
+				reports = None
+				if self.profiler is not None:
+					reports = []
+					self.profiler.begin("parallel")
+				converted = parallel.convert_experiments(type(self), worker_options, [experiments[index] for index in pending], workers, reports)
+				if self.profiler is not None:
+					self.profiler.end()
+					for report in reports:
+						self.profiler.add_worker_report(report)
+
+		if converted is None:
+			templates = None
+			if self.options is not None and "parameter_templates" in self.options:
+				from . import template
+				templates = template.get_template_cache(self.options)
+
+			converted = []
+			for index in pending:
+				converted.append(self.convert_experiment(experiments[index], templates))
+
+		for index, result in zip(pending, converted):
+			results[index] = result
+			if cache is not None and keys[index] is not None:
+				cache.put(keys[index], result)
+
+		self.results = results
+
+	def iter_convert(self, experiments, options=None):
+		"""
+		Convert experiments from any iterable (e.g. qobj_stream.iter_experiments()) one by one, yielding results
+		"""
+		self.clear()
+
+		self.options = options if options is not None else {}
+
+		profiler = None
+		if "stats" in self.options:
+			from . import stats
+			if stats.stats_requested(self.options):
+				profiler = stats.ConversionProfiler(self)
+				profiler.start()
+
+		try:
+			for result in self.iter_experiments(experiments):
+				if profiler is not None:
+					profiler.add_result(result)
+				yield result
+		finally:
+			if profiler is not None:
+				profiler.stop()
+
+	def iter_experiments(self, experiments):
+		cache = None
+		if "result_cache" in self.options:
+			from . import result_cache
+			cache = result_cache.get_result_cache(self.options)
+
+		templates = None
+		if "parameter_templates" in self.options:
+			from . import template
+			templates = template.get_template_cache(self.options)
+
+		compact = None
+		if "qubit_maps" in self.options:
+			from . import compact
+
+		for experiment in experiments:
+			if compact is not None:
+				compact.record_qubit_map(self.options, experiment)
+
+			key = None
+			if cache is not None:
+				key = result_cache.result_key(type(self), experiment, self.options)
+				if key is not None:
+					result = cache.get(key)
+					if result is not None:
+						yield result
+						continue
+
+			result = self.convert_experiment(experiment, templates)
+
+			if key is not None:
+				cache.put(key, result)
+
+			yield result
+
+	def convert_experiment(self, experiment, templates=None):
+		"""
+		Returns converted experiment. With templates (template.TemplateCache), output is made from template of
+		experiment with the same structure (made first if there is none).
+		"""
+		if templates is not None:
+			return templates.convert(self, experiment)
+
+		self.result = None
+		self.experiment_converter(experiment)
+		return self.result
+
+	def prepare_experiment(self, experiment):
+		"""
+		Returns experiment as converted: with "compact_qubits" and "peephole" options applied
+		"""
 		#
 		# Do we have header in Qobj?
 		#
 		if "header" not in experiment:
 			raise Exception("Qobj header not found.")
 
+		if self.options is not None and "compact_qubits" in self.options and self.options["compact_qubits"]:
+			from . import compact
+			experiment = compact.compact_experiment(experiment)
+
+		if self.options is not None and "peephole" in self.options and self.options["peephole"]:
+			from . import peephole
+			experiment = peephole.optimize_experiment(experiment)
+
+		return experiment
+
+	def experiment_converter(self, experiment):
+
+		profiler = self.profiler
+		if profiler is not None:
+			profiler.begin("setup")
+
+		experiment = self.prepare_experiment(experiment)
+
 		header = experiment["header"]
 		instructions = experiment["instructions"]
 
@@ -94,25 +354,85 @@ class QConvertQobj(QConvertBase):
 													"len": creg_len,
 													"mask": creg_mask }
 
-					creg_masks[str(creg_mask)] = {	"memory_offset": total_bits,
-													"name": creg_name }
+					creg_masks[creg_mask] = {	"memory_offset": total_bits,
+												"name": creg_name }
 
 					total_bits += creg_len
 
+		#
+		# Memory slot -> (creg name, bit in creg), so measure doesn't need to search cregs
+		#
+		memory_cregs = []
+		for creg_name in info["cregs"]:
+			for creg_bit in range(info["cregs"][creg_name]["len"]):
+				memory_cregs.append((creg_name, creg_bit))
+
 		# 
 		# Get number of qubits
 		#
 		if "n_qubits" in header:
 			info["qubits"] = header["n_qubits"]
 
+		if profiler is not None:
+			profiler.end()
+
 		self.on_start({	"experiment": experiment,
 						"info": info })
+		state = ExperimentState()
+		state.info = info
+		state.gate_defs = get_gate_defs(self.gate_defs_target)
+		state.creg_masks = creg_masks
+		state.memory_cregs = memory_cregs
+		state.conditions = {}
+		state.lazy_gates = self.lazy_gate_events()
 
-		conditions = {}
+		#
+		# Use shared matrix cache?
+		#
+		state.use_matrix_cache = True
+		if self.options is not None and "matrix_cache" in self.options and not self.options["matrix_cache"]:
+			state.use_matrix_cache = False
 
-		for instruction in instructions:
+		state.matrix_cache_precision = None
+		if self.options is not None and "matrix_cache_precision" in self.options:
+			state.matrix_cache_precision = self.options["matrix_cache_precision"]
+
+		#
+		# Evaluate matrices of parametrized gates with NumPy, in one batch per gate?
+		#
+		state.batch_matrices = None
+		if self.options is not None and "vectorize" in self.options and self.options["vectorize"] and self.uses_matrices():
+			from . import numpy_batch
+			if numpy_batch.numpy_available():
+				if profiler is not None:
+					profiler.begin("vectorize")
+				state.batch_matrices = numpy_batch.evaluate_experiment_matrices(instructions, state.gate_defs)
+				if profiler is not None:
+					profiler.end()
+
+		if self.slot_matrices is not None:
+			state.batch_matrices = self.slot_matrices
+
+		#
+		# Bound handler per instruction name
+		#
+		handlers = {}
+		for handler_name in self.instruction_handlers:
+			handlers[handler_name] = getattr(self, self.instruction_handlers[handler_name])
+		convert_gate = self.convert_gate
+
+		#
+		# Don't build instruction events if on_qobj_instruction is not overridden
+		#
+		on_qobj_instruction = None
+		if type(self).on_qobj_instruction is not QConvertQobj.on_qobj_instruction:
+			on_qobj_instruction = self.on_qobj_instruction
+
+		for instruction_index in range(len(instructions)):
+			instruction = instructions[instruction_index]
 
-			self.on_qobj_instruction({ "instruction": instruction, "info": info })
+			if on_qobj_instruction is not None:
+				on_qobj_instruction(InstructionEvent(instruction, info))
 
 			name = ""
 			if "name" in instruction:
@@ -124,110 +444,242 @@ class QConvertQobj(QConvertBase):
 			if name == "iden":
 				name = "id"
 
-			if name == "bfunc":
-				#
-				# Classical condition
-				#
-				bfunc_mask = int(instruction["mask"], 0)
-				bfunc_val = int(instruction["val"], 0)
-				if not str(bfunc_mask) in creg_masks:
-					raise Exception("Cannot find classical register by mask in bfunc")
+			handlers.get(name, convert_gate)(state, instruction_index, instruction, name)
+
+		self.on_end({	"experiment": experiment,
+						"info": info })
+
 
-				bfunc_relation = None
-				if("relation" in instruction):
-					bfunc_relation = instruction["relation"]
 
-				bfunc_creg = creg_masks[str(bfunc_mask)]
+	def convert_ir(self, ir):
+		"""
+		Convert experiment already parsed into ir.ExperimentIR (result is in self.result). Calls the same hooks
+		with the same events as experiment_converter, but instructions are read from IR columns: instruction
+		handlers (instruction_handlers) are not used.
+		"""
+		info = ir.make_info(self.options)
 
-				conditions[instruction["register"]] = { "mask": bfunc_mask,
+		self.on_start({	"experiment": ir.experiment,
+						"info": info })
+
+		gate_defs = get_gate_defs(self.gate_defs_target)
+		row_defs = [gate_defs.get(name) for name in ir.name_table]
+		row_param_names = [gate_def["params"] if gate_def is not None and "params" in gate_def else None for gate_def in row_defs]
+
+		#
+		# Gate events with params_dict and matrix evaluated on access (see gate_event_fields)
+		#
+		lazy_state = None
+		if self.lazy_gate_events():
+			lazy_state = ExperimentState()
+			lazy_state.batch_matrices = None
+			lazy_state.use_matrix_cache = not ("matrix_cache" in self.options and not self.options["matrix_cache"])
+			lazy_state.matrix_cache_precision = self.options.get("matrix_cache_precision")
+
+		#
+		# Matrices are evaluated (once per IR) only if converter's gate definitions have them and it uses them
+		#
+		matrices = None
+		matrix_arrays = None
+		row_matrices = [gate_def is not None and "matrix" in gate_def for gate_def in row_defs]
+		if True in row_matrices and (lazy_state is None or "matrix" in self.gate_event_fields):
+			matrices, matrix_arrays = ir.matrices(self.options)
+
+		on_qobj_instruction = None
+		if type(self).on_qobj_instruction is not QConvertQobj.on_qobj_instruction:
+			on_qobj_instruction = self.on_qobj_instruction
+		on_gate = self.on_gate
+
+		#
+		# Columns as lists: indexing a list is cheaper than indexing array
+		#
+		instructions = ir.instructions
+		name_table = ir.name_table
+		ops = ir.ops.tolist()
+		names = ir.names.tolist()
+		row_qubits = ir.row_qubits
+		row_params = ir.row_params
+		conditions = ir.conditions.tolist()
+		condition_table = ir.condition_table
+
+		for index in range(len(ops)):
+			if on_qobj_instruction is not None:
+				on_qobj_instruction(InstructionEvent(instructions[index], info))
+
+			op = ops[index]
+			if op == OP_GATE:
+				name_id = names[index]
+
+				gate_params = row_params[index]
+
+				condition = None
+				if conditions[index] >= 0:
+					condition = condition_table[conditions[index]]
+
+				if lazy_state is not None:
+					gate_data = LazyGateEvent(name_table[name_id], row_defs[name_id], condition, gate_params, row_qubits[index], info, lazy_state, index)
+					if matrices is not None and row_matrices[name_id]:
+						gate_data.matrix = matrices[index]
+					on_gate(gate_data)
+					continue
+
+				params_dict = {}
+				if row_param_names[name_id] is not None:
+					param_index = 0
+					for param_name in row_param_names[name_id]:
+						params_dict[param_name] = gate_params[param_index]
+						param_index += 1
+
+				gate_data = GateEvent(	name_table[name_id], row_defs[name_id], condition, gate_params, params_dict,
+										row_qubits[index],
+										matrices[index] if row_matrices[name_id] else None, info)
+
+				if matrix_arrays is not None:
+					gate_data.matrix_array = matrix_arrays[index]
+
+				on_gate(gate_data)
+
+			elif op == OP_MEASURE:
+				memory_cregs = ir.memory_cregs
+				measure_qubits = row_qubits[index]
+				measure_memory = ir.row_memory[index]
+				for qindex in range(len(measure_qubits)):
+					memory = measure_memory[qindex]
+
+					if type(memory) is int and 0 <= memory < len(memory_cregs):
+						dest_creg_name, dest_bit = memory_cregs[memory]
+					else:
+						dest_creg_name, dest_bit = self.find_memory_creg(info, memory)
+
+					self.on_measure(MeasureEvent(measure_qubits[qindex], dest_creg_name, dest_bit, memory, info))
+
+			elif op == OP_BARRIER:
+				self.on_barrier(BarrierEvent(info))
+
+		self.on_end({	"experiment": ir.experiment,
+						"info": info })
+
+	def uses_matrices(self):
+		"""
+		False if on_gate doesn't read GateEvent.matrix: matrices are evaluated only on access then
+		"""
+		return self.gate_event_fields is None or "matrix" in self.gate_event_fields
+
+	def lazy_gate_events(self):
+		fields = self.gate_event_fields
+		return fields is not None and ("params_dict" not in fields or "matrix" not in fields)
+
+	def convert_bfunc(self, state, instruction_index, instruction, name):
+		#
+		# Classical condition
+		#
+		bfunc_mask = int(instruction["mask"], 0)
+		bfunc_val = int(instruction["val"], 0)
+		if not bfunc_mask in state.creg_masks:
+			raise Exception("Cannot find classical register by mask in bfunc")
+
+		bfunc_relation = None
+		if("relation" in instruction):
+			bfunc_relation = instruction["relation"]
+
+		bfunc_creg = state.creg_masks[bfunc_mask]
+
+		state.conditions[instruction["register"]] = {	"mask": bfunc_mask,
 														"val": bfunc_val,
 														"memory": bfunc_creg["memory_offset"],
 														"relation": bfunc_relation,
 														"creg_name": bfunc_creg["name"],
 														"creg_value": bfunc_val >> bfunc_creg["memory_offset"] }
 
-			elif name == "measure":
-				for qindex in range(len(instruction["qubits"])):
-					memory = instruction["memory"][qindex]
-					qubit = instruction["qubits"][qindex]
-					dest_creg_name = None
-					dest_bit = None
-
-					total_bits = 0
-					for creg_name in info["cregs"]:
-						creg_info = info["cregs"][creg_name]
-						if (total_bits + creg_info["len"]) > memory:
-							dest_creg_name = creg_name
-							dest_bit = memory - total_bits
-							break
-						total_bits += creg_info["len"]
-
-					self.on_measure({	"qubit": qubit,
-										"creg_name": dest_creg_name,
-										"creg_bit": dest_bit,
-										"memory": memory,
-										"info": info })
-
-			elif name == "barrier":
-				#
-				# Barrier
-				#
-				self.on_barrier({	"info": info })
-
-				pass
+	def convert_measure(self, state, instruction_index, instruction, name):
+		memory_cregs = state.memory_cregs
+		for qindex in range(len(instruction["qubits"])):
+			memory = instruction["memory"][qindex]
+			qubit = instruction["qubits"][qindex]
+
+			if type(memory) is int and 0 <= memory < len(memory_cregs):
+				dest_creg_name, dest_bit = memory_cregs[memory]
 			else:
-				#
-				# Regular gate
-				#
-
-				#
-				# Find gateDef
-				#
-				params = None
-				if "params" in instruction:
-					params = instruction["params"]
-
-				gate_def = None
-				params_dict = {}
-				matrix = None
-				if name in gate_defs:
-					gate_def = gate_defs[name]
+				dest_creg_name, dest_bit = self.find_memory_creg(state.info, memory)
 
-					if "params" in gate_def:
-						param_index = 0
-						for param_name in gate_def["params"]:
-							params_dict[param_name] = params[param_index]
-							param_index += 1
+			self.on_measure(MeasureEvent(qubit, dest_creg_name, dest_bit, memory, state.info))
 
-					if "matrix" in gate_def:
-						matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+	def convert_barrier(self, state, instruction_index, instruction, name):
+		self.on_barrier(BarrierEvent(state.info))
 
+	def convert_gate(self, state, instruction_index, instruction, name):
+		#
+		# Find gateDef
+		#
+		params = None
+		if "params" in instruction:
+			params = instruction["params"]
+
+		if state.lazy_gates:
+			condition = None
+			if "conditional" in instruction:
+				condition = state.conditions[instruction["conditional"]]
+
+			qubits = []
+			if "qubits" in instruction:
+				qubits = instruction["qubits"]
+
+			self.on_gate(LazyGateEvent(name, state.gate_defs.get(name), condition, params, qubits, state.info, state, instruction_index))
+			return
+
+		gate_def = None
+		params_dict = {}
+		matrix = None
+		matrix_array = None
+		gate_defs = state.gate_defs
+		if name in gate_defs:
+			gate_def = gate_defs[name]
+
+			if "params" in gate_def:
+				param_index = 0
+				for param_name in gate_def["params"]:
+					params_dict[param_name] = params[param_index]
+					param_index += 1
+
+			if "matrix" in gate_def:
+				batch_matrices = state.batch_matrices
+				if batch_matrices is not None and batch_matrices[instruction_index] is not None:
+					matrix, matrix_array = batch_matrices[instruction_index]
+				elif state.use_matrix_cache:
+					matrix = matrix_cache.get(name, gate_def, params_dict, state.matrix_cache_precision)
+				else:
+					matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+
+		condition = None
+		if "conditional" in instruction:
+			#
+			# Add classical condition
+			#
+			condition = state.conditions[instruction["conditional"]]
 
-				condition = None
-				if "conditional" in instruction:
-					#
-					# Add classical condition
-					#
-					condition = conditions[instruction["conditional"]]
-
-
-				qubits = []
-				if "qubits" in instruction:
-					qubits = instruction["qubits"]
-
-				self.on_gate({	"name": name,
-								"gate_def": gate_def,
-								"condition": condition,
-								"params": params,
-								"params_dict": params_dict,
-								"qubits": qubits,
-								"matrix": matrix,
-								"info": info })
+		qubits = []
+		if "qubits" in instruction:
+			qubits = instruction["qubits"]
 
-		self.on_end({	"experiment": experiment,
-						"info": info })
+		gate_data = GateEvent(name, gate_def, condition, params, params_dict, qubits, matrix, state.info)
+
+		if state.batch_matrices is not None:
+			gate_data.matrix_array = matrix_array
 
+		self.on_gate(gate_data)
 
+	def find_memory_creg(self, info, memory):
+		#
+		# Slot outside of cregs (or not an int): search cregs as (creg name, bit), (None, None) if not found
+		#
+		total_bits = 0
+		for creg_name in info["cregs"]:
+			creg_info = info["cregs"][creg_name]
+			if (total_bits + creg_info["len"]) > memory:
+				return creg_name, memory - total_bits
+			total_bits += creg_info["len"]
+
+		return None, None
 
 	def on_qobj_instruction(self, data):
 		pass
@@ -0,0 +1,174 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Incremental Qobj reader: yields experiments[*] one by one without parsing (or
+# holding) the whole document. Only the top-level object is walked by hand,
+# each value is parsed with json.JSONDecoder.raw_decode as soon as it is
+# completely in the buffer.
+#
+
+import os
+import gzip
+import json
+import codecs
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+WHITESPACE = " \t\n\r"
+
+
+def open_source(source):
+	"""
+	Returns (file object, should close). source is path (str or PathLike, gzip is detected) or file object
+	(text, binary, or gzip.GzipFile).
+	"""
+	if isinstance(source, (str, bytes, os.PathLike)):
+		file = open(source, "rb")
+		magic = file.read(2)
+		file.seek(0)
+		if magic == GZIP_MAGIC:
+			file.close()
+			file = gzip.open(source, "rb")
+		return file, True
+
+	return source, False
+
+
+class QobjStreamReader:
+
+	def __init__(self, file, chunk_size=1 << 20):
+		self.file = file
+		self.chunk_size = chunk_size
+		self.decoder = json.JSONDecoder()
+		self.text_decoder = None
+		self.buffer = ""
+		self.pos = 0
+		self.eof = False
+
+		#
+		# Top-level fields other than "experiments", collected while reading
+		#
+		self.fields = {}
+
+	def fill(self, size=None):
+		if self.eof:
+			return False
+
+		if size is None:
+			size = self.chunk_size
+
+		chunk = self.file.read(size)
+		if not chunk:
+			self.eof = True
+			if self.text_decoder is not None:
+				self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(b"", final=True)
+				self.pos = 0
+			return False
+
+		if isinstance(chunk, bytes):
+			if self.text_decoder is None:
+				self.text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+			chunk = self.text_decoder.decode(chunk)
+
+		#
+		# Drop consumed part of the buffer
+		#
+		self.buffer = self.buffer[self.pos:] + chunk
+		self.pos = 0
+		return True
+
+	def peek(self):
+		"""
+		Skip whitespace and return next character ("" at end of input)
+		"""
+		while True:
+			while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+				self.pos += 1
+
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
+
+			if not self.fill():
+				return ""
+
+	def expect(self, chars):
+		char = self.peek()
+		if char == "" or char not in chars:
+			raise Exception("Invalid Qobj JSON: expected one of \"" + chars + "\" but found \"" + char + "\".")
+		self.pos += 1
+		return char
+
+	def value(self):
+		"""
+		Parse next JSON value. Reads more input until the value is complete.
+		"""
+		self.peek()
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+				#
+				# A number at the very end of buffer can continue in the next chunk
+				#
+				if end < len(self.buffer) or self.eof:
+					self.pos = end
+					return value
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+
+			#
+			# Value is not complete: read at least as much as we already have, so big values need few retries
+			#
+			self.fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+	def experiments(self):
+		self.expect("{")
+		if self.peek() == "}":
+			return
+
+		while True:
+			key = self.value()
+			if not isinstance(key, str):
+				raise Exception("Invalid Qobj JSON: object key is not a string.")
+			self.expect(":")
+
+			if key == "experiments":
+				self.expect("[")
+				if self.peek() == "]":
+					self.pos += 1
+				else:
+					while True:
+						yield self.value()
+						if self.expect(",]") == "]":
+							break
+			else:
+				self.fields[key] = self.value()
+
+			if self.expect(",}") == "}":
+				return
+
+
+def iter_experiments(source, chunk_size=1 << 20):
+	"""
+	Yields experiments from Qobj given as path (plain or gzip), or as file object
+	"""
+	file, should_close = open_source(source)
+	try:
+		reader = QobjStreamReader(file, chunk_size)
+		for experiment in reader.experiments():
+			yield experiment
+	finally:
+		if should_close:
+			file.close()
@@ -11,11 +11,15 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-from .qconvert_base import gate_defs, eval_mathjs_string
+from .qconvert_base import get_gate_defs, eval_mathjs_string
 from .qconvert_qobj import QConvertQobj
 
 class QobjToPyquil(QConvertQobj):
 
+	gate_defs_target = "pyquil"
+
+	gate_event_fields = ("name", "gate_def", "condition", "params", "qubits", "info")
+
 	def on_start(self, data):
 
 		info = data["info"]
@@ -27,44 +31,49 @@ class QobjToPyquil(QConvertQobj):
 		#
 		# Used for imports
 		#
-		self.imports = ""
+		self.imports = []
 
 		#
 		# Used for declarations
 		#
-		self.program_head = ""
+		self.program_head = []
 
 		#
 		# Used for program body
 		#
-		self.program_body = ""
+		self.program_body = []
 
 		#
 		# Used for user defined gates
 		#
 		self.def_gate_names = []
 		self.def_param_names = []
-		self.def_params = ""
-		self.def_gates = ""
-		self.decl_gates = ""
-		self.assign_gates = ""
-		self.append_gates = ""
+		self.def_params = []
+		self.def_gates = []
+		self.decl_gates = []
+		self.assign_gates = []
+		self.append_gates = []
+
+		#
+		# Emission plans by gate name
+		#
+		self.emission_plans = {}
 
 		#
 		# Create imports
 		#
-		self.imports += "from pyquil import Program, get_qc\n"
-		self.imports += "from pyquil.gates import *\n"
+		self.imports.append("from pyquil import Program, get_qc\n")
+		self.imports.append("from pyquil.gates import *\n")
 		if info["return_state_vector"]:
-			self.imports += "from pyquil.api import WavefunctionSimulator\n"
+			self.imports.append("from pyquil.api import WavefunctionSimulator\n")
 
 		#
 		# Create Program instance. Add rewiring if user wants exec code for simulated QPU/QPU
 		#
 		if "lattice" in options and options["lattice"] is not None and options["lattice"] != "statevector_simulator" and options["lattice"] != "qasm_simulator" and (options["lattice"].find("q-qvm") < 0):
-			self.program_head += "p = Program('PRAGMA INITIAL_REWIRING \"PARTIAL\"')\n"
+			self.program_head.append("p = Program('PRAGMA INITIAL_REWIRING \"PARTIAL\"')\n")
 		else:
-			self.program_head += "p = Program()\n"
+			self.program_head.append("p = Program()\n")
 
 		#
 		# Declare classical registers
@@ -72,191 +81,106 @@ class QobjToPyquil(QConvertQobj):
 		if "memory_slots" in info:
 			memory_slots = info["memory_slots"]
 			if memory_slots > 0:
-				self.program_head += "\n"
+				self.program_head.append("\n")
 				if not info["classical_control_present"]:
-					self.program_head += "ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ")\n"
+					self.program_head.append("ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ")\n")
 				else:
 					if memory_slots > 1:
-						self.program_head += "sha_reg = p.declare('sha_reg', memory_type='INTEGER', memory_size=" + str(memory_slots) + ")\n"
-						self.program_head += "int_reg = p.declare('int_reg', memory_type='INTEGER', memory_size=" + str(memory_slots) + ")\n"
-						self.program_head += "ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ", shared_region='sha_reg')\n"
+						self.program_head.append("sha_reg = p.declare('sha_reg', memory_type='INTEGER', memory_size=" + str(memory_slots) + ")\n")
+						self.program_head.append("int_reg = p.declare('int_reg', memory_type='INTEGER', memory_size=" + str(memory_slots) + ")\n")
+						self.program_head.append("ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ", shared_region='sha_reg')\n")
 					else:
-						self.program_head += "ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ")\n"
+						self.program_head.append("ro = p.declare('ro', memory_type='BIT', memory_size=" + str(memory_slots) + ")\n")
 
-					self.program_head += "bit_reg = p.declare('bit_reg', memory_type='BIT', memory_size=1)\n"
+					self.program_head.append("bit_reg = p.declare('bit_reg', memory_type='BIT', memory_size=1)\n")
 
 
 
 	def on_measure(self, data):
-		self.program_body += "p += MEASURE(" + str(data["qubit"]) + ", ro[" + str(data["memory"]) + "])\n"
+		self.program_body.append("p += MEASURE(" + str(data.qubit) + ", ro[" + str(data.memory) + "])\n")
 
 
 	def on_gate(self, data):
 
-		info = data["info"]
-		options = self.options
+		info = data.info
 
 		#
 		# Do we support this gate?
 		#
-		if "gate_def" not in data or data["gate_def"] is None:
-			raise Exception("Definition not found for gate \"" + data["name"] + "\".")
-
-		gate_def = data["gate_def"]
-
-		#
-		# Find pyQuil exportInfo
-		#
-		while True:
-			if "exportInfo" not in gate_def:
-				raise Exception("No export info for gate \"" + data["name"] + "\".")
-
-			if "pyquil" not in gate_def["exportInfo"]:
-				#
-				# Quil exportInfo is enough
-				#
-				if "quil" not in gate_def["exportInfo"]:
-					raise Exception("No pyQuil export info for gate \"" + data["name"] + "\".")
-				else:
-					pyquil_info = gate_def["exportInfo"]["quil"]
-			else:
-				pyquil_info = gate_def["exportInfo"]["pyquil"]
-
-			if "replacement" in pyquil_info:
-				replacement_name = pyquil_info["replacement"]["name"]
-				if replacement_name not in gate_defs:
-					raise Exception("Definition not found for gate \"" + data["name"] + "\"'s replacement \"" + replacement_name + "\".")
-
-				gate_def = gate_defs[replacement_name]
-
-				data["name"] = replacement_name
-				data["gate_def"] = gate_def
-				data["params"] = []
-
-				if "params" in pyquil_info["replacement"]:
-					rep_params_dict = pyquil_info["replacement"]["params"]
-					rep_params = []
-					for rep_param_name in rep_params_dict:
-						rep_param_eval = eval_mathjs_string(rep_params_dict[rep_param_name], params=None)
-						rep_params.append(rep_param_eval)
-					data["params"] = rep_params
-			else:
-				break;
+		if data.gate_def is None:
+			raise Exception("Definition not found for gate \"" + data.name + "\".")
 
+		plan = self.emission_plans.get(data.name)
+		if plan is None or plan.source_def is not data.gate_def:
+			plan = get_emission_plan(data.name, data.gate_def, self.gate_defs_target)
+			self.emission_plans[data.name] = plan
 
+		if plan.replaced:
+			data.name = plan.name
+			data.gate_def = plan.gate_def
+			data.params = list(plan.replacement_params)
 
 		#
-		# User defined gate?
+		# User defined gate not defined yet?
 		#
-		user_defined_gate = False
-		if "array" in pyquil_info and pyquil_info["array"] is not None and len(pyquil_info["array"]) > 0:
-			#
-			# User defined gate
-			#
-			user_defined_gate = True
-
-			#
-			# Already defined?
-			#
-			if data["name"] not in self.def_gate_names:
-				#
-				# def gate
-				#
-				if len(self.def_gate_names) == 0:
-					#
-					# Imports required for def gate
-					#
-					self.imports += "from pyquil.quilatom import Parameter, quil_sin, quil_cos, quil_sqrt, quil_exp, quil_cis\n"
-					self.imports += "from pyquil.quilbase import DefGate\n"
-					self.imports += "import numpy as np\n"
-
-				self.def_gate_names.append(data["name"])
-
-				param_list = ""
-				if "params" in pyquil_info and pyquil_info["params"] is not None and len(pyquil_info["params"]) > 0:
-					for param_name in pyquil_info["params"]:
-						if param_name not in self.def_param_names:
-							self.def_param_names.append(param_name) 
-							self.def_params += "p_" + param_name + " = Parameter('" + param_name + "')\n"
-						if param_list != "":
-							param_list += ", "
-						param_list += "p_" + param_name
-
-				self.def_gates += data["name"] + "_matrix = np.array(" + pyquil_info["array"] + ")\n"
-
-				self.decl_gates += data["name"] + "_defgate = DefGate('" + data["name"] + "', " + data["name"] + "_matrix, [" + param_list + "])\n"
-
-				self.assign_gates += data["name"]  + " = " + data["name"] + "_defgate.get_constructor()\n"
-
-				self.append_gates += "p += " + data["name"] + "_defgate\n"
-
-		got_condition = False
-		if data["condition"] is not None:
-			got_condition = True
-
-			condition = data["condition"]
-
-			if info["memory_slots"] == 1:
-				self.program_body += "\n"
-				self.program_body += "p += MOVE(bit_reg, ro[" + str(condition["memory"]) + "])\n"
-				if condition["val"] == 0:
-					self.program_body += "p += NOT(bit_reg)\n"
-				self.program_body += "p.if_then(bit_reg, Program("
-			else:
-				self.program_body += "\n"
-				self.program_body += "p += MOVE(int_reg, sha_reg)\n"
-				self.program_body += "p += AND(int_reg, " + hex(condition["mask"]) + ")\n"
-				self.program_body += "p += EQ(bit_reg, int_reg, " + hex(condition["val"]) + ")\n"
-				self.program_body += "p.if_then(bit_reg, Program("
-		else:
-			self.program_body += "p += "
+		if plan.def_gate is not None and plan.name not in self.def_gate_names:
+			self.add_def_gate(plan)
 
 		#
-		# Gate name
+		# Gate params in pyQuil order, then target qubits
 		#
-		self.program_body += pyquil_info["name"]
-		self.program_body += "("
-
-		#
-		# Gate params
-		#
-		param_count = 0
-		if "params" in pyquil_info and len(pyquil_info["params"]) > 0:
-			for param_name in gate_def["params"]:
-				if param_name not in pyquil_info["params"]:
-					raise Exception("Param \"" + param_name + "\" not found in pyQuil export info for gate \"" + data["name"] + "\".")
-
-				param_index = pyquil_info["params"].index(param_name)
-				if param_index >= len(data["params"]):
-					raise Exception("Param \"" + param_name + "\" not specified in Qobj for gate \"" + name + "\".")
+		args = ""
+		if plan.param_order is not None:
+			params = data.params
+			if plan.param_count > len(params):
+				plan.missing_param(params)
+			args = ", ".join([str(params[param_index]) for param_index in plan.param_order]) + plan.param_separator
+
+		args += ", ".join(map(str, data.qubits))
+
+		if data.condition is None:
+			self.program_body.append("p += " + plan.call_open + args + ")\n")
+			return
+
+		condition = data.condition
+
+		if info["memory_slots"] == 1:
+			self.program_body.append("\n")
+			self.program_body.append("p += MOVE(bit_reg, ro[" + str(condition["memory"]) + "])\n")
+			if condition["val"] == 0:
+				self.program_body.append("p += NOT(bit_reg)\n")
+			self.program_body.append("p.if_then(bit_reg, Program(")
+		else:
+			self.program_body.append("\n")
+			self.program_body.append("p += MOVE(int_reg, sha_reg)\n")
+			self.program_body.append("p += AND(int_reg, " + hex(condition["mask"]) + ")\n")
+			self.program_body.append("p += EQ(bit_reg, int_reg, " + hex(condition["val"]) + ")\n")
+			self.program_body.append("p.if_then(bit_reg, Program(")
 
-				if param_count > 0:
-					self.program_body += ", "
-				param_count += 1
+		self.program_body.append(plan.call_open + args + ")))\n\n")
 
-				self.program_body += str(data["params"][param_index])
 
-		if param_count > 0:
-			if user_defined_gate:
-				self.program_body += ")("
-			else:
-				self.program_body += ", "
-		#
-		# Target qubits
-		#
-		qubit_count = 0
-		for qubit in data["qubits"]:
-			if qubit_count > 0:
-				self.program_body += ", "
-			qubit_count += 1
-			self.program_body += str(qubit)
+	def add_def_gate(self, plan):
+		if len(self.def_gate_names) == 0:
+			#
+			# Imports required for def gate
+			#
+			self.imports.append("from pyquil.quilatom import Parameter, quil_sin, quil_cos, quil_sqrt, quil_exp, quil_cis\n")
+			self.imports.append("from pyquil.quilbase import DefGate\n")
+			self.imports.append("import numpy as np\n")
 
-		self.program_body += ")"
+		self.def_gate_names.append(plan.name)
 
-		if got_condition:
-			self.program_body += "))\n"
+		for param_name in plan.def_param_names:
+			if param_name not in self.def_param_names:
+				self.def_param_names.append(param_name)
+				self.def_params.append("p_" + param_name + " = Parameter('" + param_name + "')\n")
 
-		self.program_body += "\n"
+		def_gate, decl_gate, assign_gate, append_gate = plan.def_gate
+		self.def_gates.append(def_gate)
+		self.decl_gates.append(decl_gate)
+		self.assign_gates.append(assign_gate)
+		self.append_gates.append(append_gate)
 
 
 	def on_end(self, data):
@@ -276,11 +200,11 @@ class QobjToPyquil(QConvertQobj):
 				#
 				# QVM: Statevector
 				#
-				self.program_body += "qc = WavefunctionSimulator()\n"
+				self.program_body.append("qc = WavefunctionSimulator()\n")
 				if info["create_exec_code"]:
-					self.program_body += "\n"
-					self.program_body += "wf = qc.wavefunction(p)\n"
-					self.program_body += "print(wf)\n"
+					self.program_body.append("\n")
+					self.program_body.append("wf = qc.wavefunction(p)\n")
+					self.program_body.append("print(wf)\n")
 			else:
 				#
 				# QPU
@@ -290,34 +214,34 @@ class QobjToPyquil(QConvertQobj):
 				# Multishot?
 				#
 				if "shots" in options and options["shots"] is not None and options["shots"] > 1:
-					self.program_body += "p.wrap_in_numshots_loop(" + str(options["shots"]) + ")\n"
-					self.program_body += "\n"
+					self.program_body.append("p.wrap_in_numshots_loop(" + str(options["shots"]) + ")\n")
+					self.program_body.append("\n")
 
 				#
 				# get_qc
 				#
 				if "as_qvm" in options and options["as_qvm"]:
-					self.program_body += "qc = get_qc('" + lattice_name + "', as_qvm=True)\n"
+					self.program_body.append("qc = get_qc('" + lattice_name + "', as_qvm=True)\n")
 				else:
-					self.program_body += "qc = get_qc('" + lattice_name + "')\n"
+					self.program_body.append("qc = get_qc('" + lattice_name + "')\n")
 
 				#
 				# set seed if needed
 				#
 				if "seed" in options and options["seed"]:
-					self.program_body += "qc.qam.random_seed = %d\n" % int(options['seed'])
+					self.program_body.append("qc.qam.random_seed = %d\n" % int(options['seed']))
 
 				#
 				# Compile
 				#
-				self.program_body += "\n"
-				self.program_body += "ex = qc.compile(p)\n"
+				self.program_body.append("\n")
+				self.program_body.append("ex = qc.compile(p)\n")
 
 				#
 				# Run
 				#
 				if info["create_exec_code"]:
-					self.program_body += "print(qc.run(ex))\n"
+					self.program_body.append("print(qc.run(ex))\n")
 		else:
 			#
 			# QVM: If lattice is not given or lattice name is "qasm_simulator"
@@ -327,58 +251,178 @@ class QobjToPyquil(QConvertQobj):
 			# Multishot?
 			#
 			if "shots" in options and options["shots"] is not None and options["shots"] > 1:
-				self.program_body += "p.wrap_in_numshots_loop(" + str(options["shots"]) + ")\n"
-				self.program_body += "\n"
+				self.program_body.append("p.wrap_in_numshots_loop(" + str(options["shots"]) + ")\n")
+				self.program_body.append("\n")
 
 			#
 			# get_qc
 			#
 			lattice_name = str(info["qubits"]) + "q-qvm"
-			self.program_body += "qc = get_qc('" + lattice_name + "')\n"
+			self.program_body.append("qc = get_qc('" + lattice_name + "')\n")
 
 			#
 			# set seed if needed
 			#
 			if "seed" in options and options["seed"]:
-				self.program_body += "qc.qam.random_seed = %d\n" % int(options['seed'])
+				self.program_body.append("qc.qam.random_seed = %d\n" % int(options['seed']))
 
 			#
 			# Run
 			#
 			if info["create_exec_code"]:
-				self.program_body += "\n"
-				self.program_body += "print(qc.run(p))\n"
+				self.program_body.append("\n")
+				self.program_body.append("print(qc.run(p))\n")
 			else:
-				self.program_body += "ex = p\n"
+				self.program_body.append("ex = p\n")
 		#
 		# Assemble the code
 		#
-		code = ""
+		code = []
 		code += self.imports
-		code += "\n"
+		code.append("\n")
 
 		if len(self.def_gate_names) > 0:
 			code += self.def_params
-			code += "\n"
+			code.append("\n")
 			code += self.def_gates
-			code += "\n"
+			code.append("\n")
 			code += self.decl_gates
-			code += "\n"
+			code.append("\n")
 			code += self.assign_gates
-			code += "\n"
-			code += "\n"
+			code.append("\n")
+			code.append("\n")
 
 		code += self.program_head
-		code += "\n"
+		code.append("\n")
 
 		if len(self.def_gate_names) > 0:
 			code += self.append_gates
-			code += "\n"
-			code += "\n"
+			code.append("\n")
+			code.append("\n")
 
 		code += self.program_body
 
-		self.result = code
+		#
+		# Write to caller's stream or join into string
+		#
+		if "output_stream" in options and options["output_stream"] is not None:
+			options["output_stream"].writelines(code)
+			self.result = None
+		else:
+			self.result = "".join(code)
+
+
+#
+# Emission plan: everything on_gate needs which depends only on the gate definition, resolved once per gate
+#
+class EmissionPlan:
+
+	__slots__ = ("source_def", "name", "gate_def", "replaced", "replacement_params", "call_open", "param_names", "param_order", "param_count",
+		"param_separator", "def_param_names", "def_gate")
+
+	def __init__(self, name, gate_def, target):
+		gate_defs = get_gate_defs(target)
+
+		self.source_def = gate_def
+		self.replaced = False
+		self.replacement_params = []
+
+		#
+		# Follow pyQuil exportInfo replacements
+		#
+		while True:
+			if "exportInfo" not in gate_def:
+				raise Exception("No export info for gate \"" + name + "\".")
+
+			if "pyquil" not in gate_def["exportInfo"]:
+				#
+				# Quil exportInfo is enough
+				#
+				if "quil" not in gate_def["exportInfo"]:
+					raise Exception("No pyQuil export info for gate \"" + name + "\".")
+				else:
+					pyquil_info = gate_def["exportInfo"]["quil"]
+			else:
+				pyquil_info = gate_def["exportInfo"]["pyquil"]
+
+			if "replacement" not in pyquil_info:
+				break
+
+			replacement_name = pyquil_info["replacement"]["name"]
+			if replacement_name not in gate_defs:
+				raise Exception("Definition not found for gate \"" + name + "\"'s replacement \"" + replacement_name + "\".")
+
+			name = replacement_name
+			gate_def = gate_defs[replacement_name]
+
+			self.replaced = True
+			self.replacement_params = []
+			if "params" in pyquil_info["replacement"]:
+				rep_params_dict = pyquil_info["replacement"]["params"]
+				for rep_param_name in rep_params_dict:
+					self.replacement_params.append(eval_mathjs_string(rep_params_dict[rep_param_name], params=None))
+
+		self.name = name
+		self.gate_def = gate_def
+		self.call_open = pyquil_info["name"] + "("
+
+		user_defined_gate = "array" in pyquil_info and pyquil_info["array"] is not None and len(pyquil_info["array"]) > 0
+
+		#
+		# Gate params are written in gate_def order, taken from Qobj params by their position in pyQuil export info
+		#
+		self.param_names = None
+		self.param_order = None
+		self.param_count = 0
+		self.param_separator = ")(" if user_defined_gate else ", "
+		if "params" in pyquil_info and len(pyquil_info["params"]) > 0:
+			self.param_names = list(gate_def["params"])
+			self.param_order = []
+			for param_name in self.param_names:
+				if param_name not in pyquil_info["params"]:
+					raise Exception("Param \"" + param_name + "\" not found in pyQuil export info for gate \"" + name + "\".")
+				self.param_order.append(pyquil_info["params"].index(param_name))
+
+			if len(self.param_order) == 0:
+				self.param_order = None
+			else:
+				self.param_count = max(self.param_order) + 1
+
+		#
+		# Code which defines user defined gate
+		#
+		self.def_param_names = []
+		self.def_gate = None
+		if user_defined_gate:
+			if "params" in pyquil_info and pyquil_info["params"] is not None:
+				self.def_param_names = list(pyquil_info["params"])
+
+			param_list = ", ".join(["p_" + param_name for param_name in self.def_param_names])
+
+			self.def_gate = (	name + "_matrix = np.array(" + pyquil_info["array"] + ")\n",
+								name + "_defgate = DefGate('" + name + "', " + name + "_matrix, [" + param_list + "])\n",
+								name  + " = " + name + "_defgate.get_constructor()\n",
+								"p += " + name + "_defgate\n" )
+
+
+	def missing_param(self, params):
+		for param_name, param_index in zip(self.param_names, self.param_order):
+			if param_index >= len(params):
+				raise Exception("Param \"" + param_name + "\" not specified in Qobj for gate \"" + self.name + "\".")
+
+
+#
+# Emission plans keyed by gate name, id of gate definition (kept alive in the value) and gate defs target
+#
+emission_plans = {}
+
+def get_emission_plan(name, gate_def, target):
+	key = (name, id(gate_def), target)
+	cached = emission_plans.get(key)
+	if cached is None or cached[0] is not gate_def:
+		cached = (gate_def, EmissionPlan(name, gate_def, target))
+		emission_plans[key] = cached
+	return cached[1]
 
 
 def qobj_to_pyquil(qobj, options):
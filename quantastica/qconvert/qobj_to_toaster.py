@@ -11,73 +11,226 @@
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
 
-from .qconvert_base import gate_defs
 from .qconvert_qobj import QConvertQobj
+from .qconvert_base import matrix_key
 import json
 
+#
+# Output buffered by ToasterStreamWriter before it is passed to the sink
+#
+STREAM_BUFFER_SIZE = 1 << 16
+
+class ToasterStreamWriter:
+	"""
+	Writes Toaster JSON incrementally, gate by gate. Output is identical to json.dumps() of the whole document.
+
+	sink is object with write(str) method (file, io.StringIO...) or callable which takes str.
+	"""
+
+	def __init__(self, sink):
+		if hasattr(sink, "write"):
+			self.write = sink.write
+		elif callable(sink):
+			self.write = sink
+		else:
+			raise Exception("Toaster output stream must have write() method or be callable.")
+
+		self.pieces = []
+		self.size = 0
+		self.gate_count = 0
+
+	def add(self, text):
+		self.pieces.append(text)
+		self.size += len(text)
+		if self.size >= STREAM_BUFFER_SIZE:
+			self.flush()
+
+	def flush(self):
+		if len(self.pieces) > 0:
+			self.write("".join(self.pieces))
+			self.pieces = []
+			self.size = 0
+
+	def start(self, head):
+		# head: dict with all top level keys except "program"
+		text = json.dumps(head)
+		self.add(text[:-1] + (", " if len(head) > 0 else "") + "\"program\": [")
+
+	def gate(self, gate):
+		if self.gate_count > 0:
+			self.add(", ")
+		self.add(json.dumps(gate))
+		self.gate_count += 1
+
+	def end(self, tail=None):
+		# tail: dict with top level keys written after "program"
+		if tail is not None and len(tail) > 0:
+			self.add("], " + json.dumps(tail)[1:])
+		else:
+			self.add("]}")
+		self.flush()
+
+
 class QobjToToaster(QConvertQobj):
 
+	gate_defs_target = "toaster"
+
+	gate_event_fields = ("name", "gate_def", "condition", "params_dict", "qubits", "matrix")
+
 	def on_start(self, data):
 		info = data["info"]
 
 		self.result = {}
 		self.result["qubits"] = info["qubits"]
 		self.result["cregs"] = []
-		self.result["program"] = []
 
 		for creg_name in info["cregs"]:
 			creg_info = info["cregs"][creg_name]
 			self.result["cregs"].append({ "name": creg_name, "len": creg_info["len"] })
 
+		#
+		# Binary encoding (see toaster_binary.py)?
+		#
+		self.binary = self.options is not None and "toaster_binary" in self.options and self.options["toaster_binary"]
+
+		#
+		# Stream output?
+		#
+		self.json_backend = None
+		if self.options is not None and "json_backend" in self.options:
+			self.json_backend = self.options["json_backend"]
+
+		self.stream_writer = None
+		if self.options is not None and "output_stream" in self.options and self.options["output_stream"] is not None:
+			if self.binary:
+				raise Exception("Binary Toaster encoding can't be used with \"output_stream\" option.")
+			if self.json_backend is not None:
+				raise Exception("JSON backend can't be used with \"output_stream\" option.")
+			self.stream_writer = ToasterStreamWriter(self.options["output_stream"])
+			self.stream_writer.start(self.result)
+		else:
+			self.result["program"] = []
+
+		#
+		# Matrix interning: unique matrices go into top-level "matrices" list and gates refer to them by index
+		# (not with binary encoding, which stores each matrix once anyway)
+		#
+		self.intern_matrices = self.options is not None and "intern_matrices" in self.options and self.options["intern_matrices"] and not self.binary
+		self.matrices = []
+		self.matrix_indexes = {}
+
+	def add_gate(self, gate):
+		if self.stream_writer is not None:
+			self.stream_writer.gate(gate)
+		else:
+			self.result["program"].append(gate)
+
+	def intern_matrix(self, name, params_dict, matrix):
+		try:
+			key = matrix_key(name, params_dict if params_dict is not None else {})
+		except TypeError:
+			# matrix stays referenced from self.matrices, so its id is not reused
+			key = (None, id(matrix))
+
+		index = self.matrix_indexes.get(key)
+		if index is None:
+			index = len(self.matrices)
+			self.matrices.append(matrix)
+			self.matrix_indexes[key] = index
+		return index
+
 	def on_measure(self, data):
 		gate = {}
 		gate["name"] = "measure"
 		gate["wires"] = []
-		gate["wires"].append(data["qubit"])
+		gate["wires"].append(data.qubit)
 		gate["options"] = {}
 		gate["matrix"] = []
 
 		creg = {}
-		creg["bit"] = data["creg_bit"]
-		creg["name"] = data["creg_name"]
+		creg["bit"] = data.creg_bit
+		creg["name"] = data.creg_name
 		gate["options"]["creg"] = creg
 
-		self.result["program"].append(gate)
+		self.add_gate(gate)
 
 		return
 
 	def on_gate(self, data):
-		if data["gate_def"] is None:
-			raise Exception("Definition not found for gate \"" + data["name"] + "\".")
+		if data.gate_def is None:
+			raise Exception("Definition not found for gate \"" + data.name + "\".")
 
 		gate = {}
-		gate["name"] = data["name"]
-		gate["wires"] = data["qubits"]
+		gate["name"] = data.name
+		gate["wires"] = data.qubits
 		gate["options"] = {}
 		gate["matrix"] = []
 
-		if "matrix" in data and data["matrix"] is not None:
-			gate["matrix"] = data["matrix"]
+		if data.matrix is not None:
+			if self.intern_matrices:
+				gate["matrix"] = self.intern_matrix(data.name, data.params_dict, data.matrix)
+			else:
+				gate["matrix"] = data.matrix
 
-		if "condition" in data and data["condition"] is not None:
+		if data.condition is not None:
 			condition = {}
-			condition["creg"] = data["condition"]["creg_name"]
-			condition["value"] = data["condition"]["creg_value"]
+			condition["creg"] = data.condition["creg_name"]
+			condition["value"] = data.condition["creg_value"]
 
 			gate["options"]["condition"] = condition
 
-		if "params_dict" in data and data["params_dict"] is not None:
-			gate["options"]["params"] = data["params_dict"]
+		if data.params_dict is not None:
+			gate["options"]["params"] = data.params_dict
 
-		self.result["program"].append(gate)
+		self.add_gate(gate)
 
 
 	def on_end(self, data):
-		if type(self.result) is dict:
-			self.result = json.dumps(self.result)
+		tail = {}
+		if self.intern_matrices:
+			tail["matrices"] = self.matrices
+
+		if self.stream_writer is not None:
+			self.stream_writer.end(tail)
+			self.stream_writer = None
+			self.result = None
+		elif type(self.result) is dict:
+			self.result.update(tail)
+			if self.binary:
+				from . import toaster_binary
+				self.result = toaster_binary.encode_toaster(self.result)
+			elif self.json_backend is not None:
+				from . import json_backend
+				self.result = json_backend.dumps(self.result, self.json_backend)
+			else:
+				self.result = json.dumps(self.result)
+
+		self.matrices = []
+		self.matrix_indexes = {}
 		return
 
 
+def expand_toaster_matrices(toaster):
+	"""
+	Expand output written with "intern_matrices" option: matrix indexes in program are replaced with
+	matrices from top-level "matrices" list, which is removed.
+
+	toaster is JSON string (returns JSON string) or dict (expanded in place and returned).
+	"""
+	if isinstance(toaster, (str, bytes)):
+		return json.dumps(expand_toaster_matrices(json.loads(toaster)))
+
+	if "matrices" not in toaster:
+		return toaster
+
+	matrices = toaster.pop("matrices")
+	for gate in toaster.get("program", []):
+		if "matrix" in gate and type(gate["matrix"]) is int:
+			gate["matrix"] = matrices[gate["matrix"]]
+
+	return toaster
+
+
 def qobj_to_toaster(qobj, options):
 	converter = QobjToToaster()
 
@@ -0,0 +1,326 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Cache of conversion results, used with "result_cache" option.
+#
+# Results are keyed by SHA-256 of the experiment (pickled), the
+# converter, the options which affect output and the gate table version.
+# Entries are kept in a bounded in-process LRU and, if directory is given, in
+# files (one per result) shared by all processes which use the directory.
+# Files are written atomically (temporary file + rename), so concurrent
+# readers see either the whole entry or no entry.
+#
+
+import os
+import json
+import pickle
+import tempfile
+import threading
+import collections
+
+from .gate_table import gate_defs_version
+
+#
+# Bump when converters change output for the same input, so old disk entries are not used
+#
+RESULT_CACHE_VERSION = 1
+
+#
+# Options which don't change the result of one experiment
+#
+IGNORED_OPTIONS = ("all_experiments", "workers", "matrix_cache", "result_cache", "output_stream", "stats", "span_callback", "parameter_templates", "qubit_maps")
+
+TEXT_MARKER = "s\n"
+JSON_MARKER = "j\n"
+BYTES_MARKER = b"b\n"
+
+#
+# Fixed, so keys don't change with Python's default protocol
+#
+KEY_PICKLE_PROTOCOL = 4
+
+
+def result_key(converter_class, experiment, options):
+	"""
+	Returns key (hex string) of experiment converted with converter_class and options, or None if experiment or
+	options can't be pickled.
+	"""
+	key_options = {}
+	if options is not None:
+		for option_name in sorted(options):
+			if option_name not in IGNORED_OPTIONS:
+				key_options[option_name] = options[option_name]
+
+	#
+	# Pickle is used instead of canonical JSON: it is several times faster on large experiments, and equal
+	# bytes always mean equal data (different bytes for equal data only cost a cache miss)
+	#
+	try:
+		data = pickle.dumps([	RESULT_CACHE_VERSION,
+								gate_defs_version(),
+								converter_class.__module__ + "." + converter_class.__qualname__,
+								key_options,
+								experiment ], protocol=KEY_PICKLE_PROTOCOL)
+	except Exception:
+		return None
+
+	import hashlib
+
+	return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+	"""
+	Conversion result cache: LRU of up to maxsize results in memory, and optional directory with results
+	in files. If max_disk_bytes is set, least recently used files are removed when the directory grows
+	above it.
+	"""
+
+	def __init__(self, maxsize=256, directory=None, max_disk_bytes=None):
+		self.maxsize = maxsize
+		self.directory = directory
+		self.max_disk_bytes = max_disk_bytes
+		self.lock = threading.Lock()
+		self.entries = collections.OrderedDict()
+		self.disk_bytes = None
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.disk_evictions = 0
+
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+
+	def clear(self, disk=False):
+		with self.lock:
+			self.entries.clear()
+			self.hits = 0
+			self.disk_hits = 0
+			self.misses = 0
+			self.evictions = 0
+			self.disk_evictions = 0
+
+		if disk and self.directory is not None:
+			for path, size, mtime in self.disk_entries():
+				self.remove_file(path)
+			with self.lock:
+				self.disk_bytes = 0
+
+	def info(self):
+		return {	"hits": self.hits,
+					"disk_hits": self.disk_hits,
+					"misses": self.misses,
+					"evictions": self.evictions,
+					"disk_evictions": self.disk_evictions,
+					"size": len(self.entries),
+					"maxsize": self.maxsize,
+					"disk_bytes": self.disk_bytes }
+
+	def get(self, key):
+		"""
+		Returns cached result or None
+		"""
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return self.entries[key]
+
+		result = None
+		if self.directory is not None:
+			result = self.read_file(key)
+
+		if result is None:
+			with self.lock:
+				self.misses += 1
+			return None
+
+		with self.lock:
+			self.disk_hits += 1
+		self.put_memory(key, result)
+		return result
+
+	def put(self, key, result):
+		if result is None:
+			return
+
+		self.put_memory(key, result)
+
+		if self.directory is not None:
+			self.write_file(key, result)
+
+	def put_memory(self, key, result):
+		with self.lock:
+			self.entries[key] = result
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	#
+	# Disk tier
+	#
+
+	def file_path(self, key):
+		return os.path.join(self.directory, key[:2], key + ".result")
+
+	def read_file(self, key):
+		path = self.file_path(key)
+		try:
+			with open(path, "rb") as file:
+				data = file.read()
+		except OSError:
+			return None
+
+		# mark as recently used
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+
+		if data.startswith(BYTES_MARKER):
+			return data[len(BYTES_MARKER):]
+
+		try:
+			text = data.decode("utf-8")
+		except UnicodeDecodeError:
+			return None
+
+		if text.startswith(TEXT_MARKER):
+			return text[len(TEXT_MARKER):]
+		if text.startswith(JSON_MARKER):
+			return json.loads(text[len(JSON_MARKER):])
+		return None
+
+	def write_file(self, key, result):
+		if isinstance(result, bytes):
+			data = BYTES_MARKER + result
+		else:
+			if isinstance(result, str):
+				text = TEXT_MARKER + result
+			else:
+				try:
+					text = JSON_MARKER + json.dumps(result)
+				except (TypeError, ValueError):
+					return
+
+			data = text.encode("utf-8")
+
+		path = self.file_path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".result")
+		try:
+			with os.fdopen(fd, "wb") as file:
+				file.write(data)
+			os.replace(tmp_path, path)
+		except BaseException:
+			self.remove_file(tmp_path)
+			raise
+
+		if self.max_disk_bytes is not None:
+			scanned = None
+			if self.disk_bytes is None:
+				scanned = sum(size for path, size, mtime in self.disk_entries())
+
+			with self.lock:
+				if scanned is not None:
+					self.disk_bytes = scanned
+				else:
+					self.disk_bytes += len(data)
+				over_limit = self.disk_bytes > self.max_disk_bytes
+
+			if over_limit:
+				self.evict_files()
+
+	def disk_entries(self):
+		"""
+		Returns list of (path, size, mtime) of all result files
+		"""
+		entries = []
+		try:
+			subdirs = list(os.scandir(self.directory))
+		except OSError:
+			return entries
+
+		for subdir in subdirs:
+			if not subdir.is_dir():
+				continue
+			try:
+				for entry in os.scandir(subdir.path):
+					if entry.name.endswith(".result") and not entry.name.startswith(".tmp-"):
+						try:
+							stat = entry.stat()
+						except OSError:
+							# removed by another process
+							continue
+						entries.append((entry.path, stat.st_size, stat.st_mtime))
+			except OSError:
+				continue
+		return entries
+
+	def evict_files(self):
+		#
+		# Other processes write to the same directory: rescan, then remove least recently used files
+		# until the directory is below 90% of max_disk_bytes
+		#
+		entries = self.disk_entries()
+		entries.sort(key=lambda entry: entry[2])
+
+		total = sum(size for path, size, mtime in entries)
+		target = self.max_disk_bytes * 0.9
+		removed = 0
+		for path, size, mtime in entries:
+			if total <= target:
+				break
+			if self.remove_file(path):
+				removed += 1
+			total -= size
+
+		with self.lock:
+			self.disk_evictions += removed
+			self.disk_bytes = total
+
+	def remove_file(self, path):
+		try:
+			os.remove(path)
+			return True
+		except OSError:
+			return False
+
+
+#
+# Cache used with "result_cache": True (in memory only)
+#
+result_cache = ResultCache()
+
+
+def get_result_cache(options):
+	"""
+	Returns ResultCache selected by "result_cache" option (True: shared result_cache) or None.
+	Results written to output_stream are not cached.
+	"""
+	if options is None or "result_cache" not in options:
+		return None
+
+	if "output_stream" in options and options["output_stream"] is not None:
+		return None
+
+	cache = options["result_cache"]
+	if cache is True:
+		return result_cache
+	if isinstance(cache, ResultCache):
+		return cache
+	return None
@@ -0,0 +1,315 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Conversion statistics, used with "stats" option.
+#
+# Nothing here runs when the option is not given. When it is, the converter's
+# instruction handlers and hooks are wrapped (as instance attributes, for the
+# duration of the conversion) with timers, so the conversion code itself has no
+# checks in the per-instruction path. Phase times are exclusive: time of nested
+# phases is not counted in the outer one, so phases add up to the total.
+#
+# Phases:
+#   setup        experiment header, classical registers, bfunc pre-scan
+#   vectorize    NumPy batch evaluation of matrices ("vectorize" option)
+#   start        on_start hook
+#   gates        gate instructions: params, matrix evaluation, gate events
+#   bfunc, measure, barrier
+#                other instructions
+#   emit         on_gate, on_measure, on_barrier hooks (output code / JSON)
+#   finish       on_end hook (assembling output, json.dumps)
+#   parallel     waiting for experiments converted in process pool ("workers")
+#   dispatch     rest of instruction loop
+#   other        everything else (e.g. result cache lookup)
+#
+# Spans of conversion, experiments and per-experiment phases (not of single
+# instructions) are also passed to QConvertBase.on_span.
+#
+# Experiments converted by "workers" are profiled in the worker processes:
+# their experiment and instruction counts are added to the report, and their
+# merged reports (phases, caches, peak memory of workers) are under "workers".
+#
+
+import sys
+import time
+import collections
+
+from . import qconvert_base
+
+#
+# Phases reported as spans to on_span (others are per-instruction and only accumulated)
+#
+SPAN_PHASES = ("convert", "experiment", "setup", "vectorize", "start", "finish", "parallel")
+
+#
+# Wrapped converter method -> phase
+#
+HOOK_PHASES = {	"on_start": "start",
+				"on_end": "finish",
+				"on_gate": "emit",
+				"on_measure": "emit",
+				"on_barrier": "emit" }
+
+ROOT_PHASES = { "convert": "other", "experiment": "dispatch" }
+
+
+class CountingStream:
+	"""
+	Passes output to stream (object with write() or callable) and counts characters
+	"""
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.count = 0
+
+	def write(self, text):
+		self.count += len(text)
+		if hasattr(self.stream, "write"):
+			return self.stream.write(text)
+		return self.stream(text)
+
+	def writelines(self, lines):
+		for line in lines:
+			self.write(line)
+
+	def __call__(self, text):
+		self.write(text)
+
+
+class ConversionProfiler:
+
+	def __init__(self, converter):
+		self.converter = converter
+		self.phases = {}
+		self.instructions = collections.Counter()
+		self.experiments = 0
+		self.stack = []
+		self.wrapped = []
+		self.output_stream = None
+		self.emitted = 0
+		self.worker_report = None
+
+	#
+	# Timing
+	#
+
+	def begin(self, name):
+		self.stack.append([name, time.perf_counter(), 0.0])
+
+	def end(self):
+		name, start, child_time = self.stack.pop()
+		elapsed = time.perf_counter() - start
+
+		phase = ROOT_PHASES.get(name, name)
+		entry = self.phases.get(phase)
+		if entry is None:
+			entry = [0.0, 0]
+			self.phases[phase] = entry
+		entry[0] += elapsed - child_time
+		entry[1] += 1
+
+		if len(self.stack) > 0:
+			self.stack[-1][2] += elapsed
+
+		if name in SPAN_PHASES:
+			self.converter.on_span(name, start, elapsed)
+
+		return elapsed
+
+	def timed(self, name, function):
+		def wrapper(*args):
+			self.begin(name)
+			try:
+				return function(*args)
+			finally:
+				self.end()
+		return wrapper
+
+	def counted(self, name, function):
+		# instruction handler: (state, instruction_index, instruction, name)
+		def wrapper(state, instruction_index, instruction, instruction_name):
+			self.instructions[instruction_name] += 1
+			self.begin(name)
+			try:
+				return function(state, instruction_index, instruction, instruction_name)
+			finally:
+				self.end()
+		return wrapper
+
+	def wrap(self, attribute, wrapper):
+		setattr(self.converter, attribute, wrapper(getattr(self.converter, attribute)))
+		self.wrapped.append(attribute)
+
+	#
+	# Conversion
+	#
+
+	def start(self):
+		converter = self.converter
+		converter.profiler = self
+
+		self.cache_before = self.cache_counters()
+		self.tracing = False
+		try:
+			import tracemalloc
+			if tracemalloc.is_tracing():
+				tracemalloc.reset_peak()
+				self.tracing = True
+		except (ImportError, AttributeError):
+			pass
+
+		for attribute in HOOK_PHASES:
+			self.wrap(attribute, lambda function, phase=HOOK_PHASES[attribute]: self.timed(phase, function))
+
+		if hasattr(converter, "experiment_converter"):
+			self.wrap("experiment_converter", self.experiment)
+			self.wrap("convert_gate", lambda function: self.counted("gates", function))
+			for instruction_name in converter.instruction_handlers:
+				self.wrap(converter.instruction_handlers[instruction_name], lambda function, phase=instruction_name: self.counted(phase, function))
+
+		#
+		# Count characters written to output_stream
+		#
+		options = converter.options
+		self.options = options
+		if "output_stream" in options and options["output_stream"] is not None:
+			self.output_stream = CountingStream(options["output_stream"])
+			converter.options = dict(options)
+			converter.options["output_stream"] = self.output_stream
+
+		self.begin("convert")
+
+	def experiment(self, function):
+		def wrapper(*args):
+			self.experiments += 1
+			self.begin("experiment")
+			try:
+				return function(*args)
+			finally:
+				self.end()
+		return wrapper
+
+	def add_result(self, result):
+		if isinstance(result, (str, bytes)):
+			self.emitted += len(result)
+
+	def add_worker_report(self, report):
+		"""
+		Adds report of experiments converted in worker process
+		"""
+		if self.worker_report is None:
+			self.worker_report = {}
+		merge_report(self.worker_report, report)
+
+	def stop(self):
+		"""
+		Finishes profiling, returns report (also stored into converter.stats and options["stats"])
+		"""
+		options = self.options
+
+		total = 0.0
+		while len(self.stack) > 0:
+			total = self.end()
+
+		converter = self.converter
+		for attribute in self.wrapped:
+			delattr(converter, attribute)
+		self.wrapped = []
+		converter.options = options
+		converter.profiler = None
+
+		if self.output_stream is not None:
+			self.emitted += self.output_stream.count
+
+		experiments = self.experiments
+		instructions = collections.Counter(self.instructions)
+		if self.worker_report is not None:
+			experiments += self.worker_report["experiments"]
+			instructions.update(self.worker_report["instructions_by_name"])
+
+		report = {	"total_seconds": total,
+					"experiments": experiments,
+					"instructions": sum(instructions.values()),
+					"instructions_by_name": dict(instructions),
+					"phases": { name: { "seconds": entry[0], "calls": entry[1] } for name, entry in self.phases.items() },
+					"emitted_chars": self.emitted }
+
+		cache_after = self.cache_counters()
+		for cache_name in cache_after:
+			report[cache_name] = { key: cache_after[cache_name][key] - self.cache_before[cache_name][key] for key in cache_after[cache_name] }
+
+		report["peak_rss_bytes"] = peak_rss()
+		if self.tracing:
+			import tracemalloc
+			report["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+
+		if self.worker_report is not None:
+			report["workers"] = self.worker_report
+
+		converter.stats = report
+		if isinstance(options.get("stats"), dict):
+			options["stats"].clear()
+			options["stats"].update(report)
+
+		return report
+
+	def cache_counters(self):
+		expressions = qconvert_base.compile_expression.cache_info()
+		matrices = qconvert_base.matrix_cache.info()
+		return {	"expression_cache": { "hits": expressions.hits, "misses": expressions.misses },
+					"matrix_cache": { "hits": matrices["hits"], "misses": matrices["misses"], "evictions": matrices["evictions"] },
+					"compiled_matrices": { "compiled": len(qconvert_base.compiled_matrices) } }
+
+
+def peak_rss():
+	"""
+	Peak resident set size of this process in bytes, or None if not available
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	if sys.platform == "darwin":
+		return peak
+	return peak * 1024
+
+
+def merge_report(total, report):
+	"""
+	Adds counts and times of report into total (peak memory is maximum of both), returns total
+	"""
+	for key, value in report.items():
+		if isinstance(value, dict):
+			merge_report(total.setdefault(key, {}), value)
+		elif key.startswith("peak_"):
+			if value is not None and (total.get(key) is None or value > total[key]):
+				total[key] = value
+		elif key in total:
+			total[key] += value
+		else:
+			total[key] = value
+	return total
+
+
+def stats_requested(options):
+	if options is None or "stats" not in options or options["stats"] is None or options["stats"] is False:
+		return False
+
+	if not isinstance(options["stats"], dict):
+		raise Exception("\"stats\" option must be a dict (report is stored into it).")
+	return True
@@ -0,0 +1,279 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Conversion templates for parameter sweeps (convert_template() and
+# "parameter_templates" option).
+#
+# Experiment is converted once with each numeric gate param replaced by a
+# marker string, and matrices of gates with such params by matrix markers
+# (passed to convert_gate as precomputed batch matrices). Output is split at
+# the markers: for a new set of param values, only the slots are filled and
+# matrices of parametrized gates evaluated, without traversing the experiment.
+# Markers are found as written by str() (pyQuil code) or json.dumps()
+# (Toaster), and slots are filled the same way, so output is identical to
+# converting the experiment with the new values.
+#
+
+import re
+import json
+import pickle
+
+from .qconvert_base import get_gate_defs, get_matrix_function, matrix_cache
+
+PARAM_MARKER = "\x00P%d\x00"
+MATRIX_MARKER = "\x00M%d\x00"
+
+#
+# Marker as is (str) or as JSON string (json.dumps)
+#
+MARKER_PATTERN = re.compile("\x00([PM])(\\d+)\x00|\"\\\\u0000([PM])(\\d+)\\\\u0000\"")
+
+#
+# Values of JSON slots are encoded with one json.dumps() call, separated by this string
+#
+JSON_SEPARATOR = "\x00"
+JSON_SEPARATOR_TEXT = ", \"\\u0000\", "
+
+#
+# Options with which output can't be split into slots
+#
+UNSUPPORTED_OPTIONS = ("output_stream", "intern_matrices", "peephole", "toaster_binary", "json_backend")
+
+
+def is_param_value(value):
+	return type(value) is int or type(value) is float
+
+
+def split_params(experiment):
+	"""
+	Returns (copy of experiment with numeric gate params replaced by markers, list of replaced values).
+	Experiments which differ only in numeric gate params give equal copies.
+	"""
+	values = []
+	instructions = []
+	for instruction in experiment["instructions"]:
+		if "params" in instruction and instruction.get("name") not in ("bfunc", "measure", "barrier"):
+			params = []
+			for value in instruction["params"]:
+				if is_param_value(value):
+					params.append(PARAM_MARKER % len(values))
+					values.append(value)
+				else:
+					params.append(value)
+			instruction = dict(instruction)
+			instruction["params"] = params
+		instructions.append(instruction)
+
+	slotted = dict(experiment)
+	slotted["instructions"] = instructions
+	return slotted, values
+
+
+def experiment_params(experiment):
+	"""
+	Numeric gate params of experiment in template slot order
+	"""
+	values = []
+	for instruction in experiment["instructions"]:
+		if "params" in instruction and instruction.get("name") not in ("bfunc", "measure", "barrier"):
+			for value in instruction["params"]:
+				if is_param_value(value):
+					values.append(value)
+	return values
+
+
+class ConversionTemplate:
+	"""
+	Output of one experiment with slots for its numeric gate params. bind(values) returns what the converter
+	returns for the experiment with params replaced by values (in experiment_params() order).
+	"""
+
+	def __init__(self, converter, experiment, split=None):
+		options = converter.options if converter.options is not None else {}
+		for option_name in UNSUPPORTED_OPTIONS:
+			if option_name in options and options[option_name]:
+				raise Exception("Conversion template can't be used with \"" + option_name + "\" option.")
+
+		# split: split_params(experiment), if caller already has it
+		slotted, self.params = split if split is not None else split_params(experiment)
+
+		#
+		# Slots are made for experiment as converted ("compact_qubits" may drop barriers, which shifts instruction
+		# indexes). Preparing it again in experiment_converter changes nothing: compaction of compacted experiment
+		# is identity.
+		#
+		slotted = converter.prepare_experiment(slotted)
+
+		#
+		# Matrix markers for gates whose matrix depends on a slot (converters which read matrices)
+		#
+		gate_defs = get_gate_defs(converter.gate_defs_target)
+		self.matrix_slots = []
+		slot_matrices = [None] * len(slotted["instructions"])
+		for instruction_index, instruction in enumerate(slotted["instructions"] if converter.uses_matrices() else []):
+			name = instruction.get("name", "")
+			if name == "iden":
+				name = "id"
+			gate_def = gate_defs.get(name)
+			if gate_def is None or "matrix" not in gate_def or "params" not in gate_def or len(gate_def["params"]) == 0:
+				continue
+
+			#
+			# Matrix function args in gate_def params order: (True, slot index) or (False, constant value)
+			#
+			params = instruction["params"]
+			args = []
+			for param_index in range(len(gate_def["params"])):
+				value = params[param_index]
+				if type(value) is str and value.startswith("\x00P"):
+					args.append((True, int(value[2:-1])))
+				else:
+					args.append((False, value))
+
+			if any(arg[0] for arg in args):
+				slot_matrices[instruction_index] = (MATRIX_MARKER % len(self.matrix_slots), None)
+				self.matrix_slots.append((name, gate_def, args, get_matrix_function(gate_def["matrix"], gate_def["params"])))
+
+		self.use_matrix_cache = not ("matrix_cache" in options and not options["matrix_cache"])
+		self.matrix_cache_precision = options.get("matrix_cache_precision")
+
+		converter.slot_matrices = slot_matrices
+		try:
+			converter.result = None
+			converter.experiment_converter(slotted)
+			output = converter.result
+		finally:
+			converter.slot_matrices = None
+
+		if type(output) is not str:
+			raise Exception("Conversion template needs converter which returns string.")
+
+		#
+		# Static text between slots, and slots as (is matrix, slot index, is JSON)
+		#
+		self.segments = []
+		self.fills = []
+		position = 0
+		for match in MARKER_PATTERN.finditer(output):
+			self.segments.append(output[position:match.start()])
+			if match.group(1) is not None:
+				self.fills.append((match.group(1) == "M", int(match.group(2)), False))
+			else:
+				self.fills.append((match.group(3) == "M", int(match.group(4)), True))
+			position = match.end()
+		self.segments.append(output[position:])
+
+	def matrices(self, values):
+		"""
+		Matrices of matrix slots for param values
+		"""
+		matrices = []
+
+		#
+		# Rounded params: matrix from matrix cache, as convert_gate does
+		#
+		if self.use_matrix_cache and (self.matrix_cache_precision is not None or matrix_cache.precision is not None):
+			for name, gate_def, args, function in self.matrix_slots:
+				params_dict = {}
+				for param_name, arg in zip(gate_def["params"], args):
+					params_dict[param_name] = values[arg[1]] if arg[0] else arg[1]
+				matrices.append(matrix_cache.get(name, gate_def, params_dict, self.matrix_cache_precision))
+			return matrices
+
+		#
+		# Otherwise the cache would return the same matrix. Swept values are rarely repeated, so matrix is
+		# evaluated directly, without filling the cache.
+		#
+		for name, gate_def, args, function in self.matrix_slots:
+			matrices.append(function(*[values[arg[1]] if arg[0] else arg[1] for arg in args]))
+		return matrices
+
+	def bind(self, values):
+		if len(values) != len(self.params):
+			raise Exception("Template has %d params, %d values given." % (len(self.params), len(values)))
+
+		matrices = self.matrices(values)
+
+		texts = [None] * len(self.fills)
+		json_indexes = []
+		json_values = []
+		for fill_index, fill in enumerate(self.fills):
+			is_matrix, slot, is_json = fill
+			value = matrices[slot] if is_matrix else values[slot]
+			if is_json:
+				json_indexes.append(fill_index)
+				json_values.append(value)
+				json_values.append(JSON_SEPARATOR)
+			else:
+				texts[fill_index] = str(value)
+
+		if len(json_values) > 0:
+			encoded = json.dumps(json_values)
+			encoded = encoded[1:-len(JSON_SEPARATOR_TEXT) + 1]
+			for fill_index, text in zip(json_indexes, encoded.split(JSON_SEPARATOR_TEXT)):
+				texts[fill_index] = text
+
+		segments = self.segments
+		pieces = [segments[0]]
+		for fill_index in range(len(texts)):
+			pieces.append(texts[fill_index])
+			pieces.append(segments[fill_index + 1])
+
+		return "".join(pieces)
+
+	def bind_experiment(self, experiment):
+		"""
+		Output for experiment with the same structure as the template's (not checked, see TemplateCache)
+		"""
+		return self.bind(experiment_params(experiment))
+
+
+class TemplateCache:
+	"""
+	Templates of experiments converted with "parameter_templates" option, by experiment structure
+	(experiment with numeric gate params replaced by markers, pickled)
+	"""
+
+	def __init__(self):
+		self.templates = {}
+
+	def convert(self, converter, experiment):
+		slotted, values = split_params(experiment)
+
+		try:
+			key = pickle.dumps(slotted, protocol=4)
+		except Exception:
+			key = None
+
+		template = self.templates.get(key) if key is not None else None
+		if template is None:
+			template = ConversionTemplate(converter, experiment, (slotted, values))
+			if key is not None:
+				self.templates[key] = template
+
+		return template.bind(values)
+
+
+def get_template_cache(options):
+	"""
+	Returns new TemplateCache if "parameter_templates" option is set and can be used with other options, or None
+	"""
+	if options is None or "parameter_templates" not in options or not options["parameter_templates"]:
+		return None
+
+	for option_name in UNSUPPORTED_OPTIONS:
+		if option_name in options and options[option_name]:
+			return None
+
+	return TemplateCache()
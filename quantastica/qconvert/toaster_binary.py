@@ -0,0 +1,441 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Binary Toaster encoding ("toaster_binary" option, encode_toaster() and
+# decode_toaster()). decode_toaster(encode_toaster(toaster)) is equal to
+# json.loads() of the JSON output.
+#
+# Program is stored by columns: gate names, conditions and measure cregs are
+# interned, wires are integer arrays and each distinct matrix (by identity, so
+# matrices shared through the matrix cache are stored once) is packed as
+# float64. Layout, little-endian:
+#
+#   magic      4 bytes  "QTB\x01"
+#   meta size  uint32
+#   meta       UTF-8 JSON object:
+#                "head":        top-level keys except "program"
+#                "names":       gate names
+#                "conditions":  distinct options["condition"] values
+#                "cregs":       distinct options["creg"] values
+#                "param_names": distinct lists of options["params"] keys
+#                "values":      param values and matrix cells not stored as numbers
+#                "gates":       { gate index: gate } gates not stored in columns
+#   columns    in order below, each: uint32 item count, then items
+#
+#   column       type     items
+#   name         uint16   per gate: index in names
+#   wire_count   uint16   per gate
+#   wires        uint32   wires of all gates
+#   matrix       uint32   per gate: 0 for [], else index of matrix + 1
+#   condition    int32    per gate: index in conditions or -1
+#   creg         int32    per gate: index in cregs or -1
+#   params       int32    per gate: index in param_names or -1
+#   param_kind   uint8    per param value: 0 float, 1 int, 3 index in values
+#   param_value  float64  per param value
+#   matrix_size  uint16   per matrix: rows, columns
+#   cell_kind    uint8    per cell: 0 float, 1 int, 2 complex, 3 index in values
+#   cell_value   float64  per cell: one value, two (re, im) for complex
+#
+# Gate options are rebuilt as {"condition", "params"} or {"creg"} (the keys
+# the converter writes). Other gates go to meta "gates" as they are.
+# Decoded gates with the same matrix share one matrix list.
+#
+
+import sys
+import json
+import struct
+from array import array
+
+MAGIC = b"QTB\x01"
+
+#
+# (name, array typecode) of columns, in file order
+#
+COLUMNS = (	("name", "H"),
+			("wire_count", "H"),
+			("wires", "I"),
+			("matrix", "I"),
+			("condition", "i"),
+			("creg", "i"),
+			("params", "i"),
+			("param_kind", "B"),
+			("param_value", "d"),
+			("matrix_size", "H"),
+			("cell_kind", "B"),
+			("cell_value", "d") )
+
+GATE_KEYS = ("name", "wires", "options", "matrix")
+
+KIND_FLOAT = 0
+KIND_INT = 1
+KIND_COMPLEX = 2
+KIND_VALUE = 3
+
+#
+# Ints above this are not exact as float64
+#
+MAX_EXACT_INT = 1 << 53
+
+MAX_UINT16 = 0xFFFF
+MAX_UINT32 = 0xFFFFFFFF
+
+
+def is_binary_toaster(data):
+	return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def is_column_gate(gate):
+	"""
+	Gate which can be stored in columns (as written by QobjToToaster)
+	"""
+	if type(gate) is not dict or len(gate) != len(GATE_KEYS):
+		return False
+	for key in GATE_KEYS:
+		if key not in gate:
+			return False
+
+	name = gate["name"]
+	wires = gate["wires"]
+	options = gate["options"]
+	if type(name) is not str or type(wires) is not list or type(options) is not dict or type(gate["matrix"]) is not list:
+		return False
+	if len(wires) > MAX_UINT16:
+		return False
+	for wire in wires:
+		if type(wire) is not int or wire < 0 or wire > MAX_UINT32:
+			return False
+
+	if "creg" in options:
+		return len(options) == 1
+	for key in options:
+		if key != "condition" and key != "params":
+			return False
+	return "params" not in options or type(options["params"]) is dict
+
+
+def encode_toaster(toaster):
+	"""
+	Returns binary encoding (bytes) of Toaster program given as dict or JSON string
+	"""
+	if isinstance(toaster, (str, bytes, bytearray)):
+		toaster = json.loads(toaster)
+
+	head = {}
+	for key in toaster:
+		if key != "program":
+			head[key] = toaster[key]
+
+	columns = {}
+	for column_name, typecode in COLUMNS:
+		columns[column_name] = array(typecode)
+
+	names = []
+	name_indexes = {}
+	conditions = []
+	condition_indexes = {}
+	cregs = []
+	creg_indexes = {}
+	param_names = []
+	param_name_indexes = {}
+	values = []
+	extra_gates = {}
+
+	matrix_indexes = {}
+	matrix_sizes = columns["matrix_size"]
+	cell_kinds = columns["cell_kind"]
+	cell_values = columns["cell_value"]
+
+	def value_index(value):
+		values.append(value)
+		return len(values) - 1
+
+	def add_matrix(matrix):
+		"""
+		Returns index + 1 of matrix in matrix columns, or None if it is not list of equal length rows
+		"""
+		rows = len(matrix)
+		if rows > MAX_UINT16 or type(matrix[0]) is not list:
+			return None
+		row_size = len(matrix[0])
+		if row_size > MAX_UINT16:
+			return None
+		for row in matrix:
+			if type(row) is not list or len(row) != row_size:
+				return None
+
+		matrix_sizes.append(rows)
+		matrix_sizes.append(row_size)
+		for row in matrix:
+			for cell in row:
+				cell_type = type(cell)
+				if cell_type is float:
+					cell_kinds.append(KIND_FLOAT)
+					cell_values.append(cell)
+				elif cell_type is int and -MAX_EXACT_INT <= cell <= MAX_EXACT_INT:
+					cell_kinds.append(KIND_INT)
+					cell_values.append(cell)
+				elif cell_type is dict and len(cell) == 3 and cell.get("type") == "complex" and type(cell.get("re")) is float and type(cell.get("im")) is float:
+					cell_kinds.append(KIND_COMPLEX)
+					cell_values.append(cell["re"])
+					cell_values.append(cell["im"])
+				else:
+					cell_kinds.append(KIND_VALUE)
+					cell_values.append(value_index(cell))
+
+		matrix_indexes[id(matrix)] = len(matrix_indexes) + 1
+		return len(matrix_indexes)
+
+	name_column = columns["name"]
+	wire_count_column = columns["wire_count"]
+	wire_column = columns["wires"]
+	matrix_column = columns["matrix"]
+	condition_column = columns["condition"]
+	creg_column = columns["creg"]
+	params_column = columns["params"]
+	param_kinds = columns["param_kind"]
+	param_values = columns["param_value"]
+
+	program = toaster.get("program", [])
+	for gate_index, gate in enumerate(program):
+		matrix_index = None
+		if is_column_gate(gate):
+			matrix = gate["matrix"]
+			if len(matrix) == 0:
+				matrix_index = 0
+			else:
+				matrix_index = matrix_indexes.get(id(matrix))
+				if matrix_index is None:
+					matrix_index = add_matrix(matrix)
+
+		if matrix_index is None:
+			extra_gates[str(gate_index)] = gate
+			name_column.append(0)
+			wire_count_column.append(0)
+			matrix_column.append(0)
+			condition_column.append(-1)
+			creg_column.append(-1)
+			params_column.append(-1)
+			continue
+
+		name = gate["name"]
+		name_index = name_indexes.get(name)
+		if name_index is None:
+			name_index = len(names)
+			if name_index > MAX_UINT16:
+				raise Exception("Too many gate names for binary Toaster encoding.")
+			names.append(name)
+			name_indexes[name] = name_index
+		name_column.append(name_index)
+
+		wires = gate["wires"]
+		wire_count_column.append(len(wires))
+		wire_column.extend(wires)
+
+		matrix_column.append(matrix_index)
+
+		options = gate["options"]
+
+		#
+		# Conditions and cregs are interned by their JSON text
+		#
+		if "condition" in options:
+			key = json.dumps(options["condition"], sort_keys=True)
+			index = condition_indexes.get(key)
+			if index is None:
+				index = len(conditions)
+				conditions.append(options["condition"])
+				condition_indexes[key] = index
+			condition_column.append(index)
+		else:
+			condition_column.append(-1)
+
+		if "creg" in options:
+			key = json.dumps(options["creg"], sort_keys=True)
+			index = creg_indexes.get(key)
+			if index is None:
+				index = len(cregs)
+				cregs.append(options["creg"])
+				creg_indexes[key] = index
+			creg_column.append(index)
+		else:
+			creg_column.append(-1)
+
+		if "params" in options:
+			params = options["params"]
+			key = tuple(params)
+			index = param_name_indexes.get(key)
+			if index is None:
+				index = len(param_names)
+				param_names.append(list(key))
+				param_name_indexes[key] = index
+			params_column.append(index)
+
+			for value in params.values():
+				value_type = type(value)
+				if value_type is float:
+					param_kinds.append(KIND_FLOAT)
+					param_values.append(value)
+				elif value_type is int and -MAX_EXACT_INT <= value <= MAX_EXACT_INT:
+					param_kinds.append(KIND_INT)
+					param_values.append(value)
+				else:
+					param_kinds.append(KIND_VALUE)
+					param_values.append(value_index(value))
+		else:
+			params_column.append(-1)
+
+	meta = {	"head": head,
+				"names": names,
+				"conditions": conditions,
+				"cregs": cregs,
+				"param_names": param_names,
+				"values": values,
+				"gates": extra_gates }
+	meta_data = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+
+	pieces = [MAGIC, struct.pack("<I", len(meta_data)), meta_data]
+	for column_name, typecode in COLUMNS:
+		column = columns[column_name]
+		if sys.byteorder == "big":
+			column.byteswap()
+		pieces.append(struct.pack("<I", len(column)))
+		pieces.append(column.tobytes())
+
+	return b"".join(pieces)
+
+
+def decode_toaster(data):
+	"""
+	Returns Toaster program (dict, as json.loads() of JSON output) from binary encoding
+	"""
+	data = memoryview(data)
+	if bytes(data[:len(MAGIC)]) != MAGIC:
+		raise Exception("Not binary Toaster data.")
+
+	position = len(MAGIC)
+	meta_size = struct.unpack_from("<I", data, position)[0]
+	position += 4
+	meta = json.loads(bytes(data[position:position + meta_size]).decode("utf-8"))
+	position += meta_size
+
+	columns = {}
+	for column_name, typecode in COLUMNS:
+		count = struct.unpack_from("<I", data, position)[0]
+		position += 4
+		column = array(typecode)
+		size = count * column.itemsize
+		if position + size > len(data):
+			raise Exception("Binary Toaster data is truncated.")
+		column.frombytes(data[position:position + size])
+		position += size
+		if sys.byteorder == "big":
+			column.byteswap()
+		columns[column_name] = column.tolist()
+
+	values = meta["values"]
+
+	#
+	# Matrices
+	#
+	matrices = [[]]
+	matrix_sizes = columns["matrix_size"]
+	cell_kinds = columns["cell_kind"]
+	cell_values = columns["cell_value"]
+	cell_index = 0
+	value_index = 0
+	for matrix_index in range(0, len(matrix_sizes), 2):
+		rows = matrix_sizes[matrix_index]
+		row_size = matrix_sizes[matrix_index + 1]
+		matrix = []
+		for row_index in range(rows):
+			row = []
+			for column_index in range(row_size):
+				kind = cell_kinds[cell_index]
+				cell_index += 1
+				value = cell_values[value_index]
+				value_index += 1
+				if kind == KIND_FLOAT:
+					row.append(value)
+				elif kind == KIND_INT:
+					row.append(int(value))
+				elif kind == KIND_COMPLEX:
+					row.append({ "type": "complex", "re": value, "im": cell_values[value_index] })
+					value_index += 1
+				else:
+					row.append(values[int(value)])
+			matrix.append(row)
+		matrices.append(matrix)
+
+	#
+	# Program
+	#
+	names = meta["names"]
+	conditions = meta["conditions"]
+	cregs = meta["cregs"]
+	param_names = meta["param_names"]
+	extra_gates = meta["gates"]
+
+	name_column = columns["name"]
+	wire_count_column = columns["wire_count"]
+	wire_column = columns["wires"]
+	matrix_column = columns["matrix"]
+	condition_column = columns["condition"]
+	creg_column = columns["creg"]
+	params_column = columns["params"]
+	param_kinds = columns["param_kind"]
+	param_values = columns["param_value"]
+
+	program = []
+	wire_index = 0
+	param_index = 0
+	for gate_index in range(len(name_column)):
+		if len(extra_gates) > 0 and str(gate_index) in extra_gates:
+			program.append(extra_gates[str(gate_index)])
+			continue
+
+		wire_count = wire_count_column[gate_index]
+
+		options = {}
+		creg = creg_column[gate_index]
+		if creg >= 0:
+			options["creg"] = cregs[creg]
+		else:
+			condition = condition_column[gate_index]
+			if condition >= 0:
+				options["condition"] = conditions[condition]
+
+			params = params_column[gate_index]
+			if params >= 0:
+				params_dict = {}
+				for param_name in param_names[params]:
+					kind = param_kinds[param_index]
+					value = param_values[param_index]
+					param_index += 1
+					if kind == KIND_INT:
+						value = int(value)
+					elif kind == KIND_VALUE:
+						value = values[int(value)]
+					params_dict[param_name] = value
+				options["params"] = params_dict
+
+		matrix_index = matrix_column[gate_index]
+		program.append({	"name": names[name_column[gate_index]],
+							"wires": wire_column[wire_index:wire_index + wire_count],
+							"options": options,
+							"matrix": matrices[matrix_index] if matrix_index > 0 else [] })
+		wire_index += wire_count
+
+	toaster = dict(meta["head"])
+	toaster["program"] = program
+	return toaster
@@ -0,0 +1,215 @@
+# This code is part of quantastica.qconvert
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+#
+# Conversion worker: long-running process which reads requests as JSON lines
+# from stdin and writes responses as JSON lines to stdout. Python startup and
+# gate table load are paid once, and matrix cache (and result cache, with
+# --result-cache or --cache-dir) stay warm across requests.
+#
+# Request:  {"id": ..., "source_format": "qobj", "dest_format": "pyquil" | "toaster",
+#            "options": {...}, "qobj": {...}}
+#           "qobj_path" (Qobj file, plain or gzip) can be given instead of "qobj".
+#           source_format is optional (default "qobj").
+# Response: {"id": ..., "result": ..., "seconds": ..., "convert_seconds": ...}
+#           {"id": ..., "error": "message", "seconds": ..., "convert_seconds": ...}
+#
+# result is what convert() returns. Binary results ("toaster_binary" option)
+# are base64 encoded, and response has "result_encoding": "base64". seconds is
+# time from reading the request to writing the response (including time
+# waiting for a free pool worker), convert_seconds is time of parsing and
+# converting the request.
+#
+# With --jobs N > 1, requests are converted in a pool of N processes and
+# responses are written as they complete, not in request order (match them by
+# id). At end of input, latency summary is written to stderr.
+#
+# Usage: python -m quantastica.qconvert.worker [-j N] [--result-cache] [--cache-dir DIR]
+#
+
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+
+from .convert import Format, convert, convert_file
+from .gate_table import get_gate_defs
+from .result_cache import ResultCache
+from . import json_backend
+
+#
+# Requests per pool worker read ahead of responses (limits memory when input is faster than conversion)
+#
+PENDING_PER_JOB = 2
+
+#
+# Options added to each request, set by init()
+#
+_options = {}
+
+
+def init(result_cache=False, cache_dir=None):
+	"""
+	Loads gate tables and sets up result cache (in this process or in pool worker)
+	"""
+	global _options
+
+	get_gate_defs()
+
+	_options = {}
+	if cache_dir is not None:
+		_options["result_cache"] = ResultCache(directory=cache_dir)
+	elif result_cache:
+		_options["result_cache"] = True
+
+
+def parse_format(name):
+	try:
+		return Format[str(name).upper()]
+	except KeyError:
+		raise Exception("Unknown format \"" + str(name) + "\".")
+
+
+def handle_line(line):
+	"""
+	Parses and converts one request. Returns response without "seconds".
+	"""
+	started = time.perf_counter()
+
+	response = { "id": None }
+	try:
+		try:
+			request = json_backend.loads(line)
+		except ValueError as e:
+			raise Exception("Invalid JSON: " + str(e))
+		if not isinstance(request, dict):
+			raise Exception("Request must be JSON object.")
+
+		response["id"] = request.get("id")
+
+		if "dest_format" not in request:
+			raise Exception("Missing \"dest_format\".")
+		source_format = parse_format(request.get("source_format", "qobj"))
+		dest_format = parse_format(request["dest_format"])
+
+		options = dict(_options)
+		if request.get("options") is not None:
+			options.update(request["options"])
+
+		if "qobj_path" in request:
+			response["result"] = convert_file(source_format, request["qobj_path"], dest_format, options)
+		elif "qobj" in request:
+			response["result"] = convert(source_format, request["qobj"], dest_format, options)
+		else:
+			raise Exception("Missing \"qobj\" or \"qobj_path\".")
+
+		result = response["result"]
+		if isinstance(result, bytes) or (isinstance(result, list) and len(result) > 0 and isinstance(result[0], bytes)):
+			import base64
+
+			if isinstance(result, bytes):
+				response["result"] = base64.b64encode(result).decode("ascii")
+			else:
+				response["result"] = [base64.b64encode(item).decode("ascii") for item in result]
+			response["result_encoding"] = "base64"
+	except Exception as e:
+		response["error"] = str(e) or type(e).__name__
+
+	response["convert_seconds"] = time.perf_counter() - started
+	return response
+
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def make_parser():
+	parser = argparse.ArgumentParser(prog="python -m quantastica.qconvert.worker", description="Convert requests read as JSON lines from stdin, write responses as JSON lines to stdout.")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="convert in pool of this many processes (default: 1, convert in this process)")
+	parser.add_argument("--result-cache", action="store_true", help="cache results in memory (\"result_cache\" option)")
+	parser.add_argument("--cache-dir", default=None, help="cache results in memory and in this directory")
+	parser.add_argument("-q", "--quiet", action="store_true", help="don't write latency summary to stderr")
+	return parser
+
+
+def main(argv=None, input_stream=None, output_stream=None):
+	args = make_parser().parse_args(argv)
+
+	input_stream = input_stream if input_stream is not None else sys.stdin
+	output_stream = output_stream if output_stream is not None else sys.stdout
+
+	output_lock = threading.Lock()
+	latencies = []
+	errors = 0
+
+	def respond(response, received):
+		nonlocal errors
+
+		response["seconds"] = time.perf_counter() - received
+		line = json.dumps(response) + "\n"
+		with output_lock:
+			latencies.append(response["seconds"])
+			if "error" in response:
+				errors += 1
+			output_stream.write(line)
+			output_stream.flush()
+
+	def requests():
+		for line in input_stream:
+			if line.strip() != "":
+				yield line, time.perf_counter()
+
+	#
+	# Anything printed by conversion code must not end up between responses
+	#
+	with contextlib.redirect_stdout(sys.stderr):
+		if args.jobs <= 1:
+			init(args.result_cache, args.cache_dir)
+			for line, received in requests():
+				respond(handle_line(line), received)
+		else:
+			from concurrent.futures import ProcessPoolExecutor
+
+			pending = threading.BoundedSemaphore(args.jobs * PENDING_PER_JOB)
+
+			def done(future, received):
+				try:
+					response = future.result()
+				except Exception as e:
+					# worker process died
+					response = { "id": None, "error": str(e) or type(e).__name__ }
+				respond(response, received)
+				pending.release()
+
+			with ProcessPoolExecutor(max_workers=args.jobs, initializer=init, initargs=(args.result_cache, args.cache_dir)) as pool:
+				for line, received in requests():
+					pending.acquire()
+					future = pool.submit(handle_line, line)
+					future.add_done_callback(lambda future, received=received: done(future, received))
+
+	if not args.quiet and len(latencies) > 0:
+		sys.stderr.write("%d requests, %d failed, latency mean %.2fms, p50 %.2fms, p99 %.2fms, max %.2fms\n" % (	len(latencies),
+																												errors,
+																												1000 * sum(latencies) / len(latencies),
+																												1000 * percentile(latencies, 0.5),
+																												1000 * percentile(latencies, 0.99),
+																												1000 * max(latencies)))
+
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -12,7 +12,9 @@
 # that they have been altered from the originals.
 
 import pathlib
+import importlib.util
 from setuptools import setup, find_namespace_packages
+from setuptools.command.build_py import build_py
 
 # The directory containing this file
 HERE = pathlib.Path(__file__).parent
@@ -20,6 +22,27 @@ HERE = pathlib.Path(__file__).parent
 # The text of the README file
 README = (HERE / "README.md").read_text()
 
+
+class BuildPyWithGateTable(build_py):
+    """Precompile gate_defs.json into gate_defs.marshal next to it in the build tree"""
+
+    def run(self):
+        super().run()
+
+        spec = importlib.util.spec_from_file_location(
+            "gate_table", str(HERE / "quantastica" / "qconvert" / "gate_table.py")
+        )
+        gate_table = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(gate_table)
+
+        target_dir = pathlib.Path(self.build_lib) / "quantastica" / "qconvert"
+        if not self.dry_run and (target_dir / "gate_defs.json").exists():
+            gate_table.write_compiled_gate_defs(
+                str(target_dir / "gate_defs.json"),
+                str(target_dir / "gate_defs.marshal"),
+            )
+
+
 # This call to setup() does all the work
 setup(
     name="quantastica-qconvert",
@@ -42,5 +65,8 @@ setup(
     packages=find_namespace_packages(),
     include_package_data=True,
     install_requires=[],
-    entry_points={},
+    entry_points={
+        "console_scripts": ["qconvert=quantastica.qconvert.cli:main", "qconvert-worker=quantastica.qconvert.worker:main"],
+    },
+    cmdclass={"build_py": BuildPyWithGateTable},
 )
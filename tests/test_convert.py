@@ -13,6 +13,7 @@
 
 import unittest
 import json
+import io
 import os
 import logging
 import time
@@ -23,7 +24,19 @@ import sys
 #!!!
 
 
-from quantastica.qconvert import convert, Format
+from quantastica.qconvert import convert, Format, supported_gates
+from quantastica.qconvert import convert_file, convert_stream
+from quantastica.qconvert import expand_toaster_matrices
+from quantastica.qconvert import convert_multi, ExperimentIR
+from quantastica.qconvert import ir
+from quantastica.qconvert.qobj_to_pyquil import emission_plans
+from quantastica.qconvert import ResultCache
+from quantastica.qconvert import gate_table, matrix_cache, numpy_batch
+from quantastica.qconvert.qconvert_base import MatrixCache, compile_matrix
+from quantastica.qconvert.qconvert_qobj import QConvertQobj
+from quantastica.qconvert.qobj_to_toaster import QobjToToaster
+from quantastica.qconvert.qobj_to_pyquil import QobjToPyquil
+from quantastica.qconvert.qconvert_base import eval_mathjs_string
 
 
 class TestConvert(unittest.TestCase):
@@ -148,6 +161,1035 @@ class TestConvert(unittest.TestCase):
         self.assertFalse("qc.run" in ret)
         self.assertTrue(lattice in ret)
 
+    def test_gate_defs_not_loaded_on_import(self):
+        import subprocess
+
+        code = (
+            "from quantastica import qconvert\n"
+            "from quantastica.qconvert import gate_table\n"
+            "assert gate_table._gate_defs is None\n"
+            "qconvert.convert(qconvert.Format.QOBJ, {}, qconvert.Format.PYQUIL)\n"
+            "assert gate_table._gate_defs is None\n"
+            "qconvert.supported_gates()\n"
+            "assert gate_table._gate_defs is not None\n"
+        )
+        subprocess.check_call(
+            [sys.executable, "-c", code], cwd=self.abspath("..")
+        )
+
+    def test_gate_defs_slices(self):
+        full = gate_table.get_gate_defs()
+        self.assertEqual(sorted(full.keys()), sorted(supported_gates()))
+
+        pyquil = gate_table.get_gate_defs("pyquil")
+        self.assertEqual(pyquil["u3"]["matrix"], full["u3"]["matrix"])
+        self.assertEqual(
+            pyquil["u3"]["exportInfo"]["pyquil"],
+            full["u3"]["exportInfo"]["pyquil"],
+        )
+        self.assertNotIn("cirq", pyquil["u3"]["exportInfo"])
+
+        toaster = gate_table.get_gate_defs("toaster")
+        self.assertEqual(toaster["u3"]["matrix"], full["u3"]["matrix"])
+        self.assertNotIn("exportInfo", toaster["u3"])
+
+        self.assertIs(gate_table.get_gate_defs("toaster"), toaster)
+
+    def test_gate_defs_compiled_file(self):
+        import tempfile
+        import shutil
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "gate_defs.json")
+            compiled_path = os.path.join(tmp, "gate_defs.marshal")
+            shutil.copy(gate_table.gate_defs_path, json_path)
+
+            gate_table.write_compiled_gate_defs(json_path, compiled_path)
+            self.assertEqual(
+                gate_table.load_gate_defs(json_path, compiled_path),
+                gate_table.load_gate_defs(json_path, None),
+            )
+
+            # stale compiled file must be ignored
+            with open(json_path, "w") as f:
+                json.dump({"x": {"params": []}}, f)
+            self.assertEqual(
+                gate_table.load_gate_defs(json_path, compiled_path),
+                {"x": {"params": []}},
+            )
+
+    def test_matrix_cache(self):
+        matrix_cache.clear()
+        cached = convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)
+        info = matrix_cache.info()
+        self.assertTrue(info["hits"] > 0)
+        self.assertTrue(info["constant_size"] > 0)
+
+        uncached = convert(
+            Format.QOBJ,
+            self.qaoa_dict,
+            Format.TOASTER,
+            options={"matrix_cache": False},
+        )
+        self.assertEqual(cached, uncached)
+        self.assertEqual(matrix_cache.info(), info)
+
+    def test_matrix_cache_eviction_and_precision(self):
+        cache = MatrixCache(maxsize=2)
+        rz = gate_table.get_gate_defs()["rz"]
+
+        for phi in [0.1, 0.2, 0.1, 0.3, 0.4]:
+            cache.get("rz", rz, {"phi": phi})
+        info = cache.info()
+        self.assertEqual(info["hits"], 1)
+        self.assertEqual(info["misses"], 4)
+        self.assertEqual(info["evictions"], 2)
+        self.assertEqual(info["size"], 2)
+
+        a = cache.get("rz", rz, {"phi": 0.50001}, precision=3)
+        b = cache.get("rz", rz, {"phi": 0.49999}, precision=3)
+        self.assertIs(a, b)
+        self.assertEqual(a, cache.get("rz", rz, {"phi": 0.5}))
+
+    def test_compile_matrix(self):
+        u3 = gate_table.get_gate_defs()["u3"]
+        evaluate = compile_matrix(u3["matrix"], u3["params"])
+        m = evaluate(0.0, 0.0, 0.0)
+        self.assertEqual(m[0][0], {"type": "complex", "re": 1.0, "im": 0.0})
+        self.assertEqual(m[1][1], {"type": "complex", "re": 1.0, "im": 0.0})
+
+        # imaginary literals like "0.5+0.5i"
+        srn = gate_table.get_gate_defs()["srn"]
+        m = compile_matrix(srn["matrix"], srn["params"])()
+        self.assertEqual(m[0][0], {"type": "complex", "re": 0.5, "im": 0.5})
+
+    def test_expression_restricted(self):
+        self.assertAlmostEqual(eval_mathjs_string("cos(pi)", None).real, -1)
+        for expression in ["__import__(os)", "x.__class__", "open(x)"]:
+            self.assertRaises(
+                Exception, eval_mathjs_string, expression, {"x": 1}
+            )
+        self.assertRaises(
+            Exception, compile_matrix, [["cos(alpha)"]], ["theta"]
+        )
+
+    @unittest.skipUnless(numpy_batch.numpy_available(), "NumPy not installed")
+    def test_vectorize(self):
+        from quantastica.qconvert.qobj_to_toaster import QobjToToaster
+
+        views = []
+
+        class Recorder(QobjToToaster):
+            def on_gate(self, data):
+                views.append(data["matrix_array"])
+                super().on_gate(data)
+
+        scalar = json.loads(
+            convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)
+        )
+        vectorized = json.loads(
+            Recorder().convert(self.qaoa_dict, {"vectorize": True})
+        )
+        self.assertEqual(len(scalar["program"]), len(vectorized["program"]))
+        for a, b in zip(scalar["program"], vectorized["program"]):
+            self.assertEqual(a["name"], b["name"])
+            for row_a, row_b in zip(a["matrix"], b["matrix"]):
+                for cell_a, cell_b in zip(row_a, row_b):
+                    if isinstance(cell_a, dict):
+                        self.assertAlmostEqual(cell_a["re"], cell_b["re"])
+                        self.assertAlmostEqual(cell_a["im"], cell_b["im"])
+                    else:
+                        self.assertEqual(cell_a, cell_b)
+
+        # u1/u2 have params: their matrices come from the batch array
+        self.assertTrue(any(view is not None for view in views))
+        view = next(view for view in views if view is not None)
+        self.assertEqual(view.shape, (2, 2))
+
+    def test_vectorize_without_numpy(self):
+        saved = numpy_batch.numpy
+        numpy_batch.numpy = None
+        try:
+            ret = convert(
+                Format.QOBJ,
+                self.qaoa_dict,
+                Format.TOASTER,
+                options={"vectorize": True},
+            )
+        finally:
+            numpy_batch.numpy = saved
+        self.assertEqual(
+            ret, convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)
+        )
+
+    def test_workers(self):
+        from quantastica.qconvert import parallel
+
+        qobj = {
+            "experiments": self.qaoa_dict["experiments"]
+            + self.bell_dict["experiments"]
+            + self.qaoa_dict["experiments"]
+        }
+        for dest_format in [Format.PYQUIL, Format.TOASTER]:
+            sequential = convert(
+                Format.QOBJ, qobj, dest_format, {"all_experiments": True}
+            )
+            parallel_results = convert(
+                Format.QOBJ,
+                qobj,
+                dest_format,
+                {"all_experiments": True, "workers": 2},
+            )
+            self.assertEqual(len(parallel_results), 3)
+            self.assertEqual(sequential, parallel_results)
+
+        # pool is reused
+        self.assertIs(parallel.get_pool(2), parallel.get_pool(2))
+
+        # broken pool (worker died) is replaced
+        from concurrent.futures.process import BrokenProcessPool
+        pool = parallel.get_pool(2)
+        with self.assertRaises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result()
+        self.assertEqual(convert(Format.QOBJ, qobj, Format.TOASTER, {"all_experiments": True, "workers": 2}), sequential)
+        self.assertIsNot(parallel.get_pool(2), pool)
+
+    def test_balance_chunks(self):
+        from quantastica.qconvert.parallel import balance_chunks
+
+        experiments = [
+            {"instructions": [{}] * size} for size in [1, 50, 2, 48, 3, 1]
+        ]
+        chunks = balance_chunks(experiments, 2)
+        self.assertEqual(sorted(sum(chunks, [])), list(range(6)))
+        totals = [
+            sum(len(experiments[i]["instructions"]) for i in chunk)
+            for chunk in chunks
+        ]
+        self.assertTrue(abs(totals[0] - totals[1]) <= 2)
+
+    def test_convert_file(self):
+        import gzip
+        import tempfile
+
+        qobj = dict(self.qaoa_dict)
+        qobj["experiments"] = (
+            self.qaoa_dict["experiments"] + self.bell_dict["experiments"]
+        )
+        options = {"all_experiments": True}
+        expected = convert(Format.QOBJ, qobj, Format.TOASTER, options)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "qobj.json")
+            with open(path, "w") as f:
+                json.dump(qobj, f, indent=4)
+            gz_path = os.path.join(tmp, "qobj.json.gz")
+            with gzip.open(gz_path, "wt") as f:
+                json.dump(qobj, f)
+
+            self.assertEqual(
+                convert_file(Format.QOBJ, path, Format.TOASTER, options),
+                expected,
+            )
+            self.assertEqual(
+                convert_file(Format.QOBJ, gz_path, Format.TOASTER, options),
+                expected,
+            )
+            with open(path, "rb") as f:
+                self.assertEqual(
+                    convert_file(Format.QOBJ, f, Format.TOASTER),
+                    expected[0],
+                )
+
+        self.assertEqual(
+            convert_file(Format.QOBJ, io.StringIO("{}"), Format.PYQUIL), []
+        )
+
+    def test_stream_reader_small_chunks(self):
+        from quantastica.qconvert.qobj_stream import QobjStreamReader
+
+        qobj = {
+            "qobj_id": "x",
+            "experiments": self.bell_dict["experiments"] * 3,
+            "config": {"shots": 12345678},
+        }
+        reader = QobjStreamReader(io.StringIO(json.dumps(qobj)), chunk_size=5)
+        self.assertEqual(list(reader.experiments()), qobj["experiments"])
+        self.assertEqual(reader.fields["config"], {"shots": 12345678})
+
+        results = list(
+            convert_stream(
+                Format.QOBJ, io.BytesIO(json.dumps(qobj).encode()), Format.PYQUIL
+            )
+        )
+        self.assertEqual(len(results), 3)
+
+        reader = QobjStreamReader(io.StringIO('{"experiments": [{"a": 1'))
+        self.assertRaises(Exception, list, reader.experiments())
+
+    def test_pyquil_output_stream(self):
+        expected = convert(
+            Format.QOBJ,
+            self.qaoa_dict,
+            Format.PYQUIL,
+            options={"all_experiments": True},
+        )
+        stream = io.StringIO()
+        ret = convert(
+            Format.QOBJ,
+            self.qaoa_dict,
+            Format.PYQUIL,
+            options={"all_experiments": True, "output_stream": stream},
+        )
+        self.assertEqual(ret, [None])
+        self.assertEqual(stream.getvalue(), expected[0])
+
+    def test_pyquil_emission_fragments(self):
+        # linear emission: sections are lists of small fragments, joined (or written) once at the end
+        class RecordingStream:
+            def __init__(self):
+                self.calls = []
+
+            def write(self, text):
+                self.calls.append(("write", text))
+
+            def writelines(self, lines):
+                self.calls.append(("writelines", lines))
+
+        expected = convert(Format.QOBJ, self.qaoa_dict, Format.PYQUIL)
+        instructions = self.qaoa_dict["experiments"][0]["instructions"]
+
+        stream = RecordingStream()
+        converter = QobjToPyquil()
+        converter.convert(self.qaoa_dict, {"output_stream": stream})
+
+        for section in [converter.imports, converter.program_head, converter.program_body]:
+            self.assertIs(type(section), list)
+            self.assertTrue(all(type(fragment) is str and len(fragment) < 200 for fragment in section))
+        self.assertGreaterEqual(len(converter.program_body), len([i for i in instructions if i["name"] != "barrier"]))
+
+        self.assertEqual(len(stream.calls), 1)
+        method, lines = stream.calls[0]
+        self.assertEqual(method, "writelines")
+        self.assertIs(type(lines), list)
+        self.assertEqual("".join(lines), expected)
+
+    def test_many_cregs(self):
+        creg_count = 100
+        creg_len = 3
+        memory_slots = creg_count * creg_len
+
+        instructions = []
+        for memory in range(memory_slots):
+            instructions.append({"name": "measure", "qubits": [0], "memory": [memory]})
+
+        last_mask = ((1 << creg_len) - 1) << (memory_slots - creg_len)
+        last_val = 5 << (memory_slots - creg_len)
+        instructions.append({"name": "bfunc", "mask": hex(last_mask), "relation": "==", "val": hex(last_val), "register": memory_slots})
+        instructions.append({"name": "x", "qubits": [0], "conditional": memory_slots})
+
+        qobj = {
+            "experiments": [
+                {
+                    "header": {
+                        "n_qubits": 1,
+                        "memory_slots": memory_slots,
+                        "creg_sizes": [["c" + str(i), creg_len] for i in range(creg_count)],
+                    },
+                    "instructions": instructions,
+                }
+            ]
+        }
+
+        toaster = json.loads(convert(Format.QOBJ, qobj, Format.TOASTER))
+        program = toaster["program"]
+        for memory in range(memory_slots):
+            creg = program[memory]["options"]["creg"]
+            self.assertEqual(creg["name"], "c" + str(memory // creg_len))
+            self.assertEqual(creg["bit"], memory % creg_len)
+
+        condition = program[-1]["options"]["condition"]
+        self.assertEqual(condition["creg"], "c" + str(creg_count - 1))
+        self.assertEqual(condition["value"], 5)
+
+    def test_lazy_gate_events(self):
+        class EagerConverter(QConvertQobj):
+            def on_start(self, data):
+                self.result = []
+
+            def on_gate(self, data):
+                self.result.append((data.name, data.params_dict, data["matrix"], "params_dict" in data))
+
+        class LazyConverter(EagerConverter):
+            gate_event_fields = ("name", "params")
+
+        expected = EagerConverter().convert(self.qaoa_dict, {})
+        self.assertEqual(LazyConverter().convert(self.qaoa_dict, {}), expected)
+        self.assertEqual(LazyConverter().convert(self.qaoa_dict, {"matrix_cache": False}), expected)
+
+        converter = LazyConverter()
+        converter.options = {}
+        converter.convert_ir(ExperimentIR(self.qaoa_dict["experiments"][0]))
+        self.assertEqual(converter.result, expected)
+
+        #
+        # pyQuil subclass reading matrix gets the same matrix as converters with full gate_defs
+        #
+        class MatrixPyquil(QobjToPyquil):
+            def on_start(self, data):
+                super().on_start(data)
+                self.matrices = []
+
+            def on_gate(self, data):
+                super().on_gate(data)
+                self.matrices.append(data["matrix"])
+
+        converter = MatrixPyquil()
+        converter.convert(self.qaoa_dict, {})
+        self.assertEqual(converter.matrices, [matrix for name, params_dict, matrix, has_params in expected])
+        self.assertTrue(any(matrix is not None for matrix in converter.matrices))
+
+    def test_event_records_dict_compatible(self):
+        import collections.abc
+
+        class DictStyleConverter(QConvertQobj):
+            def on_start(self, data):
+                self.result = []
+
+            def on_qobj_instruction(self, data):
+                self.result.append(("instruction", data["instruction"]["name"]))
+
+            def on_measure(self, data):
+                self.result.append(("measure", data["qubit"], data["creg_name"], data["creg_bit"]))
+
+            def on_gate(self, data):
+                data["name"] = data["name"].upper()
+                data["extra"] = len(data["qubits"])
+                copied = data.copy()
+                copied["name"] = "changed"
+                data.update({"copied": type(copied) is dict and data["name"] != "changed"}, mapping=isinstance(data, collections.abc.Mapping))
+                self.result.append(
+                    (
+                        "gate",
+                        data["name"],
+                        data["extra"],
+                        "params_dict" in data,
+                        "matrix_array" in data,
+                        data.get("matrix_array", "missing"),
+                        dict(data.items())["qubits"],
+                        data["copied"] and data["mapping"],
+                    )
+                )
+
+        result = DictStyleConverter().convert(self.bell_dict, {})
+
+        self.assertEqual(
+            result,
+            [
+                ("instruction", "h"),
+                ("gate", "H", 1, True, False, "missing", [0], True),
+                ("instruction", "cx"),
+                ("gate", "CX", 2, True, False, "missing", [0, 1], True),
+                ("instruction", "measure"),
+                ("measure", 0, "c", 0),
+                ("instruction", "measure"),
+                ("measure", 1, "c", 1),
+            ],
+        )
+
+    def test_convert_multi(self):
+        formats = [Format.PYQUIL, Format.TOASTER]
+        for qobj in [self.bell_dict, self.qaoa_dict]:
+            for options in [{}, {"all_experiments": True}, {"create_exec_code": False, "intern_matrices": True}]:
+                expected = [convert(Format.QOBJ, qobj, dest_format, dict(options)) for dest_format in formats]
+                self.assertEqual(convert_multi(Format.QOBJ, qobj, formats, dict(options)), expected)
+
+        # options per format
+        pyquil_code, toaster = convert_multi(
+            Format.QOBJ,
+            self.bell_dict,
+            formats,
+            [{"shots": 7}, {"intern_matrices": True}],
+        )
+        self.assertEqual(pyquil_code, convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, {"shots": 7}))
+        self.assertEqual(toaster, convert(Format.QOBJ, self.bell_dict, Format.TOASTER, {"intern_matrices": True}))
+
+        self.assertEqual(convert_multi(Format.QOBJ, {"experiments": []}, formats), [[], []])
+
+        # options applied as by convert()
+        for options in [{"peephole": True}, {"compact_qubits": True}, {"result_cache": ResultCache()}]:
+            expected = [convert(Format.QOBJ, self.qaoa_dict, dest_format, dict(options)) for dest_format in formats]
+            self.assertEqual(convert_multi(Format.QOBJ, self.qaoa_dict, formats, dict(options)), expected)
+
+        cache = ResultCache()
+        convert_multi(Format.QOBJ, self.bell_dict, formats, {"result_cache": cache})
+        self.assertEqual(convert_multi(Format.QOBJ, self.bell_dict, formats, {"result_cache": cache}), [convert(Format.QOBJ, self.bell_dict, dest_format) for dest_format in formats])
+        self.assertEqual(cache.hits, 2)
+
+        qubit_maps = []
+        convert_multi(Format.QOBJ, self.bell_dict, formats, [{"compact_qubits": True, "qubit_maps": qubit_maps}, {}])
+        self.assertEqual(len(qubit_maps), 1)
+
+        # shared options dict: one map per experiment, as convert()
+        qubit_maps = []
+        qobj = {"experiments": self.bell_dict["experiments"] * 2}
+        convert_multi(Format.QOBJ, qobj, formats, {"compact_qubits": True, "qubit_maps": qubit_maps, "all_experiments": True})
+        self.assertEqual(qubit_maps, [{0: 0, 1: 1}, {0: 0, 1: 1}])
+
+        self.assertRaises(Exception, convert_multi, Format.QOBJ, self.bell_dict, formats, {"stats": {}})
+
+    def test_experiment_ir(self):
+        experiment = {
+            "header": {"n_qubits": 2, "memory_slots": 2, "creg_sizes": [["c", 2]]},
+            "instructions": [
+                {"name": "iden", "qubits": [0]},
+                {"name": "measure", "qubits": [0], "memory": [1]},
+                {"name": "bfunc", "mask": "0x3", "relation": "==", "val": "0x2", "register": 2},
+                {"name": "u1", "qubits": [1], "params": [0.5], "conditional": 2},
+                {"name": "id", "qubits": [1]},
+            ],
+        }
+
+        experiment_ir = ExperimentIR(experiment)
+
+        self.assertEqual(experiment_ir.ops.tolist(), [ir.OP_GATE, ir.OP_MEASURE, ir.OP_BFUNC, ir.OP_GATE, ir.OP_GATE])
+        self.assertEqual([experiment_ir.name(index) for index in range(len(experiment_ir))], ["id", "measure", "bfunc", "u1", "id"])
+        self.assertEqual(experiment_ir.names[0], experiment_ir.names[4])
+        self.assertEqual(experiment_ir.conditions.tolist(), [-1, -1, 0, 0, -1])
+        self.assertEqual(experiment_ir.condition(3)["creg_value"], 2)
+        self.assertEqual(experiment_ir.row_memory[1], [1])
+
+        offsets, qubits = experiment_ir.qubit_columns()
+        self.assertEqual(offsets.tolist(), [0, 1, 2, 2, 3, 4])
+        self.assertEqual(qubits.tolist(), [0, 0, 1, 1])
+
+        offsets, params = experiment_ir.param_columns()
+        self.assertEqual(offsets.tolist(), [0, 0, 0, 0, 1, 1])
+        self.assertEqual(params.tolist(), [0.5])
+
+    def test_toaster_output_stream(self):
+        for qobj in [self.bell_dict, self.qaoa_dict]:
+            expected = convert(Format.QOBJ, qobj, Format.TOASTER)
+
+            stream = io.StringIO()
+            ret = convert(
+                Format.QOBJ,
+                qobj,
+                Format.TOASTER,
+                options={"output_stream": stream},
+            )
+            self.assertIsNone(ret)
+            self.assertEqual(stream.getvalue(), expected)
+
+            chunks = []
+            convert(
+                Format.QOBJ,
+                qobj,
+                Format.TOASTER,
+                options={"output_stream": chunks.append},
+            )
+            self.assertEqual("".join(chunks), expected)
+
+    def test_toaster_intern_matrices(self):
+        for qobj in [self.bell_dict, self.qaoa_dict]:
+            expected = convert(Format.QOBJ, qobj, Format.TOASTER)
+
+            interned = convert(
+                Format.QOBJ,
+                qobj,
+                Format.TOASTER,
+                options={"intern_matrices": True},
+            )
+            self.assertEqual(expand_toaster_matrices(interned), expected)
+            if qobj is self.qaoa_dict:
+                self.assertLess(len(interned), len(expected))
+
+            interned_dict = json.loads(interned)
+            for gate in interned_dict["program"]:
+                if gate["name"] == "measure":
+                    self.assertEqual(gate["matrix"], [])
+                else:
+                    self.assertIsInstance(gate["matrix"], int)
+
+            # unique matrices only
+            matrices = [json.dumps(matrix) for matrix in interned_dict["matrices"]]
+            self.assertEqual(len(matrices), len(set(matrices)))
+
+            stream = io.StringIO()
+            convert(
+                Format.QOBJ,
+                qobj,
+                Format.TOASTER,
+                options={"intern_matrices": True, "output_stream": stream},
+            )
+            self.assertEqual(stream.getvalue(), interned)
+
+    def test_pyquil_emission_plans(self):
+        instructions = [
+            {"name": "u3", "qubits": [0], "params": [0.1, 0.2, 0.3]},
+            {"name": "u3", "qubits": [1], "params": [0.4, 0.5, 0.6]},
+            {"name": "tdg", "qubits": [0]},
+            {"name": "cu2", "qubits": [0, 1], "params": [0.7, 0.8]},
+            {"name": "measure", "qubits": [0], "memory": [0]},
+        ]
+        qobj = {"experiments": [{
+            "header": {"n_qubits": 2, "memory_slots": 1, "creg_sizes": [["c", 1]]},
+            "instructions": instructions,
+        }]}
+
+        emission_plans.clear()
+        code = convert(Format.QOBJ, qobj, Format.PYQUIL, {})
+        self.assertIn("p += u3(0.1, 0.2, 0.3)(0)\n", code)
+        self.assertIn("p += u3(0.4, 0.5, 0.6)(1)\n", code)
+        self.assertIn("p += PHASE(-0.7853981633974483, 0)\n", code)
+        self.assertIn("p += cu2(0.7, 0.8)(0, 1)\n", code)
+        self.assertEqual(code.count("u3_defgate = DefGate("), 1)
+        self.assertEqual(code.count("p_theta = Parameter('theta')"), 1)
+
+        # one plan per gate, reused by later conversions
+        self.assertEqual(len(emission_plans), 3)
+        self.assertEqual(convert(Format.QOBJ, qobj, Format.PYQUIL, {}), code)
+        self.assertEqual(len(emission_plans), 3)
+
+    def test_cli(self):
+        import contextlib
+        import gzip
+        import shutil
+        import tempfile
+        from quantastica.qconvert import cli
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_dir = os.path.join(directory, "in", "sub")
+            output_dir = os.path.join(directory, "out")
+            os.makedirs(input_dir)
+            shutil.copy(self.abspath("files/qobj_bell.json"), input_dir)
+            with open(self.abspath("files/qobj_qaoa.json"), "rb") as source:
+                with gzip.open(os.path.join(input_dir, "qobj_qaoa.json.gz"), "wb") as target:
+                    target.write(source.read())
+
+            def run(*args):
+                stdout = io.StringIO()
+                with contextlib.redirect_stdout(stdout):
+                    ret = cli.main(list(args) + ["-f", "toaster", "-o", output_dir, "-z", os.path.join(directory, "in")])
+                self.assertEqual(ret, 0)
+                return stdout.getvalue().splitlines()[-1]
+
+            self.assertTrue(run("-j", "2").startswith("2 converted, 0 unchanged, 0 failed"))
+            with gzip.open(os.path.join(output_dir, "sub", "qobj_qaoa.toaster.json.gz"), "rt") as file:
+                self.assertEqual(file.read(), convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER))
+
+            # incremental: unchanged inputs are skipped, touched input with same content too
+            self.assertTrue(run("-j", "1").startswith("0 converted, 2 unchanged"))
+            os.utime(os.path.join(input_dir, "qobj_bell.json"), (1, 1))
+            self.assertTrue(run("-j", "1").startswith("0 converted, 2 unchanged"))
+            self.assertTrue(run("-j", "1", "-O", "shots=10").startswith("2 converted, 0 unchanged"))
+
+            # only gate instructions are counted as gates
+            settings = {"format": "toaster", "options": {}, "all_experiments": False, "gzip": False, "output_dir": output_dir}
+            bell_path = os.path.join(input_dir, "qobj_bell.json")
+            self.assertEqual(cli.convert_input(bell_path, "qobj_bell.json", settings)[3], 2)
+
+            # inputs with the same name from different directories: glob keeps directories, files collide
+            other_dir = os.path.join(directory, "in", "other")
+            os.makedirs(other_dir)
+            shutil.copy(bell_path, other_dir)
+            inputs = cli.find_inputs([os.path.join(directory, "in", "*", "*.json")])
+            self.assertEqual(sorted(relative_path for path, relative_path in inputs), [os.path.join("other", "qobj_bell.json"), os.path.join("sub", "qobj_bell.json")])
+            cli.check_outputs(inputs, settings)
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(cli.main(["-f", "toaster", "-o", output_dir, bell_path, os.path.join(other_dir, "qobj_bell.json")]), 2)
+
+    def test_convert_template(self):
+        from quantastica.qconvert import convert_template
+
+        qobj = self.qaoa_dict
+        for dest_format in [Format.PYQUIL, Format.TOASTER]:
+            template = convert_template(Format.QOBJ, qobj, dest_format)
+            self.assertEqual(template.bind(template.params), convert(Format.QOBJ, qobj, dest_format))
+
+            # new values: same as converting experiment with these values
+            values = [param + 0.125 * (index + 1) for index, param in enumerate(template.params)]
+            self.assertTrue(len(values) > 0)
+            experiment = json.loads(json.dumps(qobj["experiments"][0]))
+            next_value = iter(values)
+            for instruction in experiment["instructions"]:
+                if "params" in instruction and instruction["name"] not in ["bfunc", "measure", "barrier"]:
+                    instruction["params"] = [next(next_value) for param in instruction["params"]]
+
+            bound = {"experiments": [experiment]}
+            self.assertEqual(template.bind(values), convert(Format.QOBJ, bound, dest_format))
+            self.assertEqual(template.bind_experiment(experiment), convert(Format.QOBJ, bound, dest_format))
+
+            sweep = {"experiments": [qobj["experiments"][0], experiment, self.bell_dict["experiments"][0], experiment]}
+            options = {"all_experiments": True}
+            self.assertEqual(convert(Format.QOBJ, sweep, dest_format, dict(options, parameter_templates=True)), convert(Format.QOBJ, sweep, dest_format, options))
+
+        with self.assertRaises(Exception):
+            convert_template(Format.QOBJ, qobj, Format.TOASTER, {"intern_matrices": True})
+
+    def test_peephole(self):
+        from quantastica.qconvert.peephole import optimize_instructions, gate_matrix, multiply
+        from quantastica.qconvert.qconvert_base import get_gate_defs
+
+        def gate(name, qubits, params=None):
+            instruction = {"name": name, "qubits": qubits}
+            if params is not None:
+                instruction["params"] = params
+            return instruction
+
+        def names(instructions):
+            return [instruction["name"] for instruction in optimize_instructions(instructions)]
+
+        self.assertEqual(names([gate("h", [0]), gate("x", [0]), gate("x", [0]), gate("h", [0]), gate("cx", [0, 1]), gate("cx", [0, 1])]), [])
+        self.assertEqual(names([gate("cz", [0, 1]), gate("cz", [1, 0]), gate("s", [2]), gate("sdg", [2]), gate("id", [1])]), [])
+        self.assertEqual(names([gate("cx", [0, 1]), gate("cx", [1, 0])]), ["cx", "cx"])
+        self.assertEqual(optimize_instructions([gate("rz", [0], [0.5]), gate("rz", [0], [0.25])]), [gate("rz", [0], [0.75])])
+
+        # nothing cancelled across measure, barrier, conditional gate or gate on shared qubit
+        measure = {"name": "measure", "qubits": [0], "memory": [0]}
+        conditional = dict(gate("x", [0]), conditional=0)
+        self.assertEqual(names([gate("h", [0]), measure, gate("h", [0])]), ["h", "measure", "h"])
+        self.assertEqual(names([gate("h", [0]), gate("barrier", [0, 1]), gate("h", [0])]), ["h", "barrier", "h"])
+        self.assertEqual(names([gate("h", [0]), {"name": "barrier"}, gate("h", [0])]), ["h", "barrier", "h"])
+        self.assertEqual(names([gate("x", [0]), conditional, gate("x", [0])]), ["x", "x", "x"])
+        self.assertEqual(names([gate("h", [0]), gate("cx", [0, 1]), gate("h", [0])]), ["h", "cx", "h"])
+
+        # mixed rotations: one u3 equal to product up to global phase
+        gate_defs = get_gate_defs()
+        run = [gate("u1", [0], [0.3]), gate("ry", [0], [1.1]), gate("u3", [0], [0.4, -0.7, 2.0]), gate("rz", [0], [0.9])]
+        optimized = optimize_instructions(run)
+        self.assertEqual(names(run), ["u3"])
+        expected = gate_matrix(run[0], gate_defs)
+        for instruction in run[1:]:
+            expected = multiply(gate_matrix(instruction, gate_defs), expected)
+        actual = gate_matrix(optimized[0], gate_defs)
+        phase = expected[0][0] / actual[0][0]
+        for row in range(2):
+            for column in range(2):
+                self.assertAlmostEqual(abs(actual[row][column] * phase - expected[row][column]), 0)
+        self.assertEqual(names([gate("u3", [0], [0.4, -0.7, 2.0]), gate("u3", [0], [-0.4, -2.0, 0.7])]), [])
+
+        qobj = json.loads(json.dumps(self.bell_dict))
+        qobj["experiments"][0]["instructions"][0:0] = [gate("x", [1]), gate("x", [1])]
+        self.assertEqual(convert(Format.QOBJ, qobj, Format.PYQUIL, {"peephole": True}), convert(Format.QOBJ, self.bell_dict, Format.PYQUIL))
+
+    def test_compact_qubits(self):
+        from quantastica.qconvert import qubit_map
+
+        def remapped(qobj, mapping, n_qubits):
+            qobj = json.loads(json.dumps(qobj))
+            experiment = qobj["experiments"][0]
+            for instruction in experiment["instructions"]:
+                instruction["qubits"] = [mapping[qubit] for qubit in instruction["qubits"]]
+            experiment["header"]["n_qubits"] = n_qubits
+            experiment["header"].pop("qubit_labels")
+            return qobj
+
+        # bell circuit on qubits 5 and 2 of 27-qubit device, with barrier on all qubits
+        device = remapped(self.bell_dict, {0: 5, 1: 2}, 27)
+        device["experiments"][0]["instructions"].insert(2, {"name": "barrier", "qubits": list(range(27))})
+        self.assertEqual(qubit_map(device["experiments"][0]), {2: 0, 5: 1})
+
+        expected = remapped(self.bell_dict, {0: 1, 1: 0}, 2)
+        expected["experiments"][0]["instructions"].insert(2, {"name": "barrier", "qubits": [0, 1]})
+
+        qubit_maps = []
+        options = {"compact_qubits": True, "qubit_maps": qubit_maps}
+        for dest_format in [Format.PYQUIL, Format.TOASTER]:
+            self.assertEqual(convert(Format.QOBJ, device, dest_format, options), convert(Format.QOBJ, expected, dest_format))
+        self.assertEqual(qubit_maps, [{2: 0, 5: 1}, {2: 0, 5: 1}])
+        self.assertIn("2q-qvm", convert(Format.QOBJ, device, Format.PYQUIL, {"compact_qubits": True}))
+        self.assertIn("27q-qvm", convert(Format.QOBJ, device, Format.PYQUIL))
+        self.assertEqual(json.loads(convert(Format.QOBJ, device, Format.TOASTER, options))["qubits"], 2)
+
+        # templates
+        from quantastica.qconvert import convert_template
+        qubit_maps = []
+        options = {"compact_qubits": True, "qubit_maps": qubit_maps}
+        template = convert_template(Format.QOBJ, device, Format.PYQUIL, options)
+        self.assertEqual(template.bind(template.params), convert(Format.QOBJ, expected, Format.PYQUIL))
+        self.assertEqual(qubit_maps, [{2: 0, 5: 1}])
+
+        # barrier on unused qubit is dropped by compaction, template slots follow the compacted instructions
+        experiment = {
+            "header": {"n_qubits": 5, "memory_slots": 1, "creg_sizes": [["c", 1]]},
+            "instructions": [
+                {"name": "barrier", "qubits": [4]},
+                {"name": "h", "qubits": [0]},
+                {"name": "rx", "params": [0.3], "qubits": [1]},
+                {"name": "measure", "qubits": [0], "memory": [0]},
+            ],
+        }
+        swept = json.loads(json.dumps(experiment))
+        swept["instructions"][2]["params"] = [0.7]
+        qobj = {"experiments": [experiment, swept]}
+        options = {"compact_qubits": True, "all_experiments": True}
+        for dest_format in [Format.PYQUIL, Format.TOASTER]:
+            expected = convert(Format.QOBJ, qobj, dest_format, options)
+            self.assertEqual(convert(Format.QOBJ, qobj, dest_format, dict(options, parameter_templates=True)), expected)
+            template = convert_template(Format.QOBJ, qobj, dest_format, {"compact_qubits": True})
+            self.assertEqual(template.bind_experiment(swept), expected[1])
+
+    def test_toaster_binary(self):
+        import tempfile
+        from quantastica.qconvert import encode_toaster, decode_toaster
+
+        for qobj in [self.bell_dict, self.qaoa_dict]:
+            expected = convert(Format.QOBJ, qobj, Format.TOASTER)
+            data = convert(Format.QOBJ, qobj, Format.TOASTER, {"toaster_binary": True, "intern_matrices": True})
+            self.assertIsInstance(data, bytes)
+            self.assertLess(len(data), len(expected))
+            self.assertEqual(decode_toaster(data), json.loads(expected))
+            self.assertEqual(decode_toaster(encode_toaster(expected)), json.loads(expected))
+
+        # values which don't fit columns are kept as they are
+        toaster = {
+            "qubits": 2,
+            "program": [
+                {"name": "x", "wires": [0], "options": {"other": 1}, "matrix": [[0, 1], [1, 0]]},
+                {"name": "u", "wires": [1], "options": {"params": {"a": "pi/2", "b": 2 ** 60, "c": 1, "d": 0.5}}, "matrix": [[1, {"type": "complex", "re": 0, "im": 1}], [0.5, {"type": "complex", "re": 0.5, "im": -0.5}]]},
+                {"name": "measure", "wires": [1], "options": {"creg": {"bit": 0, "name": "c"}}, "matrix": []},
+            ],
+            "extra": [1],
+        }
+        self.assertEqual(decode_toaster(encode_toaster(toaster)), toaster)
+
+        with self.assertRaises(Exception):
+            convert(Format.QOBJ, self.bell_dict, Format.TOASTER, {"toaster_binary": True, "output_stream": io.StringIO()})
+
+        data = convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"toaster_binary": True})
+        with tempfile.TemporaryDirectory() as directory:
+            convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"toaster_binary": True, "result_cache": ResultCache(directory=directory)})
+            cache = ResultCache(directory=directory)
+            self.assertEqual(convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"toaster_binary": True, "result_cache": cache}), data)
+            self.assertEqual(cache.info()["disk_hits"], 1)
+
+    def test_source_json(self):
+        import gzip
+        import math
+        import tempfile
+        from quantastica.qconvert import json_backend
+
+        path = self.abspath("files/qobj_qaoa.json")
+        with open(path, "rb") as file:
+            data = file.read()
+
+        for dest_format in [Format.PYQUIL, Format.TOASTER]:
+            expected = convert(Format.QOBJ, self.qaoa_dict, dest_format)
+            for source in [data, bytearray(data), memoryview(data), data.decode("utf-8"), gzip.compress(data), path]:
+                self.assertEqual(convert(Format.QOBJ, source, dest_format), expected)
+            for backend in json_backend.available_backends():
+                options = {"json_backend": backend}
+                self.assertEqual(convert(Format.QOBJ, data, dest_format, options), convert(Format.QOBJ, self.qaoa_dict, dest_format, options))
+
+        expected = json.loads(convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER))
+        self.assertEqual(json.loads(convert(Format.QOBJ, data, Format.TOASTER, {"json_backend": "auto"})), expected)
+
+        with tempfile.TemporaryDirectory() as directory:
+            gzip_path = os.path.join(directory, "qobj.json.gz")
+            with open(gzip_path, "wb") as file:
+                file.write(gzip.compress(data))
+            self.assertEqual(convert_multi(Format.QOBJ, gzip_path, [Format.TOASTER]), [convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)])
+
+        # stdlib json extensions are parsed by fallback, errors are stdlib's
+        self.assertTrue(math.isnan(json_backend.loads(b'{"a": NaN}')["a"]))
+        for backend in json_backend.available_backends():
+            self.assertEqual(json.loads(json_backend.dumps([math.inf, 1.5, None], backend))[0], math.inf)
+
+        # JSON in memory with convert_stream() and convert_async()
+        import asyncio
+        from quantastica.qconvert import convert_async
+        all_experiments = {"all_experiments": True}
+        expected = convert(Format.QOBJ, self.qaoa_dict, Format.PYQUIL, all_experiments)
+        self.assertEqual(list(convert_stream(Format.QOBJ, data, Format.PYQUIL, all_experiments)), expected)
+        for source in [data, data.decode("utf-8")]:
+            self.assertEqual(asyncio.run(convert_async(Format.QOBJ, source, Format.PYQUIL, all_experiments)), expected)
+        with self.assertRaises(ValueError):
+            convert(Format.QOBJ, b'{"experiments": [', Format.PYQUIL)
+        with self.assertRaises(Exception):
+            convert(Format.QOBJ, data, Format.TOASTER, {"json_backend": "unknown"})
+
+    def test_worker(self):
+        import contextlib
+        from quantastica.qconvert import worker
+
+        requests = [
+            json.dumps({"id": 1, "dest_format": "toaster", "qobj": self.bell_dict}),
+            json.dumps({"id": "qaoa", "source_format": "qobj", "dest_format": "pyquil", "qobj_path": self.abspath("files/qobj_qaoa.json"), "options": {"all_experiments": True}}),
+            "",
+            "{",
+            json.dumps({"id": 3, "dest_format": "quil", "qobj": self.bell_dict}),
+        ]
+        stdout = io.StringIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(worker.main(["--result-cache"], io.StringIO("\n".join(requests) + "\n"), stdout), 0)
+
+        responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(responses[0]["result"], convert(Format.QOBJ, self.bell_dict, Format.TOASTER))
+        self.assertEqual(responses[1]["id"], "qaoa")
+        self.assertEqual(responses[1]["result"], convert(Format.QOBJ, self.qaoa_dict, Format.PYQUIL, {"all_experiments": True}))
+        self.assertIsNone(responses[2]["id"])
+        self.assertTrue(responses[2]["error"].startswith("Invalid JSON"))
+        self.assertEqual(responses[3]["id"], 3)
+        self.assertIn("error", responses[3])
+        for response in responses:
+            self.assertGreaterEqual(response["seconds"], response["convert_seconds"])
+
+    def test_stats(self):
+        expected = convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)
+
+        stats = {}
+        spans = []
+        options = {"stats": stats, "span_callback": lambda name, start, seconds: spans.append(name)}
+        self.assertEqual(convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, options), expected)
+
+        instructions = self.qaoa_dict["experiments"][0]["instructions"]
+        self.assertEqual(stats["experiments"], 1)
+        self.assertEqual(stats["instructions"], len(instructions))
+        self.assertEqual(stats["instructions_by_name"]["cx"], len([i for i in instructions if i["name"] == "cx"]))
+        self.assertEqual(stats["phases"]["emit"]["calls"], len(instructions))
+        self.assertEqual(stats["emitted_chars"], len(expected))
+        self.assertAlmostEqual(sum(phase["seconds"] for phase in stats["phases"].values()), stats["total_seconds"])
+        for phase in ["setup", "start", "gates", "measure", "barrier", "finish"]:
+            self.assertIn(phase, stats["phases"])
+        self.assertEqual(spans[-2:], ["experiment", "convert"])
+
+        # hooks are restored after conversion
+        converter = QobjToToaster()
+        converter.convert(self.bell_dict, {"stats": {}})
+        self.assertEqual(converter.stats["instructions"], 4)
+        self.assertNotIn("on_gate", vars(converter))
+        self.assertRaises(Exception, convert, Format.QOBJ, self.bell_dict, Format.TOASTER, {"stats": True})
+
+        # experiments converted by workers and in async executor are counted
+        qobj = {"experiments": self.qaoa_dict["experiments"] + self.bell_dict["experiments"]}
+        total = len(instructions) + len(self.bell_dict["experiments"][0]["instructions"])
+        convert(Format.QOBJ, qobj, Format.PYQUIL, {"stats": stats, "workers": 2, "all_experiments": True})
+        self.assertEqual(stats["experiments"], 2)
+        self.assertEqual(stats["instructions"], total)
+        self.assertEqual(stats["workers"]["experiments"], 2)
+
+        import asyncio
+        from quantastica.qconvert import convert_async
+        asyncio.run(convert_async(Format.QOBJ, qobj, Format.PYQUIL, {"stats": stats, "all_experiments": True}))
+        self.assertEqual(stats["experiments"], 2)
+        self.assertEqual(stats["instructions"], total)
+
+        stream = io.StringIO()
+        convert(Format.QOBJ, self.qaoa_dict, Format.PYQUIL, {"stats": stats, "output_stream": stream})
+        self.assertEqual(stats["emitted_chars"], len(stream.getvalue()))
+
+    def test_convert_async(self):
+        import asyncio
+        from quantastica.qconvert import convert_async, iter_convert_async
+        from quantastica.qconvert.async_convert import AsyncConverter
+
+        qobj = {"experiments": self.qaoa_dict["experiments"] + self.bell_dict["experiments"]}
+        options = {"all_experiments": True}
+        expected = convert(Format.QOBJ, qobj, Format.PYQUIL, options)
+
+        async def run():
+            self.assertEqual(await convert_async(Format.QOBJ, qobj, Format.PYQUIL, options), expected)
+            self.assertEqual(await convert_async(Format.QOBJ, qobj, Format.PYQUIL), expected[0])
+
+            converter = AsyncConverter("thread", max_concurrency=1)
+            results = await asyncio.gather(*[converter.convert(Format.QOBJ, qobj, Format.PYQUIL, options) for i in range(3)])
+            self.assertEqual(results, [expected] * 3)
+
+            results = []
+            async for result in iter_convert_async(Format.QOBJ, self.abspath("files/qobj_bell.json"), Format.PYQUIL, options):
+                results.append(result)
+            self.assertEqual(results, [expected[1]])
+
+            # cancelled between experiments
+            converted = []
+
+            async def consume():
+                async for result in converter.iter_convert(Format.QOBJ, qobj, Format.PYQUIL, options):
+                    converted.append(result)
+                    await asyncio.sleep(10)
+
+            task = asyncio.ensure_future(consume())
+            while len(converted) == 0:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(converted, expected[:1])
+
+            # semaphore released
+            self.assertEqual(await converter.convert(Format.QOBJ, qobj, Format.PYQUIL), expected[0])
+
+            # cancelled while experiment is read from file: read is finished before the stream is closed
+            class SlowFile(io.BytesIO):
+                def read(self, size=-1):
+                    time.sleep(0.2)
+                    return super().read(size)
+
+            source = SlowFile(json.dumps(self.bell_dict).encode("utf-8"))
+            task = asyncio.ensure_future(converter.convert(Format.QOBJ, source, Format.PYQUIL))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+
+        # converter used from another loop, results of process jobs cached in this process
+        converter = AsyncConverter("process", max_workers=2, max_concurrency=1)
+        cache = ResultCache()
+        cache_options = {"all_experiments": True, "result_cache": cache}
+        for i in range(2):
+            self.assertEqual(asyncio.run(converter.convert(Format.QOBJ, qobj, Format.PYQUIL, cache_options)), expected)
+        self.assertEqual(cache.info()["hits"], 2)
+
+    def test_result_cache(self):
+        cache = ResultCache(maxsize=2)
+        options = {"all_experiments": True, "result_cache": cache}
+
+        expected = convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, {"all_experiments": True})
+        self.assertEqual(convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, options), expected)
+        self.assertEqual(cache.info()["misses"], 1)
+        self.assertEqual(convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, options), expected)
+        self.assertEqual(cache.info()["hits"], 1)
+
+        # different format and different options are different entries
+        convert(Format.QOBJ, self.bell_dict, Format.TOASTER, options)
+        convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, dict(options, shots=10))
+        self.assertEqual(cache.info()["misses"], 3)
+        self.assertEqual(cache.info()["size"], 2)
+        self.assertEqual(cache.info()["evictions"], 1)
+
+        # output_stream is not cached
+        stream = io.StringIO()
+        convert(Format.QOBJ, self.bell_dict, Format.PYQUIL, {"output_stream": stream, "result_cache": cache})
+        self.assertEqual(stream.getvalue(), expected[0])
+        self.assertEqual(cache.info()["misses"], 3)
+
+    def test_result_cache_disk(self):
+        import tempfile
+
+        expected = convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=directory)
+            convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"result_cache": cache})
+
+            # new process: empty memory, same directory
+            cache = ResultCache(directory=directory)
+            self.assertEqual(convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"result_cache": cache}), expected)
+            self.assertEqual(cache.info()["disk_hits"], 1)
+
+            # disk limit: older entries are removed
+            cache = ResultCache(directory=directory, max_disk_bytes=len(expected) * 2)
+            for shots in range(4):
+                convert(Format.QOBJ, self.qaoa_dict, Format.TOASTER, {"result_cache": cache, "shots": shots})
+            self.assertGreater(cache.info()["disk_evictions"], 0)
+            self.assertLessEqual(sum(size for path, size, mtime in cache.disk_entries()), len(expected) * 2)
+
+            cache.clear(disk=True)
+            self.assertEqual(cache.disk_entries(), [])
+
 
 if __name__ == "__main__":
     unittest.main()